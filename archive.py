@@ -0,0 +1,89 @@
+"""Перенос прошедших резервов в архив.
+
+Резервы с временем визита раньше начала текущего дня переносятся
+из reservations в reservations_archive пачками по ARCHIVE_BATCH_SIZE,
+каждая пачка - отдельной записью в очереди потока записи БД
+(database.DBWriter), чтобы не задерживать надолго сохранение резервов
+персоналом. Так выборки будущих резервов (сегодня, все, по дате)
+идут по маленькой таблице, сколько бы истории ни накопилось.
+
+У каждого заведения свой архив в его БД. Бот запускает перенос
+для всех заведений при старте и каждый день в ARCHIVE_TIME.
+Из командной строки:
+    python archive.py
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from telegram.ext import CallbackContext, JobQueue
+
+import settings
+from database import get_write_connection, run_in_db_thread, venues, write
+from reservations import (ARCHIVE_TABLE, HOT_TABLE, archive_cutoff,
+                          move_reservations)
+
+
+def archive_batch(before: str, limit: int, venue: str) -> int:
+    """Функция переносит в архив заведения до limit самых старых резервов
+    с временем визита раньше before и возвращает их количество"""
+    return move_reservations(
+        get_write_connection(venue),
+        HOT_TABLE,
+        ARCHIVE_TABLE,
+        """id IN (
+            SELECT id FROM reservations
+            WHERE date_time < :before
+            ORDER BY date_time, id
+            LIMIT :limit
+        )""",
+        {'before': before, 'limit': limit}
+    )
+
+
+def archive_reservations(
+    before: Optional[str] = None,
+    batch_size: int = settings.ARCHIVE_BATCH_SIZE,
+    venue: str = settings.DEFAULT_VENUE,
+) -> int:
+    """Функция переносит в архив заведения резервы с временем визита
+    раньше before (по умолчанию - начала текущего дня)
+    и возвращает их количество"""
+    if before is None:
+        before = archive_cutoff()
+    archived = 0
+    while True:
+        moved = write(venue, archive_batch, before, batch_size, venue)
+        if not moved:
+            return archived
+        archived += moved
+
+
+async def archive_job(context: CallbackContext):
+    for venue in venues():
+        archived = await run_in_db_thread(archive_reservations, venue=venue)
+        logging.info(f'Reservations archived in {venue}: {archived}')
+
+
+def schedule_archival(job_queue: JobQueue):
+    """Ставит перенос в архив сразу (если бот был выключен ночью)
+    и ежедневно в ARCHIVE_TIME по местному времени"""
+    now = datetime.now()
+    next_run = datetime.combine(now.date(), settings.ARCHIVE_TIME)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    job_queue.run_once(archive_job, 0, name='archive')
+    # время передается интервалом: у JobQueue свой часовой пояс
+    job_queue.run_repeating(
+        archive_job,
+        interval=timedelta(days=1),
+        first=(next_run - now).total_seconds(),
+        name='archive',
+    )
+
+
+if __name__ == '__main__':
+    from migrations import migrate_venues
+    migrate_venues()
+    for venue in venues():
+        print(f'Archived in {venue}: {archive_reservations(venue=venue)}')
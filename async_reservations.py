@@ -0,0 +1,134 @@
+"""Асинхронные версии функций reservations.py, import_export.py и stats.py.
+Чтение выполняется в пуле потоков database.DB_EXECUTOR, запись - в потоке
+записи БД (database.DBWriter), который фиксирует одновременные записи
+одной транзакцией; вызвавший ждет фиксации той, в которую попала его запись.
+Поэтому обработчики бота не блокируют цикл событий на время работы с БД.
+Функции резервов принимают заведение первым аргументом: запрос идет
+в БД этого заведения (см. database.venue_db_path).
+Добавление, изменение, удаление и импорт резервов
+обновляют напоминания о визитах (reminders.REMINDERS)"""
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import import_export
+import reservations
+import stats
+from database import run_in_db_thread, run_in_db_writer
+from reminders import REMINDERS
+from reservations import Reservation, ReservationsPage
+
+
+async def add_reservation(venue: str, reservation: Reservation):
+    """Записывает резерв в базу данных"""
+    await run_in_db_writer(venue, reservations.add_reservation, reservation, venue=venue)
+    REMINDERS[venue].update(reservation)
+
+
+async def get_reservation(venue: str, reservation_id: int) -> Optional[Reservation]:
+    """Выводит резерв по его id"""
+    return await run_in_db_thread(
+        reservations.get_reservation, reservation_id, venue=venue
+    )
+
+
+async def delete_reservation(venue: str, reservation: Reservation):
+    """Удаляет резерв из базы данных"""
+    await run_in_db_writer(venue, reservations.delete_reservation, reservation, venue=venue)
+    REMINDERS[venue].discard(reservation.id)
+
+
+async def edit_reservation(venue: str, reservation: Reservation):
+    """Изменяет резерв в базе данных"""
+    await run_in_db_writer(venue, reservations.edit_reservation, reservation, venue=venue)
+    REMINDERS[venue].update(reservation)
+
+
+async def show_reservations_all(
+    venue: str,
+    page_cursor: Optional[Tuple[datetime, int]] = None,
+    backwards: bool = False,
+) -> ReservationsPage:
+    """Выводит страницу БУДУЩИХ резервов"""
+    return await run_in_db_thread(
+        reservations.show_reservations_all, page_cursor, backwards, venue=venue
+    )
+
+
+async def show_reservations_archive(
+    venue: str,
+    page_cursor: Optional[Tuple[datetime, int]] = None,
+    backwards: bool = False,
+) -> ReservationsPage:
+    """Выводит страницу ПРОШЕДШИХ резервов"""
+    return await run_in_db_thread(
+        reservations.show_reservations_archive, page_cursor, backwards, venue=venue
+    )
+
+
+async def show_reservations_today(venue: str) -> List[Reservation]:
+    """Выводит резервы на текущий день"""
+    return await run_in_db_thread(reservations.show_reservations_today, venue=venue)
+
+
+async def show_reservations_per_date(
+    venue: str, passed_date: datetime
+) -> List[Reservation]:
+    """Выводит резервы на переданную дату"""
+    return await run_in_db_thread(
+        reservations.show_reservations_per_date, passed_date, venue=venue
+    )
+
+
+async def search_reservations(venue: str, text: str) -> List[Reservation]:
+    """Ищет резервы по имени гостя и деталям"""
+    return await run_in_db_thread(
+        reservations.search_reservations, text, venue=venue
+    )
+
+
+async def import_reservations(venue: str, path: str) -> import_export.ImportResult:
+    """Импортирует резервы из CSV или JSONL файла"""
+    try:
+        return await run_in_db_thread(
+            import_export.import_reservations, path, venue=venue
+        )
+    finally:
+        # новые резервы могли попасть в любые дни
+        await REMINDERS[venue].reload()
+
+
+async def export_reservations(venue: str, path: str) -> int:
+    """Выгружает все резервы в CSV или JSONL файл"""
+    return await run_in_db_thread(
+        import_export.export_reservations, path, venue=venue
+    )
+
+
+async def stats_for_last_days(venue: str, days: int) -> stats.StatsReport:
+    """Собирает статистику резервов за последние дни"""
+    return await run_in_db_thread(stats.stats_for_last_days, days, venue=venue)
+
+
+async def rebuild_daily_stats(venue: str):
+    """Пересчитывает статистику резервов с нуля"""
+    return await run_in_db_writer(venue, stats.rebuild_daily_stats, venue=venue)
+
+
+async def add_chat_id(chat_id: int, venue: str):
+    """Записывает id чата в базу данных"""
+    return await run_in_db_writer(None, reservations.add_chat_id, chat_id, venue=venue)
+
+
+async def set_chat_venue(chat_id: int, venue: str):
+    """Записывает заведение, с которым работает чат"""
+    return await run_in_db_writer(None, reservations.set_chat_venue, chat_id, venue)
+
+
+async def delete_chat_id(chat_id: int):
+    """Удаляет id чата из базы данных"""
+    return await run_in_db_writer(None, reservations.delete_chat_id, chat_id)
+
+
+async def get_chats() -> List[Tuple[int, Optional[str]]]:
+    """Выводит ID всех чатов, с которыми общается бот, и их заведения"""
+    return await run_in_db_thread(reservations.get_chats)
@@ -0,0 +1,125 @@
+"""Сравнение старого и нового способов превращать строки БД в Reservation.
+
+Старый: sqlite3.Row -> dict -> dataclass с datetime.strptime на каждую строку.
+Новый: row_factory создает Reservation со __slots__ прямо из кортежа,
+время визита разбирается лениво.
+
+Запуск из корня репозитория:
+    python -m benchmarks.reservation_rows [количество строк]
+"""
+import sqlite3
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+import settings
+from reservations import RESERVATION_COLUMNS, reservation_row_factory
+
+
+@dataclass
+class LegacyReservation:
+    """Reservation в том виде, в каком он был до перехода на __slots__"""
+    id: int = None
+    guest_name: str = None
+    date_time: datetime = None
+    info: str = None
+    user_added: str = None
+    visited: int = 0
+
+
+def legacy_parse(rows):
+    reservations = []
+    for line in rows:
+        parsed_line = dict(line)
+        reservations.append(
+            LegacyReservation(
+                id=parsed_line['id'],
+                guest_name=parsed_line['guest_name'],
+                date_time=datetime.strptime(
+                    parsed_line['date_time'], settings.DATETIME_DB_FORMAT
+                ),
+                info=parsed_line['info'],
+                user_added=parsed_line['user_added'],
+                visited=parsed_line['visited'],
+            )
+        )
+    return reservations
+
+
+def build_db(rows_count: int) -> sqlite3.Connection:
+    connection = sqlite3.connect(':memory:')
+    connection.execute(
+        """CREATE TABLE reservations (
+            id integer PRIMARY KEY,
+            guest_name text,
+            date_time datetime,
+            info text,
+            user_added text,
+            visited integer
+        )"""
+    )
+    start = datetime(2020, 1, 1, 12, 0)
+    connection.executemany(
+        'INSERT INTO reservations VALUES (?, ?, ?, ?, ?, ?)',
+        (
+            (
+                i,
+                f'Гость {i}',
+                (start + timedelta(minutes=30 * i)).strftime(
+                    settings.DATETIME_DB_FORMAT
+                ),
+                'Стол 3, 4 гостя, день рождения',
+                '@staff',
+                i % 2,
+            )
+            for i in range(1, rows_count + 1)
+        )
+    )
+    return connection
+
+
+def legacy_path(connection):
+    cursor = connection.cursor()
+    cursor.row_factory = sqlite3.Row
+    rows = cursor.execute(f'SELECT {RESERVATION_COLUMNS} FROM reservations')
+    return legacy_parse(rows.fetchall())
+
+
+def compact_path(connection):
+    cursor = connection.cursor()
+    cursor.row_factory = reservation_row_factory
+    return cursor.execute(
+        f'SELECT {RESERVATION_COLUMNS} FROM reservations'
+    ).fetchall()
+
+
+def measure(name, func, connection):
+    # время и память меряются отдельными прогонами:
+    # tracemalloc сильно замедляет выделение объектов
+    started_at = time.perf_counter()
+    rows_count = len(func(connection))
+    elapsed = time.perf_counter() - started_at
+
+    tracemalloc.start()
+    reservations = func(connection)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del reservations
+    print(
+        f'{name:<8} {rows_count:>8} rows  {elapsed:8.3f} s  '
+        f'{rows_count / elapsed:>10.0f} rows/s  '
+        f'retained {retained / 2 ** 20:7.1f} MiB  peak {peak / 2 ** 20:7.1f} MiB'
+    )
+
+
+def main():
+    rows_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    connection = build_db(rows_count)
+    measure('legacy', legacy_path, connection)
+    measure('compact', compact_path, connection)
+
+
+if __name__ == '__main__':
+    main()
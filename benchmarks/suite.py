@@ -0,0 +1,431 @@
+"""Набор бенчмарков слоя данных и отрисовки сообщений.
+
+Строит синтетические reservations.db нужных размеров, замеряет функции
+show_reservations_*, search_reservations, stats_report, скорость add_reservation / edit_reservation
+(по одной и одновременными записями через поток записи БД),
+parse_db_to_reservation_class и все методы Reservation.reserve_*.
+Результаты пишутся в JSON; с --compare сравниваются с сохраненным
+прогоном по лучшему времени, и замедление больше порога считается
+регрессией. Порог - не меньше --threshold и не меньше утроенного
+разброса замеров, а замедлившиеся размеры БД перемериваются
+(--confirm раз) с лучшим результатом из всех прогонов: так шум
+не выдается за регрессию.
+
+Запуск из корня репозитория (БД на миллион строк строится около
+минуты, но сохраняется в --db-dir и переиспользуется):
+    python -m benchmarks.suite --output bench.json
+    python -m benchmarks.suite --compare bench.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import settings
+from database import close_connection, get_connection, get_writer, write
+from day_cache import DAY_CACHE
+from migrations import migrate
+from reservations import (ARCHIVE_TABLE, HOT_TABLE, RENDER_CACHE,
+                          RESERVATION_COLUMNS, Reservation, add_reservation,
+                          archive_cutoff, delete_reservation,
+                          edit_reservation, move_reservations,
+                          parse_db_to_reservation_class,
+                          search_reservations, show_reservations_all, show_reservations_archive,
+                          show_reservations_per_date, show_reservations_today)
+from stats import stats_report
+
+DEFAULT_SIZES = '1000,100000,1000000'
+# доля строк, приходящихся на прошлое: остальное - будущие резервы
+PAST_SHARE = 0.8
+WRITE_OPERATIONS = 200
+# сколько раз повторяется замер записей, в результат идет лучший
+WRITE_REPEAT = 5
+# быстрые функции вызываются в одном замере несколько раз, чтобы замер
+# длился не меньше MIN_SAMPLE_S: иначе точность таймера и переключения
+# потоков дают больше разброса, чем сама функция
+MIN_SAMPLE_S = 0.02
+# порог регрессии - не меньше стольких разбросов замеров
+NOISE_FACTOR = 3
+RENDER_SAMPLE = 1000
+
+
+def build_db(path: str, rows_count: int):
+    """Создает БД с rows_count резервами, равномерно распределенными
+    по времени так, чтобы на сегодня и на каждый день были резервы"""
+    if os.path.exists(path):
+        os.remove(path)
+    migrate(path)
+    connection = sqlite3.connect(path)
+    rng = random.Random(rows_count)
+    # по ~20 резервов на день
+    days = max(rows_count // 20, 2)
+    first_day = datetime.combine(date.today(), datetime.min.time()) - timedelta(
+        days=int(days * PAST_SHARE)
+    )
+    with connection:
+        connection.executemany(
+            """INSERT INTO reservations
+               (guest_name, date_time, info, user_added, visited)
+               VALUES (?, ?, ?, ?, ?)""",
+            (
+                (
+                    f'Гость {i}',
+                    (
+                        first_day
+                        + timedelta(days=i % days, hours=10 + rng.randrange(12),
+                                    minutes=rng.choice((0, 15, 30, 45)))
+                    ).strftime(settings.DATETIME_DB_FORMAT),
+                    f'Стол {rng.randrange(1, 20)}, гостей: {rng.randrange(1, 9)}',
+                    '@staff',
+                    rng.randrange(2),
+                )
+                for i in range(rows_count)
+            )
+        )
+        # прошедшие резервы - в архиве, как после ночной задачи archive.py
+        move_reservations(
+            connection, HOT_TABLE, ARCHIVE_TABLE, 'date_time < :before',
+            {'before': archive_cutoff()}
+        )
+    connection.close()
+
+
+def prepare_db(db_dir: str, rows_count: int) -> str:
+    """Возвращает путь к БД нужного размера, создавая её при необходимости"""
+    path = os.path.join(db_dir, f'reservations_{rows_count}.db')
+    if os.path.exists(path):
+        # БД могла быть создана до новых миграций
+        migrate(path)
+        connection = sqlite3.connect(path)
+        existing = connection.execute(
+            'SELECT count(*) FROM all_reservations'
+        ).fetchone()[0]
+        connection.close()
+        if existing == rows_count:
+            return path
+    build_db(path, rows_count)
+    return path
+
+
+def working_copy(path: str) -> str:
+    """Копирует подготовленную БД в рабочий файл прогона. Замеры записей
+    меняют БД (свободные страницы, сегменты FTS), и без копии каждый
+    следующий прогон мерил бы уже другую БД"""
+    copy_path = path[:-len('.db')] + '_run.db'
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(copy_path + suffix):
+            os.remove(copy_path + suffix)
+    source = sqlite3.connect(path)
+    target = sqlite3.connect(copy_path)
+    source.backup(target)
+    target.close()
+    source.close()
+    return copy_path
+
+
+def timeit(func, repeat: int) -> dict:
+    """Делает repeat замеров func и возвращает статистику времени
+    одного вызова в секундах. Первый вызов прогревает кэши и определяет,
+    сколько раз (number) вызывать func в замере, чтобы он длился
+    не меньше MIN_SAMPLE_S. spread - насколько медиана хуже лучшего"""
+    started_at = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started_at
+    number = max(1, math.ceil(MIN_SAMPLE_S / max(elapsed, 1e-7)))
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - started_at) / number)
+    best = min(timings)
+    median = statistics.median(timings)
+    return {
+        'median_s': median,
+        'min_s': best,
+        'spread': median / best - 1,
+        'runs': repeat,
+        'number': number,
+    }
+
+
+def throughput(timings: list, operations: int) -> dict:
+    """Статистика скорости записей по временам повторов одного замера"""
+    best = min(timings)
+    median = statistics.median(timings)
+    return {
+        'ops_per_s': operations / best,
+        'median_ops_per_s': operations / median,
+        'spread': median / best - 1,
+        'runs': len(timings),
+        'operations': operations,
+    }
+
+
+def cold(func):
+    """Оборачивает func так, чтобы перед каждым вызовом сбрасывались кэши"""
+    def wrapper():
+        DAY_CACHE.clear()
+        RENDER_CACHE.clear()
+        return func()
+    return wrapper
+
+
+def bench_queries(repeat: int) -> dict:
+    today = date.today()
+    last_page = show_reservations_all().reservations
+    cursor = (last_page[-1].date_time, last_page[-1].id)
+    return {
+        'show_reservations_today': timeit(cold(show_reservations_today), repeat),
+        'show_reservations_today_cached': timeit(show_reservations_today, repeat),
+        'show_reservations_per_date': timeit(
+            cold(lambda: show_reservations_per_date(today + timedelta(days=3))),
+            repeat
+        ),
+        'show_reservations_all': timeit(cold(show_reservations_all), repeat),
+        'show_reservations_all_next_page': timeit(
+            cold(lambda: show_reservations_all(cursor)), repeat
+        ),
+        'show_reservations_archive': timeit(
+            cold(show_reservations_archive), repeat
+        ),
+        'search_reservations': timeit(
+            lambda: search_reservations('Стол 7'), repeat
+        ),
+        'search_reservations_rare': timeit(
+            lambda: search_reservations(f'Гость {len(last_page) * 7}'), repeat
+        ),
+        'stats_report_year': timeit(
+            lambda: stats_report(date.today() - timedelta(days=365), date.today()),
+            repeat
+        ),
+    }
+
+
+def bench_writes() -> dict:
+    timings = {
+        'add_reservation': [],
+        'edit_reservation': [],
+        'edit_reservation_concurrent': [],
+    }
+    for _ in range(WRITE_REPEAT):
+        for name, elapsed in time_writes().items():
+            timings[name].append(elapsed)
+    return {
+        name: throughput(elapsed, WRITE_OPERATIONS)
+        for name, elapsed in timings.items()
+    }
+
+
+def time_writes() -> dict:
+    """Один замер записей: WRITE_OPERATIONS добавлений, правок по одной
+    и одновременных правок. Возвращает время каждого вида в секундах"""
+    visit_time = datetime.combine(
+        date.today() + timedelta(days=1), datetime.min.time()
+    ) + timedelta(hours=18)
+    reservations = [
+        Reservation(
+            guest_name=f'Бенчмарк {i}',
+            date_time=visit_time,
+            info='Стол 1',
+            user_added='@bench',
+        )
+        for i in range(WRITE_OPERATIONS)
+    ]
+    venue = settings.DEFAULT_VENUE
+    started_at = time.perf_counter()
+    for reservation in reservations:
+        write(venue, add_reservation, reservation)
+    add_elapsed = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    for reservation in reservations:
+        reservation.visited_on_off()
+        write(venue, edit_reservation, reservation)
+    edit_elapsed = time.perf_counter() - started_at
+
+    # все правки сразу, как при одновременном сохранении персоналом:
+    # поток записи фиксирует их пачками
+    started_at = time.perf_counter()
+    futures = [
+        get_writer(venue).submit(edit_reservation, reservation)
+        for reservation in reservations
+    ]
+    for future in futures:
+        future.result()
+    concurrent_elapsed = time.perf_counter() - started_at
+
+    for reservation in reservations:
+        write(venue, delete_reservation, reservation)
+    return {
+        'add_reservation': add_elapsed,
+        'edit_reservation': edit_elapsed,
+        'edit_reservation_concurrent': concurrent_elapsed,
+    }
+
+
+def bench_parsing(repeat: int) -> dict:
+    rows = get_connection().execute(
+        f'SELECT {RESERVATION_COLUMNS} FROM all_reservations LIMIT {RENDER_SAMPLE}'
+    ).fetchall()
+    return {
+        'parse_db_to_reservation_class': timeit(
+            lambda: parse_db_to_reservation_class(rows), repeat
+        ),
+    }
+
+
+def bench_rendering(repeat: int) -> dict:
+    reservations = parse_db_to_reservation_class(
+        get_connection().execute(
+            f'SELECT {RESERVATION_COLUMNS} FROM all_reservations '
+            f'LIMIT {RENDER_SAMPLE}'
+        ).fetchall()
+    )
+    renderers = {
+        'reserve_preview': lambda r: r.reserve_preview(),
+        'reserve_card': lambda r: r.reserve_card(),
+        'reserve_line': lambda r: r.reserve_line(),
+        'reserve_line_emoji': lambda r: r.reserve_line(logs=False),
+        'reserve_copy_card': lambda r: r.reserve_copy_card(),
+    }
+    results = {}
+    for name, render in renderers.items():
+        def render_all():
+            for reservation in reservations:
+                render(reservation)
+        results[name] = timeit(cold(render_all), repeat)
+        results[name + '_cached'] = timeit(render_all, repeat)
+    return results
+
+
+def run(sizes, db_dir: str, repeat: int) -> dict:
+    results = {}
+    for rows_count in sizes:
+        settings.DB_PATH = working_copy(prepare_db(db_dir, rows_count))
+        close_connection()
+        DAY_CACHE.clear()
+        RENDER_CACHE.clear()
+        size_results = {}
+        size_results.update(bench_queries(repeat))
+        size_results.update(bench_writes())
+        size_results.update(bench_parsing(repeat))
+        size_results.update(bench_rendering(repeat))
+        results[str(rows_count)] = size_results
+        print(f'{rows_count} rows: done', file=sys.stderr)
+    close_connection()
+    return {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'repeat': repeat,
+            'write_repeat': WRITE_REPEAT,
+        },
+        'results': results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """Сравнивает результаты с базовыми по лучшему замеру. Регрессия -
+    лучшее время выросло (или лучшее число операций в секунду упало)
+    больше допустимого: threshold или NOISE_FACTOR разбросов замеров
+    (большего из двух прогонов), смотря что больше"""
+    regressions = []
+    for size, benchmarks in current['results'].items():
+        for name, result in benchmarks.items():
+            base = baseline['results'].get(size, {}).get(name)
+            if base is None:
+                continue
+            if 'min_s' in result:
+                change = result['min_s'] / base['min_s'] - 1
+            else:
+                change = base['ops_per_s'] / result['ops_per_s'] - 1
+            allowed = max(
+                threshold,
+                NOISE_FACTOR * max(result.get('spread', 0), base.get('spread', 0)),
+            )
+            if change > allowed:
+                regressions.append({
+                    'size': size,
+                    'benchmark': name,
+                    'slowdown': change,
+                    'allowed': allowed,
+                })
+    return regressions
+
+
+def merge_best(results: dict, rerun: dict):
+    """Оставляет в results для каждого бенчмарка лучший результат
+    из двух прогонов"""
+    for size, benchmarks in rerun['results'].items():
+        kept = results['results'][size]
+        for name, result in benchmarks.items():
+            if 'min_s' in result:
+                better = result['min_s'] < kept[name]['min_s']
+            else:
+                better = result['ops_per_s'] > kept[name]['ops_per_s']
+            if better:
+                kept[name] = result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--sizes', default=DEFAULT_SIZES,
+        help='размеры БД через запятую, например 1000,100000,1000000'
+    )
+    parser.add_argument(
+        '--db-dir', default=os.path.join(tempfile.gettempdir(), 'reservations_bench'),
+        help='папка для синтетических БД (переиспользуются между запусками)'
+    )
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', help='куда записать результаты в JSON')
+    parser.add_argument('--compare', help='JSON с базовыми результатами')
+    parser.add_argument(
+        '--threshold', type=float, default=0.1,
+        help='наименьшее допустимое замедление относительно базы (0.1 = 10%%);'
+             ' для шумных замеров порог больше, см. NOISE_FACTOR'
+    )
+    parser.add_argument(
+        '--confirm', type=int, default=2,
+        help='сколько раз перемерить размеры БД с регрессиями, прежде чем их сообщить'
+    )
+    args = parser.parse_args()
+
+    os.makedirs(args.db_dir, exist_ok=True)
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = run(sizes, args.db_dir, args.repeat)
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.threshold)
+        for _ in range(args.confirm):
+            if not regressions:
+                break
+            rerun_sizes = sorted({int(regression['size']) for regression in regressions})
+            merge_best(results, run(rerun_sizes, args.db_dir, args.repeat))
+            regressions = compare(results, baseline, args.threshold)
+        results['regressions'] = regressions
+        exit_code = 1 if regressions else 0
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            output_file.write(output)
+    print(output)
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
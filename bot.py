@@ -1,49 +1,89 @@
 import logging
+import os
+import tempfile
 import textwrap
-from typing import List
+from datetime import date, datetime
+from functools import partial
+from typing import Awaitable, List, Optional, Tuple
 
 from telegram import (InlineKeyboardButton, InlineKeyboardMarkup,
-                      ReplyKeyboardMarkup, ReplyKeyboardRemove, Update, error)
-from telegram.ext import (ApplicationBuilder, CallbackQueryHandler,
-                          CommandHandler, ContextTypes, ConversationHandler,
-                          MessageHandler, filters)
+                      ReplyKeyboardMarkup, ReplyKeyboardRemove, Update)
+from telegram.ext import (Application, ApplicationBuilder,
+                          CallbackQueryHandler, CommandHandler, ContextTypes,
+                          ConversationHandler, MessageHandler, filters)
 
+import bot_server
 import settings
-from reservations import (Reservation, add_chat_id, add_reservation,
-                          delete_reservation, edit_reservation,
-                          get_chat_id_list, show_reservations_all,
-                          show_reservations_archive,
-                          show_reservations_per_date, show_reservations_today)
+from archive import schedule_archival
+from async_reservations import (add_reservation, delete_reservation,
+                                edit_reservation, export_reservations,
+                                get_reservation, import_reservations,
+                                rebuild_daily_stats,
+                                show_reservations_all,
+                                show_reservations_archive,
+                                search_reservations,
+                                show_reservations_per_date,
+                                show_reservations_today,
+                                stats_for_last_days)
+from broadcast import BROADCASTER
+from chat_registry import CHAT_REGISTRY
+from database import venues
+from day_cache import DAY_CACHE
+from diag import CAPTURES, DIAGNOSTICS, DiagnosticsBusyException
+from import_export import FORMATS, file_format
+from logs import setup_logging
+from metrics import MeteredHTTPXRequest, instrument_handlers
+from migrations import migrate_venues
+from outbound import OUTBOUND
+from persistence import SQLitePersistence
+from reminders import NO_SHOW, REMINDERS
+from reservations import Reservation, ReservationsPage
 from validators import InvalidDatetimeException
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()
-    ]
-)
-
 # states for /addreserve conversation
 GUEST_NAME, DATE_TIME, MORE_INFO, CHOICE, CANCEL, END = range(6)
 # states for edit conversation
 EDIT_NAME, EDIT_DATETIME, EDIT_INFO = range(3)
 # state for reserves_per_date conversation
 ENTER_THE_DATE = 1
-
-# клавиатура для карточек резервов
-RESERVE_CARD_KEYBOARD = [
-        [InlineKeyboardButton('Гости пришли', callback_data='visited')],
-        [
-            InlineKeyboardButton(
-                'Удалить бронь', callback_data='delete_reservation'
-            ),
-            InlineKeyboardButton(
-                'Изменить бронь', callback_data='edit_reservation'
-            ),
-        ],
-        [InlineKeyboardButton('Для копирования', callback_data='copy_format')]
+# state for search conversation
+ENTER_SEARCH_QUERY = 1
+
+# выдачи, которые выводятся постранично: ключ используется в callback_data
+PAGED_VIEWS = {
+    'all': show_reservations_all,
+    'archive': show_reservations_archive,
+}
+
+# callback_data кнопок резервов: r:<заведение>:<id>:<действие>
+# (r:<id>:<действие> - кнопки, отправленные до появления заведений)
+CARD_CALLBACK_PATTERN = '^r:(?:[^:]+:)?[0-9]+:[a-z_]+$'
+# Кнопки, отправленные до перехода на r:<id>:<действие>: PTB заменял
+# их callback_data на uuid клавиатуры и кнопки (по 32 hex-символа),
+# а данные кнопки хранил в кэше (см. persistence.load_legacy_buttons)
+LEGACY_CARD_CALLBACK_PATTERN = '^[0-9a-f]{64}$'
+# данные старых кнопок карточек -> действие. id резерва в них нет,
+# он хранился в chat_data['msg_reservation']
+LEGACY_CARD_ACTIONS = {
+    'visited': 'visited',
+    'delete_reservation': 'delete',
+    'edit_reservation': 'edit',
+    'copy_format': 'copy',
+    'edit_name': 'edit_name',
+    'edit_datetime': 'edit_datetime',
+    'edit_info': 'edit_info',
+}
+# кнопки под карточкой резерва: (текст, действие в callback_data)
+RESERVE_CARD_BUTTONS = [
+        [('Гости пришли', 'visited')],
+        [('Удалить бронь', 'delete'), ('Изменить бронь', 'edit')],
+        [('Для копирования', 'copy')],
+    ]
+# кнопки выбора изменяемого поля резерва
+RESERVE_EDIT_BUTTONS = [
+        [('Имя', 'edit_name')],
+        [('Дата / Время', 'edit_datetime')],
+        [('Детали', 'edit_info')],
     ]
 
 
@@ -60,6 +100,7 @@ BASE_KEYBOARD = ReplyKeyboardMarkup(
             settings.RESERVES_PER_DATE_BUTTON
         ],
         [
+            settings.SEARCH_BUTTON,
             settings.HELP_BUTTON
         ]
     ],
@@ -82,29 +123,35 @@ async def send_message(
     )
 
 
-async def notify_all_users(
+def chat_venue(update: Update) -> str:
+    """Шорткат для заведения, с которым работает текущий чат"""
+    return CHAT_REGISTRY.venue_of(update.effective_chat.id)
+
+
+def notify_all_users(
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
+    venue: str,
     msg_text: str
 ):
-    """Функция отправляет всем пользователям бота
-    сообщение с переданной информацией"""
-    for chat_id in get_chat_id_list():
-        if chat_id == update.effective_chat.id:
-            pass
-        else:
-            try:
-                await context.bot.send_message(
-                    chat_id=chat_id,
-                    text=msg_text,
-                    reply_markup=None,
-                    parse_mode='HTML'
-                )
-            except error.TelegramError as er:
-                logging.info(f'\nError when notifying:\n{er}')
-    await send_message(update, context,
-                       settings.NOTIFY_ALL_CONFIRMATION,
-                       reply_markup=None)
+    """Функция отправляет всем пользователям бота из заведения venue
+    сообщение с переданной информацией.
+    Рассылка идет в фоне, подтверждение (notify_confirmation)
+    вызывающий отправляет вместе с остальными сообщениями ответа"""
+    chat_ids = [
+        chat_id for chat_id in CHAT_REGISTRY.chats_of(venue)
+        if chat_id != update.effective_chat.id
+    ]
+    context.application.create_task(
+        BROADCASTER.broadcast(context.bot, chat_ids, msg_text)
+    )
+
+
+def notify_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Шорткат для подтверждения, что оповещение отправлено"""
+    return send_message(update, context,
+                        settings.NOTIFY_ALL_CONFIRMATION,
+                        reply_markup=None)
 
 
 async def helloworld(
@@ -115,15 +162,230 @@ async def helloworld(
     сообщение написанное после команды /helloworld.
     Работает только для пользователя-администратора"""
     if update.effective_user.id == settings.ADMIN_TG_ID:
-        for chat_id in get_chat_id_list():
-            try:
-                await context.bot.send_message(
-                    chat_id=chat_id,
-                    text=update.message.text.split('/helloworld')[1],
-                    reply_markup=None
+        context.application.create_task(
+            BROADCASTER.broadcast(
+                context.bot,
+                list(CHAT_REGISTRY),
+                update.message.text.split('/helloworld')[1],
+                parse_mode=None,
+            )
+        )
+
+
+async def cachestats(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+):
+    """Функция выводит счетчики кэша резервов по дням.
+    Работает только для пользователя-администратора"""
+    if update.effective_user.id == settings.ADMIN_TG_ID:
+        stats = DAY_CACHE.stats()
+        await send_message(
+            update,
+            context,
+            'Кэш резервов: {hits} попаданий, {misses} промахов, '
+            '{size} дней в кэше'.format(**stats),
+            reply_markup=None
+        )
+
+
+async def export_command(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+):
+    """Функция выгружает все резервы заведения чата в файл
+    (/export csv или /export jsonl) и отправляет его документом. Файл пишется потоково во временную папку.
+    Работает только для пользователя-администратора"""
+    if update.effective_user.id == settings.ADMIN_TG_ID:
+        fmt = context.args[0].lower() if context.args else 'csv'
+        if fmt not in FORMATS:
+            await send_message(update, context, settings.EXPORT_USAGE)
+            return
+        venue = chat_venue(update)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(
+                directory,
+                'reservations_{}_{}.{}'.format(venue, date.today().strftime('%Y%m%d'), fmt)
+            )
+            count = await export_reservations(venue, path)
+            with open(path, 'rb') as file:
+                await context.bot.send_document(
+                    chat_id=update.effective_chat.id,
+                    document=file,
+                    caption=settings.EXPORT_CAPTION.format(count),
                 )
-            except error.TelegramError as er:
-                logging.info(f'\nError when notifying:\n{er}')
+
+
+async def import_document(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+):
+    """Функция импортирует резервы из CSV или JSONL файла,
+    отправленного с подписью /import, в заведение чата и выводит итог.
+    Работает только для пользователя-администратора"""
+    if update.effective_user.id == settings.ADMIN_TG_ID:
+        file_name = update.message.document.file_name or ''
+        try:
+            file_format(file_name)
+        except ValueError:
+            await send_message(update, context, settings.IMPORT_WRONG_FORMAT)
+            return
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, os.path.basename(file_name))
+            document = await update.message.document.get_file()
+            await document.download_to_drive(path)
+            try:
+                result = await import_reservations(chat_venue(update), path)
+            except Exception:
+                # записи, вставленные до ошибки, остаются в БД
+                logging.exception(f'Import from {file_name} failed')
+                await send_message(update, context, settings.IMPORT_FAILED)
+                return
+        logging.info(f'Reservations imported from {file_name}: {result}')
+        await send_message(
+            update,
+            context,
+            '\n'.join([
+                settings.IMPORT_RESULT.format(
+                    imported=result.imported, skipped=result.skipped
+                ),
+                *(Reservation.parse_escape(error) for error in result.errors),
+            ]),
+            reply_markup=BASE_KEYBOARD,
+        )
+
+
+async def stats_command(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+):
+    """Функция выводит статистику резервов заведения чата
+    за последние дни (/stats 7). /stats rebuild пересчитывает статистику
+    с нуля и работает только для пользователя-администратора"""
+    venue = chat_venue(update)
+    argument = context.args[0].lower() if context.args else ''
+    if argument == 'rebuild':
+        if update.effective_user.id == settings.ADMIN_TG_ID:
+            await rebuild_daily_stats(venue)
+            await send_message(update, context, settings.STATS_REBUILT)
+        return
+    if not argument:
+        days = settings.STATS_DEFAULT_DAYS
+    elif argument.isdigit() and 1 <= int(argument) <= settings.STATS_MAX_DAYS:
+        days = int(argument)
+    else:
+        await send_message(
+            update, context, settings.STATS_USAGE, reply_markup=BASE_KEYBOARD
+        )
+        return
+    report = await stats_for_last_days(venue, days)
+    await send_message(
+        update, context, report.render(date.today()), reply_markup=BASE_KEYBOARD
+    )
+
+
+async def venue_command(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+):
+    """Функция выводит заведение, с которым работает чат.
+    Администратор может переключить на другое заведение текущий чат
+    (/venue park) или любой другой (/venue park 123456)"""
+    current = settings.VENUE_CURRENT.format(chat_venue(update))
+    if update.effective_user.id != settings.ADMIN_TG_ID:
+        await send_message(update, context, current)
+        return
+    if not context.args:
+        await send_message(
+            update,
+            context,
+            current + '\n' + settings.VENUE_USAGE.format(', '.join(venues())),
+        )
+        return
+    venue = context.args[0]
+    if venue not in venues():
+        await send_message(
+            update, context, settings.VENUE_UNKNOWN.format(', '.join(venues()))
+        )
+        return
+    chat_id = update.effective_chat.id
+    if len(context.args) > 1 and context.args[1].lstrip('-').isdigit():
+        chat_id = int(context.args[1])
+    await CHAT_REGISTRY.set_venue(chat_id, venue)
+    logging.info(f'Chat {chat_id} switched to venue {venue}')
+    await send_message(
+        update,
+        context,
+        settings.VENUE_CHANGED.format(chat_id=chat_id, venue=venue),
+        reply_markup=BASE_KEYBOARD,
+    )
+
+
+async def send_report(
+    context: ContextTypes.DEFAULT_TYPE,
+    chat_id: int,
+    name: str,
+    text: str,
+):
+    """Шорткат для отправки текстового отчета файлом"""
+    await context.bot.send_document(
+        chat_id=chat_id,
+        document=text.encode(),
+        filename='{}_{}.txt'.format(name, datetime.now().strftime('%Y%m%d_%H%M%S')),
+    )
+
+
+async def send_report_when_ready(
+    context: ContextTypes.DEFAULT_TYPE,
+    chat_id: int,
+    name: str,
+    report: Awaitable[str],
+):
+    """Функция дожидается отчета диагностики и отправляет его файлом"""
+    await send_report(context, chat_id, name, await report)
+
+
+async def diag_command(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+):
+    """Функция запускает диагностику бота (/diag profile 30, /diag mem...),
+    отчет приходит файлом. Сборы на время идут в фоне, чтобы не задерживать
+    обработку остальных апдейтов.
+    Работает только для пользователя-администратора"""
+    if update.effective_user.id != settings.ADMIN_TG_ID:
+        return
+    chat_id = update.effective_chat.id
+    action = context.args[0].lower() if context.args else ''
+    argument = context.args[1].lower() if len(context.args) > 1 else ''
+    if action == 'tasks':
+        await send_report(context, chat_id, action, DIAGNOSTICS.tasks())
+    elif action == 'mem' and argument == 'stop':
+        DIAGNOSTICS.memory_stop()
+        await send_message(update, context, settings.DIAG_MEMORY_STOPPED)
+    elif action == 'mem':
+        if DIAGNOSTICS.memory_start(context.application):
+            await send_message(update, context, settings.DIAG_MEMORY_STARTED)
+        else:
+            context.application.create_task(send_report_when_ready(
+                context, chat_id, action, DIAGNOSTICS.memory_report(context.application)
+            ))
+    elif action in CAPTURES and (
+        not argument
+        or argument.isdigit() and 1 <= int(argument) <= settings.DIAG_MAX_SECONDS
+    ):
+        seconds = int(argument) if argument else settings.DIAG_DEFAULT_SECONDS
+        try:
+            report = DIAGNOSTICS.capture(action, seconds)
+        except DiagnosticsBusyException as running:
+            await send_message(update, context, settings.DIAG_BUSY.format(running))
+            return
+        context.application.create_task(
+            send_report_when_ready(context, chat_id, action, report)
+        )
+        await send_message(update, context, settings.DIAG_STARTED.format(action, seconds))
+    else:
+        await send_message(update, context, settings.DIAG_USAGE)
 
 
 async def keyboard_off(update: Update):
@@ -133,139 +395,246 @@ async def keyboard_off(update: Update):
     )
 
 
-async def create_update_msg_reservation_link(
-    msg_id: int,
-    reservation: Reservation,
-    context: ContextTypes.DEFAULT_TYPE,
-):
-    """Шорткат для обновления связки сообщение-объект резерва или добавления новой"""
-    context.chat_data['msg_reservation'].update({msg_id: reservation})
+def card_callback_data(reservation: Reservation, action: str) -> str:
+    """Формирует callback_data кнопки действия с резервом:
+    r:<заведение>:<id>:<действие>. Резерв при нажатии читается
+    из БД заведения по id, поэтому кнопки не зависят от памяти бота
+    и работают после перезапуска"""
+    return 'r:{}:{}:{}'.format(reservation.venue, reservation.id, action)
 
 
-async def get_reservation_from_msg(
-    msg_id: int,
-    context: ContextTypes.DEFAULT_TYPE
-):
-    """Шорткат для получения объекта резерва по id сообщения"""
-    return context.chat_data['msg_reservation'][msg_id]
+def reservation_keyboard(
+    reservation: Reservation,
+    buttons: List[List[Tuple[str, str]]] = RESERVE_CARD_BUTTONS,
+) -> InlineKeyboardMarkup:
+    """Собирает клавиатуру с действиями над резервом"""
+    return InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton(text, callback_data=card_callback_data(reservation, action))
+            for text, action in row
+        ]
+        for row in buttons
+    ])
+
+
+def reservations_keyboard(
+    reservations: List[Reservation],
+    nav_row: List[InlineKeyboardButton] = None,
+) -> InlineKeyboardMarkup:
+    """Собирает клавиатуру-список с кнопкой на каждый резерв
+    и, если передан, рядом кнопок навигации по страницам"""
+    keyboard = []
+    for reservation in reservations:
+        keyboard.append([
+            InlineKeyboardButton(
+                reservation.reserve_line(logs=False),
+                callback_data=card_callback_data(reservation, 'show')
+            )
+        ])
+    if nav_row:
+        keyboard.append(nav_row)
+    return InlineKeyboardMarkup(keyboard)
+
+
+def page_nav_row(view: str, page: ReservationsPage) -> List[InlineKeyboardButton]:
+    """Кнопки Назад / Вперед для страницы резервов.
+    В callback_data кладется курсор (время визита и id) крайнего резерва"""
+    nav_row = []
+    if page.has_previous:
+        nav_row.append(InlineKeyboardButton(
+            '◀️ Назад',
+            callback_data=page_callback_data(view, 'prev', page.reservations[0])
+        ))
+    if page.has_next:
+        nav_row.append(InlineKeyboardButton(
+            'Вперед ▶️',
+            callback_data=page_callback_data(view, 'next', page.reservations[-1])
+        ))
+    return nav_row
+
+
+def page_callback_data(view: str, direction: str, reservation: Reservation) -> str:
+    """Формирует callback_data кнопки перехода на соседнюю страницу"""
+    return 'page:{}:{}:{}:{}'.format(
+        view,
+        direction,
+        reservation.date_time.strftime(settings.PAGE_CURSOR_FORMAT),
+        reservation.id,
+    )
 
 
-async def reservations_to_messages(
+def reservations_messages(
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
     reservations: List[Reservation]
-) -> None:
-    """Функция принимает список с резервами и отправляет сообщение
-     за каждый из элементов, добавляя к ним кнопки."""
+) -> List[List[Awaitable]]:
+    """Функция принимает список с резервами и готовит этапы отправки
+    для OUTBOUND: заголовок, затем сообщение за каждый из элементов
+    с кнопками. Карточки отправляются одновременно и могут прийти
+    не по порядку: время визита есть в каждой из них"""
     if len(reservations) == 0:
-        await send_message(update, context, settings.NO_INFO_FOUND, reply_markup=BASE_KEYBOARD)
-    elif len(reservations) > settings.NUMBER_OF_RESERVES_BEFORE_LIST:
-        keyboard = []
-        for reservation in reservations:
-            keyboard.append([
-                InlineKeyboardButton(
-                    reservation.reserve_line(logs=False),
-                    callback_data=reservation
-                )
-            ])
-
-        await send_message(
-                update,
-                context,
-                'Вот что я нашел:',
-                reply_markup=BASE_KEYBOARD
-                )
-        await send_message(
+        return [[send_message(update, context, settings.NO_INFO_FOUND, reply_markup=BASE_KEYBOARD)]]
+    header = send_message(
+            update,
+            context,
+            'Вот что я нашел:',
+            reply_markup=BASE_KEYBOARD
+            )
+    if len(reservations) > settings.NUMBER_OF_RESERVES_BEFORE_LIST:
+        return [
+            [header],
+            [send_message(
                 update,
                 context,
                 'Резервы:',
-                reply_markup=InlineKeyboardMarkup(keyboard)
-                )
-    else:
-        await send_message(
-                update,
-                context,
-                'Вот что я нашел:',
-                reply_markup=BASE_KEYBOARD
-                )
-        for reservation in reservations:
-            msg = await send_message(
+                reply_markup=reservations_keyboard(reservations)
+                )],
+        ]
+    return [
+        [header],
+        [
+            send_message(
                 update,
                 context,
                 reservation.reserve_card(),
-                InlineKeyboardMarkup(RESERVE_CARD_KEYBOARD),
+                reservation_keyboard(reservation),
                 )
-            # словарь для связки объекта резерва с сообщением о нем
-            context.chat_data.setdefault('msg_reservation', {}).update({msg.id: reservation})
+            for reservation in reservations
+        ],
+    ]
+
+
+async def reservations_to_messages(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    reservations: List[Reservation]
+) -> None:
+    """Функция принимает список с резервами и отправляет сообщение
+     за каждый из элементов, добавляя к ним кнопки."""
+    await OUTBOUND.send(
+        update.effective_chat.id,
+        *reservations_messages(update, context, reservations)
+    )
+
+
+async def page_to_messages(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    view: str,
+    page: ReservationsPage,
+) -> None:
+    """Функция выводит первую страницу резервов. Если все резервы
+    уместились на ней, вывод такой же, как у reservations_to_messages,
+    иначе - список с кнопками перехода по страницам"""
+    if not page.has_next:
+        await reservations_to_messages(update, context, page.reservations)
+        return
+    await OUTBOUND.send(
+        update.effective_chat.id,
+        [send_message(
+            update,
+            context,
+            'Вот что я нашел:',
+            reply_markup=BASE_KEYBOARD
+        )],
+        [send_message(
+            update,
+            context,
+            'Резервы:',
+            reply_markup=reservations_keyboard(
+                page.reservations, page_nav_row(view, page)
+            )
+        )],
+    )
+
+
+async def page_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обрабатывает кнопки Назад / Вперед: загружает соседнюю страницу
+    и подменяет ею клавиатуру списка"""
+    query = update.callback_query
+    await query.answer()
+    _, view, direction, cursor_date_time, cursor_id = query.data.split(':')
+    show_page = PAGED_VIEWS[view]
+    venue = chat_venue(update)
+    page = await show_page(
+        venue,
+        (
+            datetime.strptime(cursor_date_time, settings.PAGE_CURSOR_FORMAT),
+            int(cursor_id),
+        ),
+        backwards=direction == 'prev',
+    )
+    if not page.reservations:
+        # резервы вокруг курсора удалены или устарели - возвращаемся в начало
+        page = await show_page(venue)
+    await query.edit_message_reply_markup(
+        reply_markup=reservations_keyboard(
+            page.reservations, page_nav_row(view, page)
+        )
+    )
 
 
 async def delete_reserve_button(
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
+    reservation: Reservation,
 ) -> None:
     """Функция удаляет запись о брони из БД и выводит подтверждение в чат"""
-    update.callback_query.answer()
-    reservation = await get_reservation_from_msg(update.effective_message.id, context)
-    delete_reservation(reservation)
-    await update.callback_query.edit_message_text(
-        text='ОТМЕНЕНА' + '\n' + reservation.reserve_card(),
-        parse_mode='HTML'
-    )
-    del context.chat_data['msg_reservation'][update.effective_message.id]
+    await delete_reservation(reservation.venue, reservation)
     logging.info('\nReservation deleted:\n{}'.format(reservation.reserve_line()))
-    await notify_all_users(
+    notify_all_users(
         update,
         context,
+        reservation.venue,
         settings.NOTIFY_ALL_DELETE_RESERVE + '\n\n' + reservation.reserve_card()
     )
+    await OUTBOUND.send(update.effective_chat.id, [
+        update.callback_query.edit_message_text(
+            text='ОТМЕНЕНА' + '\n' + reservation.reserve_card(),
+            parse_mode='HTML'
+        ),
+        notify_confirmation(update, context),
+    ])
     return ConversationHandler.END
 
 
 async def visited_button(
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
+    reservation: Reservation,
 ) -> None:
     """Функция обновляет информацию о приходе гостей в бд и изменяет карточку резерва"""
-    update.callback_query.answer()
-    reservation = await get_reservation_from_msg(update.effective_message.id, context)
     reservation.visited_on_off()
-    edit_reservation(reservation)
+    await edit_reservation(reservation.venue, reservation)
     await update.callback_query.edit_message_text(
         text=reservation.reserve_card(),
-        reply_markup=InlineKeyboardMarkup(RESERVE_CARD_KEYBOARD),
+        reply_markup=reservation_keyboard(reservation),
         parse_mode='HTML'
     )
-    await create_update_msg_reservation_link(update.effective_message.id, reservation, context)
     logging.info('\nGuests visit status changed:\n{}'.format(reservation.reserve_line()))
     return ConversationHandler.END
 
 
-async def edit_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def edit_button(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    reservation: Reservation,
+):
     """Функция предлагает параметры резерва, которые можно изменить"""
-    context.user_data['reservation'] = await get_reservation_from_msg(update.effective_message.id, context)
-    # сохраняем id сообщения, из которого запущен процесс редактирования
-    context.user_data['edited_id'] = update.effective_message.id
-    keyboard = [
-        [InlineKeyboardButton('Имя', callback_data='edit_name')],
-        [InlineKeyboardButton('Дата / Время', callback_data='edit_datetime')],
-        [InlineKeyboardButton('Детали', callback_data='edit_info')],
-    ]
-    query = update.callback_query
-    await query.answer()
-    await query.edit_message_text(
+    await update.callback_query.edit_message_text(
         text='Что меняем?:' + '\n\n' + update.effective_message.text,
-        reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML'
+        reply_markup=reservation_keyboard(reservation, RESERVE_EDIT_BUTTONS),
+        parse_mode='HTML'
     )
 
 
 async def copy_format_button(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    reservation: Reservation,
 ):
     """Функция изменяет сообщение и выводит информацию о резерве
     в удобном для копирования формате"""
-    reservation = await get_reservation_from_msg(
-        update.effective_message.id, context
-    )
     await update.callback_query.edit_message_text(
         text=reservation.reserve_copy_card(),
         parse_mode='Markdown'
@@ -273,38 +642,64 @@ async def copy_format_button(
     return ConversationHandler.END
 
 
-async def edit_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def show_card_button(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    reservation: Reservation,
+):
+    """Функция выводит карточку резерва, выбранного в списке"""
+    await reservations_to_messages(update, context, [reservation, ])
+
+
+async def edit_name(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    reservation: Reservation,
+):
     """Функция предлагает изменить имя в резерве"""
+    context.user_data['reservation'] = reservation
     await keyboard_off(update)
     await send_message(
         update,
         context,
-        'Текущее имя в резерве: ' + context.user_data['reservation'].guest_name + '\n' + 'Отправь мне новое!'
+        'Текущее имя в резерве: ' + reservation.guest_name + '\n' + 'Отправь мне новое!'
     )
     context.user_data['changed'] = 'name'
-    await update.callback_query.answer()
+    return EDIT_NAME
 
 
-async def edit_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def edit_time(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    reservation: Reservation,
+):
     """Функция предлагает изменить время визита в резерве"""
+    context.user_data['reservation'] = reservation
     await keyboard_off(update)
     await send_message(
         update,
         context,
-        'Текущее время визита в резерве: ' + str(context.user_data['reservation'].date_time.strftime(settings.DATETIME_FORMAT)) + '\n' + 'Отправь мне новое!'
+        'Текущее время визита в резерве: ' + str(reservation.date_time.strftime(settings.DATETIME_FORMAT)) + '\n' + 'Отправь мне новое!'
     )
     context.user_data['changed'] = 'time'
+    return EDIT_DATETIME
 
 
-async def edit_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def edit_info(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    reservation: Reservation,
+):
     """Функция предлагает изменить детали в резерве"""
+    context.user_data['reservation'] = reservation
     await keyboard_off(update)
     await send_message(
         update,
         context,
-        'Детали: ' + context.user_data['reservation'].info + '\n' + 'На что меняем?'
+        'Детали: ' + reservation.info + '\n' + 'На что меняем?'
     )
     context.user_data['changed'] = 'info'
+    return EDIT_INFO
 
 
 async def edit_save(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -325,64 +720,120 @@ async def edit_save(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # получаем измененный резерв
     reservation = context.user_data['reservation']
     # изменяем его в ДБ
-    edit_reservation(reservation)
+    await edit_reservation(reservation.venue, reservation)
 
     logging.info('\nReservation info changed:\n{}'.format(
         reservation.reserve_line())
     )
-    msg = await send_message(
-        update,
-        context,
-        reservation.reserve_card(),
-        reply_markup=InlineKeyboardMarkup(RESERVE_CARD_KEYBOARD)
-    )
-    await send_message(
-        update,
-        context,
-        settings.RESERVER_ADDITION_END_SAVE,
-        reply_markup=BASE_KEYBOARD)
-    await notify_all_users(
+    notify_all_users(
         update,
         context,
+        reservation.venue,
         settings.NOTIFY_ALL_EDIT_RESERVE + f'({changed})' + '\n\n' + reservation.reserve_card()
     )
-    await create_update_msg_reservation_link(msg.id, reservation, context)
+    # карточка и подтверждения - одновременно
+    await OUTBOUND.send(update.effective_chat.id, [
+        send_message(
+            update,
+            context,
+            reservation.reserve_card(),
+            reply_markup=reservation_keyboard(reservation)
+        ),
+        send_message(
+            update,
+            context,
+            settings.RESERVER_ADDITION_END_SAVE,
+            reply_markup=BASE_KEYBOARD),
+        notify_confirmation(update, context),
+    ])
     return ConversationHandler.END
 
 
+# действия кнопок с callback_data вида r:<id>:<действие>
+CARD_ACTIONS = {
+    'visited': visited_button,
+    'delete': delete_reserve_button,
+    'edit': edit_button,
+    'copy': copy_format_button,
+    'show': show_card_button,
+    'edit_name': edit_name,
+    'edit_datetime': edit_time,
+    'edit_info': edit_info,
+}
+
+
+async def card_action(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    venue: str,
+    reservation_id: Optional[int],
+    action: str,
+):
+    """Читает резерв по id из БД заведения и передает его обработчику
+    действия. Резервы другого заведения (например, из кнопок, отправленных
+    до смены заведения чата) не обрабатываются"""
+    handler = CARD_ACTIONS.get(action)
+    reservation = (
+        await get_reservation(venue, reservation_id)
+        if handler and reservation_id is not None and venue == chat_venue(update)
+        else None
+    )
+    if reservation is None:
+        # неизвестное действие, чужое заведение или резерв уже удален
+        await send_message(update, context, settings.CARD_BUTTONS_ERROR_MSG)
+        return ConversationHandler.END
+    return await handler(update, context, reservation)
+
+
 async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обрабатывает выбор кнопочек"""
+    """Обрабатывает нажатия кнопок резервов: id резерва, заведение
+    и действие берутся из callback_data"""
     query = update.callback_query
     await query.answer()
-    try:
-        if query.data == 'delete_reservation':
-            await delete_reserve_button(update, context)
-        if query.data == 'edit_reservation':
-            await edit_button(update, context)
-        if query.data == 'visited':
-            await visited_button(update, context)
-        if query.data == 'copy_format':
-            await copy_format_button(update, context)
-        if query.data == 'edit_name':
-            await edit_name(update, context)
-            return EDIT_NAME
-        if query.data == 'edit_datetime':
-            await edit_time(update, context)
-            return EDIT_DATETIME
-        if query.data == 'edit_info':
-            await edit_info(update, context)
-            return EDIT_INFO
-        if isinstance(query.data, Reservation):
-            await reservations_to_messages(update, context, [query.data, ])
-    except KeyError:
-        await send_message(update, context, settings.CARD_BUTTONS_ERROR_MSG)
+    data = query.data.split(':')
+    if len(data) == 3:
+        # кнопка, отправленная до появления заведений
+        data.insert(1, settings.DEFAULT_VENUE)
+    _, venue, reservation_id, action = data
+    return await card_action(update, context, venue, int(reservation_id), action)
+
+
+async def legacy_card_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обрабатывает нажатия кнопок, отправленных до перехода
+    на r:<id>:<действие>. Данные кнопки находятся по ее uuid в сохраненном
+    кэше PTB: в кнопке карточки было только действие, id резерва берется
+    из связки id сообщения - id резерва (до нее - сам резерв), в кнопке
+    списка - сам резерв. Резерв перечитывается из БД. Кнопки, данных
+    которых нет (кэш PTB вытеснил их или не был сохранен), не работают"""
+    query = update.callback_query
+    await query.answer()
+    legacy_buttons = await context.application.persistence.get_legacy_buttons()
+    data = legacy_buttons.get(query.data)
+    if isinstance(data, Reservation):
+        # кнопка списка резервов
+        action = 'show'
+        reservation_id = data.id
+    else:
+        action = LEGACY_CARD_ACTIONS.get(data)
+        links = context.chat_data.get('msg_reservation') or {}
+        reservation_id = links.get(update.effective_message.id)
+        reservation_id = getattr(reservation_id, 'id', reservation_id)
+    return await card_action(
+        update, context, settings.DEFAULT_VENUE, reservation_id, action
+    )
+
+
+async def unknown_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обрабатывает нажатия кнопок, отправленных до смены формата callback_data"""
+    await update.callback_query.answer()
+    await send_message(update, context, settings.CARD_BUTTONS_ERROR_MSG)
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обрабатывает команду /start"""
     current_chat_id = update.effective_chat.id
-    if current_chat_id not in get_chat_id_list():
-        add_chat_id(current_chat_id)
+    if current_chat_id not in CHAT_REGISTRY:
+        await CHAT_REGISTRY.add(current_chat_id)
         logging.info(f'New person pressed /start: {update.effective_user.name}')
 
     await send_message(
@@ -416,17 +867,23 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def archive(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обрабатывает команду /archive. Выводит резервы раньше текущей даты"""
-    await reservations_to_messages(update, context, show_reservations_archive())
+    await page_to_messages(
+        update, context, 'archive', await show_reservations_archive(chat_venue(update))
+    )
 
 
 async def allreserves(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обрабатывает команду /allreserves. Выводит резервы позже текущей даты"""
-    await reservations_to_messages(update, context, show_reservations_all())
+    await page_to_messages(
+        update, context, 'all', await show_reservations_all(chat_venue(update))
+    )
 
 
 async def todayreserves(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обрабатывает команду /todayreserves. Выводит резервы на текущий день"""
-    await reservations_to_messages(update, context, show_reservations_today())
+    await reservations_to_messages(
+        update, context, await show_reservations_today(chat_venue(update))
+    )
 
 
 async def addreserve(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -466,7 +923,7 @@ async def more_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_message(update, context, settings.RESERVER_ADDITION_SAVE_EDIT_DELETE)
     await send_message(
         update, context,
-        textwrap.dedent(context.user_data['new_reservation'].reserve_preview()),
+        context.user_data['new_reservation'].reserve_preview(),
         ReplyKeyboardMarkup(
             reply_keyboard,
             one_time_keyboard=True,
@@ -488,19 +945,25 @@ async def end_save(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Сохраняет запись и заканчивает сбор данных"""
     context.user_data['new_reservation'].user_added = update.effective_user.name
     reservation = context.user_data['new_reservation']
-    add_reservation(reservation)
+    await add_reservation(chat_venue(update), reservation)
     logging.info('\nReservation saved:\n{}'.format(reservation.reserve_line()))
-    await reservations_to_messages(update, context, [reservation, ])
-    await send_message(
-        update,
-        context,
-        settings.RESERVER_ADDITION_END_SAVE,
-        reply_markup=BASE_KEYBOARD)
-    await notify_all_users(
+    notify_all_users(
         update,
         context,
+        reservation.venue,
         settings.NOTIFY_ALL_NEW_RESERVE + '\n\n' + reservation.reserve_card()
     )
+    # заголовок, затем карточка нового резерва и подтверждения - одновременно
+    *stages, card_stage = reservations_messages(update, context, [reservation, ])
+    card_stage.extend([
+        send_message(
+            update,
+            context,
+            settings.RESERVER_ADDITION_END_SAVE,
+            reply_markup=BASE_KEYBOARD),
+        notify_confirmation(update, context),
+    ])
+    await OUTBOUND.send(update.effective_chat.id, *stages, card_stage)
     del context.user_data['new_reservation']
     return ConversationHandler.END
 
@@ -520,7 +983,9 @@ async def reserves_per_date_answer(update: Update, context: ContextTypes.DEFAULT
     try:
         await reservations_to_messages(
             update, context,
-            show_reservations_per_date(Reservation.str_to_date(update.message.text))
+            await show_reservations_per_date(
+                chat_venue(update), Reservation.str_to_date(update.message.text)
+            )
         )
     except InvalidDatetimeException as datetime_validation_error:
         await send_message(update, context, datetime_validation_error.args[0]) # вот это конечно сильно
@@ -528,10 +993,85 @@ async def reserves_per_date_answer(update: Update, context: ContextTypes.DEFAULT
     return ConversationHandler.END
 
 
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обрабатывает команду /search и кнопку поиска. Если текст для поиска
+    передан вместе с командой, сразу выводит результаты, иначе запрашивает его"""
+    if context.args:
+        await reservations_to_messages(
+            update,
+            context,
+            await search_reservations(chat_venue(update), ' '.join(context.args)),
+        )
+        return ConversationHandler.END
+    await send_message(update, context, settings.ASK_FOR_SEARCH_QUERY)
+    return ENTER_SEARCH_QUERY
+
+
+async def search_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выводит резервы, найденные по введенному тексту, по релевантности"""
+    await reservations_to_messages(
+        update,
+        context,
+        await search_reservations(chat_venue(update), update.message.text),
+    )
+    return ConversationHandler.END
+
+
+async def notify_reminder(
+    application: Application,
+    kind: str,
+    reservation: Reservation,
+):
+    """Функция рассылает пользователям бота из заведения резерва напоминание
+    о визите или, после времени визита, карточку с кнопками, чтобы отметить гостей"""
+    if kind == NO_SHOW:
+        text = settings.NO_SHOW_MSG
+        reply_markup = reservation_keyboard(reservation)
+    else:
+        text = settings.REMINDER_MSG.format(minutes=settings.REMINDER_MINUTES_BEFORE)
+        reply_markup = None
+    application.create_task(
+        BROADCASTER.broadcast(
+            application.bot,
+            list(CHAT_REGISTRY.chats_of(reservation.venue)),
+            text + '\n\n' + reservation.reserve_card(),
+            reply_markup=reply_markup,
+        )
+    )
+
+
+async def post_init(application: Application) -> None:
+    """Загружает данные, которые бот держит в памяти, перед началом работы"""
+    await CHAT_REGISTRY.load()
+    for reminders in REMINDERS.values():
+        await reminders.start(
+            application.job_queue,
+            partial(notify_reminder, application),
+        )
+    schedule_archival(application.job_queue)
+
+
 def main() -> None:
+    setup_logging()
     if not settings.TELEGRAM_BOT_TOKEN:
         exit('No TG token found!')
-    application = ApplicationBuilder().token(settings.TELEGRAM_BOT_TOKEN).arbitrary_callback_data(True).build()
+    if settings.BOT_MODE == 'webhook' and not (
+        settings.WEBHOOK_URL and settings.WEBHOOK_SECRET_TOKEN and settings.HTTP_PORT
+    ):
+        exit('Webhook mode needs WEBHOOK_URL, WEBHOOK_SECRET_TOKEN and HTTP_PORT!')
+    migrate_venues()
+    application = (
+        ApplicationBuilder()
+        .token(settings.TELEGRAM_BOT_TOKEN)
+        .base_url(settings.TELEGRAM_API_URL)
+        .request(MeteredHTTPXRequest(
+            connection_pool_size=settings.TELEGRAM_CONNECTION_POOL_SIZE,
+            pool_timeout=settings.TELEGRAM_POOL_TIMEOUT,
+        ))
+        .persistence(SQLitePersistence())
+        .post_init(post_init)
+        .build()
+    )
 
     # Добавляем обработку команды /start
     start_handler = CommandHandler('start', start)
@@ -569,6 +1109,33 @@ def main() -> None:
     helloworld_handler = CommandHandler('helloworld', helloworld)
     application.add_handler(helloworld_handler)
 
+    # Добавляем обработку команды /cachestats
+    cachestats_handler = CommandHandler('cachestats', cachestats)
+    application.add_handler(cachestats_handler)
+
+    # Добавляем обработку команды /export
+    export_handler = CommandHandler('export', export_command)
+    application.add_handler(export_handler)
+
+    # Добавляем обработку команды /stats
+    stats_handler = CommandHandler('stats', stats_command)
+    application.add_handler(stats_handler)
+
+    # Добавляем обработку команды /venue
+    venue_handler = CommandHandler('venue', venue_command)
+    application.add_handler(venue_handler)
+
+    # Добавляем обработку команды /diag
+    diag_handler = CommandHandler('diag', diag_command)
+    application.add_handler(diag_handler)
+
+    # Добавляем обработку файла с подписью /import
+    import_handler = MessageHandler(
+        filters.Document.ALL & filters.CaptionRegex('^/import'),
+        import_document
+    )
+    application.add_handler(import_handler)
+
     # Добавляем обработку команды /addreserve
     addreserve_handler = ConversationHandler(
         entry_points=[
@@ -593,14 +1160,24 @@ def main() -> None:
             ],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
+        name='addreserve',
+        persistent=True,
     )
 
     application.add_handler(addreserve_handler)
 
+    # Добавляем обработку кнопок переключения страниц списка резервов
+    # (до обработчика остальных кнопок, который принимает любые нажатия)
+    page_handler = CallbackQueryHandler(page_button, pattern='^page:')
+    application.add_handler(page_handler)
+
     # Добавляем обработку запроса на редактирование резерва
     editreserve_handler = ConversationHandler(
         entry_points=[
-            CallbackQueryHandler(button),
+            CallbackQueryHandler(button, pattern=CARD_CALLBACK_PATTERN),
+            CallbackQueryHandler(
+                legacy_card_button, pattern=LEGACY_CARD_CALLBACK_PATTERN
+            ),
         ],
         states={
             EDIT_NAME: [
@@ -614,10 +1191,18 @@ def main() -> None:
             ],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
+        name='editreserve',
+        persistent=True,
     )
 
     application.add_handler(editreserve_handler)
 
+    # Добавляем обработку кнопок со старыми callback_data
+    unknown_button_handler = CallbackQueryHandler(
+        unknown_button, pattern='^(?!r:|page:)'
+    )
+    application.add_handler(unknown_button_handler)
+
     # Добавляем обработку нажатия кнопки выдачи резервов по дате
     reserves_per_date_handler = ConversationHandler(
         entry_points=[
@@ -635,12 +1220,41 @@ def main() -> None:
             ]
         },
         fallbacks=[CommandHandler('cancel', cancel)],
+        name='reserves_per_date',
+        persistent=True,
     )
 
     application.add_handler(reserves_per_date_handler)
 
-    # Поллинг
-    application.run_polling()
+    # Добавляем обработку кнопки и команды поиска
+    search_handler = ConversationHandler(
+        entry_points=[
+            MessageHandler(
+                filters.Regex(f'^{settings.SEARCH_BUTTON}$'),
+                search_command
+            ),
+            CommandHandler('search', search_command),
+        ],
+        states={
+            ENTER_SEARCH_QUERY: [
+                MessageHandler(
+                    filters.TEXT & (~ filters.COMMAND),
+                    search_answer
+                )
+            ]
+        },
+        fallbacks=[CommandHandler('cancel', cancel)],
+        name='search',
+        persistent=True,
+    )
+
+    application.add_handler(search_handler)
+
+    # Замер времени работы всех обработчиков (метрики на /metrics)
+    instrument_handlers(application)
+
+    # Поллинг или вебхук, в зависимости от settings.BOT_MODE
+    bot_server.run(application)
 
 
 if __name__ == '__main__':
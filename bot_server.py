@@ -0,0 +1,168 @@
+"""Запуск бота и его HTTP-сервер.
+
+В режиме polling бот сам запрашивает апдейты (getUpdates), в режиме
+webhook Telegram присылает их POST-запросами на WEBHOOK_PATH.
+В обоих режимах HTTP-сервер отдает /healthz и /metrics
+(в режиме polling - только если задан HTTP_PORT)"""
+import asyncio
+import hmac
+import json
+import logging
+import signal
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import Application
+
+import settings
+from day_cache import DAY_CACHE
+from http_server import HTTPRequest, HTTPResponse, HTTPServer
+from metrics import METRICS
+
+SECRET_TOKEN_HEADER = 'x-telegram-bot-api-secret-token'
+
+
+class BotServer:
+    """HTTP-сервер бота: проверка здоровья, метрики
+    и, если передан webhook_path, прием апдейтов от Telegram"""
+
+    def __init__(
+        self,
+        application: Application,
+        host: str = settings.HTTP_HOST,
+        port: int = settings.HTTP_PORT,
+        webhook_path: str = None,
+        secret_token: str = None,
+    ):
+        self.application = application
+        self.webhook_path = webhook_path
+        self.secret_token = secret_token
+        self.server = HTTPServer(
+            self.handle,
+            host,
+            port,
+            max_body_size=settings.HTTP_MAX_BODY_SIZE,
+            check_headers=self.check_headers,
+        )
+        self.updates_received = 0
+        self.updates_rejected = 0
+
+    async def start(self):
+        await self.server.start()
+
+    async def stop(self):
+        await self.server.stop()
+
+    def check_headers(self, request: HTTPRequest) -> Optional[HTTPResponse]:
+        """Проверяет метод и секретный токен запроса к вебхуку
+        до того, как сервер прочитает его тело"""
+        if not self.webhook_path or request.path != self.webhook_path:
+            return None
+        if request.method != 'POST':
+            return HTTPResponse(405, b'Method Not Allowed')
+        token = request.headers.get(SECRET_TOKEN_HEADER, '')
+        if not hmac.compare_digest(token.encode(), self.secret_token.encode()):
+            self.updates_rejected += 1
+            logging.warning('Webhook request with invalid secret token')
+            return HTTPResponse(403, b'Forbidden')
+        return None
+
+    async def handle(self, request: HTTPRequest) -> HTTPResponse:
+        if request.path == self.webhook_path and self.webhook_path:
+            return await self.handle_update(request)
+        if request.path == '/healthz':
+            return self.healthz()
+        if request.path == '/metrics':
+            return self.metrics()
+        return HTTPResponse(404, b'Not Found')
+
+    async def handle_update(self, request: HTTPRequest) -> HTTPResponse:
+        """Ставит апдейт в очередь Application (метод и секретный токен
+        уже проверены check_headers). Ответ отдается сразу,
+        не дожидаясь обработки"""
+        try:
+            update = Update.de_json(json.loads(request.body), self.application.bot)
+        except (ValueError, TypeError, KeyError):
+            self.updates_rejected += 1
+            return HTTPResponse(400, b'Bad Request')
+        self.updates_received += 1
+        await self.application.update_queue.put(update)
+        return HTTPResponse(200)
+
+    def healthz(self) -> HTTPResponse:
+        if self.application.running:
+            return HTTPResponse(200, b'ok')
+        return HTTPResponse(503, b'stopped')
+
+    def metrics(self) -> HTTPResponse:
+        """Метрики в текстовом формате Prometheus"""
+        cache_stats = DAY_CACHE.stats()
+        lines = [
+            '# TYPE bot_webhook_updates_received_total counter',
+            f'bot_webhook_updates_received_total {self.updates_received}',
+            '# TYPE bot_webhook_updates_rejected_total counter',
+            f'bot_webhook_updates_rejected_total {self.updates_rejected}',
+            '# TYPE bot_update_queue_size gauge',
+            f'bot_update_queue_size {self.application.update_queue.qsize()}',
+            '# TYPE bot_day_cache_hits_total counter',
+            f'bot_day_cache_hits_total {cache_stats["hits"]}',
+            '# TYPE bot_day_cache_misses_total counter',
+            f'bot_day_cache_misses_total {cache_stats["misses"]}',
+            '# TYPE bot_day_cache_size gauge',
+            f'bot_day_cache_size {cache_stats["size"]}',
+            *METRICS.render(),
+        ]
+        return HTTPResponse(
+            body=('\n'.join(lines) + '\n').encode(),
+            content_type='text/plain; version=0.0.4; charset=utf-8',
+        )
+
+
+async def serve(application: Application):
+    """Запускает бота в режиме settings.BOT_MODE и работает
+    до SIGINT/SIGTERM. Повторяет порядок запуска и остановки
+    Application.run_polling, добавляя HTTP-сервер"""
+    webhook = settings.BOT_MODE == 'webhook'
+    server = None
+    if webhook or settings.HTTP_PORT:
+        server = BotServer(
+            application,
+            webhook_path=settings.WEBHOOK_PATH if webhook else None,
+            secret_token=settings.WEBHOOK_SECRET_TOKEN,
+        )
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for stop_signal in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(stop_signal, stop.set)
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        if server is not None:
+            await server.start()
+        if webhook:
+            await application.bot.set_webhook(
+                settings.WEBHOOK_URL,
+                secret_token=settings.WEBHOOK_SECRET_TOKEN,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        else:
+            await application.updater.start_polling()
+        await application.start()
+        logging.info(f'Bot started in {settings.BOT_MODE} mode')
+        await stop.wait()
+    finally:
+        if server is not None:
+            await server.stop()
+        if application.updater.running:
+            await application.updater.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def run(application: Application):
+    asyncio.run(serve(application))
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional
+
+from telegram import Bot, InlineKeyboardMarkup, error
+
+import settings
+from chat_registry import CHAT_REGISTRY
+from metrics import BROADCAST_MESSAGES, BROADCASTS
+
+
+class TokenBucket:
+    """Ограничитель частоты: не больше rate событий в секунду,
+    с возможностью накопить не больше capacity токенов"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        # сколько acquire сейчас ждут токен
+        self.waiting = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    async def acquire(self):
+        """Ждет, пока не появится свободный токен, и забирает его"""
+        self.waiting += 1
+        try:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+        finally:
+            self.waiting -= 1
+
+    def idle(self) -> bool:
+        """Никто не ждет токен и все токены накоплены: такой ограничитель
+        можно удалить и потом создать заново без нарушения лимита"""
+        self._refill()
+        return not self.waiting and self.tokens >= self.capacity
+
+
+@dataclass
+class BroadcastStats:
+    """Статистика доставки одной рассылки"""
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    pruned: int = 0
+    retries: int = 0
+    duration: float = 0.0
+
+
+class Broadcaster:
+    """Рассылка сообщений по списку чатов с ограничением
+    числа одновременных запросов и частоты отправки"""
+
+    def __init__(self):
+        self._global_bucket = TokenBucket(
+            settings.BROADCAST_GLOBAL_RATE, settings.BROADCAST_GLOBAL_RATE
+        )
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        if chat_id not in self._chat_buckets:
+            self._chat_buckets[chat_id] = TokenBucket(
+                settings.BROADCAST_PER_CHAT_RATE, 1
+            )
+        return self._chat_buckets[chat_id]
+
+    def _evict_idle_buckets(self):
+        """Удаляет ограничители чатов, которые давно не отправляли сообщений,
+        чтобы их число не росло со всеми чатами, куда бот когда-либо писал"""
+        for chat_id in [
+            chat_id for chat_id, bucket in self._chat_buckets.items() if bucket.idle()
+        ]:
+            del self._chat_buckets[chat_id]
+
+    async def _prune_chat(self, chat_id: int, stats: BroadcastStats):
+        """Удаляет чат, недоступный боту, из списка рассылки"""
+        await CHAT_REGISTRY.remove(chat_id)
+        self._chat_buckets.pop(chat_id, None)
+        stats.pruned += 1
+        logging.info(f'Chat {chat_id} is unreachable and was removed')
+
+    async def _send(
+        self,
+        bot: Bot,
+        chat_id: int,
+        text: str,
+        parse_mode: Optional[str],
+        reply_markup: Optional[InlineKeyboardMarkup],
+        stats: BroadcastStats,
+    ):
+        for attempt in range(settings.BROADCAST_MAX_RETRIES + 1):
+            # лимит чата ждем до захвата слота, чтобы не держать слот впустую
+            await self._chat_bucket(chat_id).acquire()
+            async with self._semaphore:
+                await self._global_bucket.acquire()
+                try:
+                    await bot.send_message(
+                        chat_id=chat_id,
+                        text=text,
+                        reply_markup=reply_markup,
+                        parse_mode=parse_mode,
+                    )
+                except error.RetryAfter as er:
+                    if attempt == settings.BROADCAST_MAX_RETRIES:
+                        # попытки кончились: ждать retry_after незачем
+                        break
+                    retry_after = er.retry_after
+                except error.Forbidden:
+                    await self._prune_chat(chat_id, stats)
+                    return
+                except error.BadRequest as er:
+                    if 'chat not found' in er.message.lower():
+                        await self._prune_chat(chat_id, stats)
+                    else:
+                        stats.failed += 1
+                        logging.info(f'\nError when notifying:\n{er}')
+                    return
+                except error.TelegramError as er:
+                    stats.failed += 1
+                    logging.info(f'\nError when notifying:\n{er}')
+                    return
+                else:
+                    stats.sent += 1
+                    return
+            stats.retries += 1
+            await asyncio.sleep(retry_after)
+        stats.failed += 1
+
+    async def broadcast(
+        self,
+        bot: Bot,
+        chat_ids: Iterable[int],
+        text: str,
+        parse_mode: Optional[str] = 'HTML',
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+    ) -> BroadcastStats:
+        """Отправляет сообщение во все переданные чаты
+        и возвращает статистику доставки"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(
+                settings.BROADCAST_CONCURRENCY
+            )
+        self._evict_idle_buckets()
+        chat_ids = list(chat_ids)
+        stats = BroadcastStats(total=len(chat_ids))
+        started_at = time.monotonic()
+        await asyncio.gather(
+            *(self._send(bot, chat_id, text, parse_mode, reply_markup, stats)
+              for chat_id in chat_ids)
+        )
+        stats.duration = time.monotonic() - started_at
+        BROADCASTS.inc()
+        BROADCAST_MESSAGES.inc('sent', amount=stats.sent)
+        BROADCAST_MESSAGES.inc('failed', amount=stats.failed)
+        BROADCAST_MESSAGES.inc('pruned', amount=stats.pruned)
+        logging.info(
+            f'Broadcast finished: {stats.sent}/{stats.total} sent, '
+            f'{stats.failed} failed, {stats.pruned} pruned, '
+            f'{stats.retries} retries in {stats.duration:.2f}s'
+        )
+        return stats
+
+
+BROADCASTER = Broadcaster()
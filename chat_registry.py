@@ -0,0 +1,77 @@
+import logging
+from typing import Dict, Iterator, Set
+
+import settings
+from async_reservations import add_chat_id, delete_chat_id, get_chats, set_chat_venue
+from database import venues
+
+
+class ChatRegistry:
+    """id чатов, с которыми общается бот, и заведения, с резервами
+    которых работает каждый чат. Загружается из БД один раз при запуске,
+    изменения пишутся одновременно в память и в БД.
+    Чаты хранятся и по заведениям, чтобы рассылка по заведению
+    не перебирала все чаты"""
+
+    def __init__(self):
+        self._venues: Dict[int, str] = {}
+        self._chats_by_venue: Dict[str, Set[int]] = {}
+
+    def _set(self, chat_id: int, venue: str):
+        self._discard(chat_id)
+        self._venues[chat_id] = venue
+        self._chats_by_venue.setdefault(venue, set()).add(chat_id)
+
+    def _discard(self, chat_id: int):
+        venue = self._venues.pop(chat_id, None)
+        if venue is not None:
+            self._chats_by_venue[venue].discard(chat_id)
+
+    async def load(self):
+        """Загружает id чатов и их заведения из БД.
+        Чаты без заведения и с заведением, которого больше нет
+        в настройках, работают с основным"""
+        self._venues = {}
+        self._chats_by_venue = {}
+        known_venues = set(venues())
+        for chat_id, venue in await get_chats():
+            if venue is not None and venue not in known_venues:
+                logging.warning(f'Chat {chat_id} has unknown venue {venue}')
+                venue = None
+            self._set(chat_id, venue or settings.DEFAULT_VENUE)
+
+    async def add(self, chat_id: int, venue: str = settings.DEFAULT_VENUE):
+        """Добавляет чат в реестр и в БД"""
+        await add_chat_id(chat_id, venue)
+        self._set(chat_id, venue)
+
+    async def set_venue(self, chat_id: int, venue: str):
+        """Переключает чат на резервы заведения venue
+        (чата, которого нет в реестре, - добавляет)"""
+        await set_chat_venue(chat_id, venue)
+        self._set(chat_id, venue)
+
+    async def remove(self, chat_id: int):
+        """Удаляет чат из реестра и из БД"""
+        await delete_chat_id(chat_id)
+        self._discard(chat_id)
+
+    def venue_of(self, chat_id: int) -> str:
+        """Заведение чата. Чаты не из реестра работают с основным"""
+        return self._venues.get(chat_id, settings.DEFAULT_VENUE)
+
+    def chats_of(self, venue: str) -> Set[int]:
+        """id чатов заведения"""
+        return self._chats_by_venue.get(venue, set())
+
+    def __contains__(self, chat_id: int) -> bool:
+        return chat_id in self._venues
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._venues)
+
+    def __len__(self) -> int:
+        return len(self._venues)
+
+
+CHAT_REGISTRY = ChatRegistry()
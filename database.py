@@ -0,0 +1,288 @@
+import asyncio
+import functools
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import settings
+from metrics import (DB_COMMIT_LATENCY, DB_POOL_WAIT, DB_QUERY_LATENCY,
+                     DB_WRITE_BATCH_SIZE)
+
+_thread_local = threading.local()
+
+
+def venues() -> List[str]:
+    """Функция возвращает все заведения, основное - первым"""
+    return [settings.DEFAULT_VENUE, *settings.VENUE_DB_PATHS]
+
+
+def venue_db_path(venue: str) -> str:
+    """Функция возвращает путь к файлу БД (шарду) заведения"""
+    if venue == settings.DEFAULT_VENUE:
+        return settings.DB_PATH
+    return settings.VENUE_DB_PATHS[venue]
+
+
+def db_path(venue: Optional[str] = None) -> str:
+    """Функция возвращает путь к файлу БД заведения venue,
+    без venue - к основной БД"""
+    return settings.DB_PATH if venue is None else venue_db_path(venue)
+
+
+def get_connection(venue: Optional[str] = None) -> sqlite3.Connection:
+    """Функция возвращает соединение с БД заведения venue
+    (без venue - с основной БД), принадлежащее текущему потоку.
+    Соединения создаются при первом обращении и кэшируются потоком
+    по пути к файлу БД. Для чтения: запись идет через DBWriter"""
+    path = db_path(venue)
+    connections = getattr(_thread_local, 'connections', None)
+    if connections is None:
+        connections = _thread_local.connections = {}
+    connection = connections.get(path)
+    if connection is None:
+        connection = sqlite3.connect(path, timeout=settings.DB_TIMEOUT)
+        connection.row_factory = sqlite3.Row
+        connections[path] = connection
+    return connection
+
+
+def close_connection():
+    """Функция закрывает все соединения текущего потока.
+    Следующий вызов get_connection откроет новое"""
+    connections = getattr(_thread_local, 'connections', None)
+    if connections:
+        for connection in connections.values():
+            connection.close()
+        connections.clear()
+
+
+# пул потоков для запросов к БД, у каждого потока своё соединение
+DB_EXECUTOR = ThreadPoolExecutor(
+    max_workers=settings.DB_WORKERS,
+    thread_name_prefix='db_worker',
+    initializer=get_connection,
+)
+
+
+async def run_in_db_thread(func, *args, **kwargs):
+    """Выполняет синхронную функцию работы с БД в пуле DB_EXECUTOR,
+    не блокируя цикл событий. Замеряет ожидание свободного потока
+    и время работы функции (метрики с ее именем)"""
+    loop = asyncio.get_running_loop()
+    submitted_at = time.perf_counter()
+
+    def run():
+        started_at = time.perf_counter()
+        DB_POOL_WAIT.observe(started_at - submitted_at)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            DB_QUERY_LATENCY.observe(time.perf_counter() - started_at, func.__name__)
+
+    return await loop.run_in_executor(DB_EXECUTOR, run)
+
+
+class DBWriterStoppedException(Exception):
+    """Вызываем когда поток записи в БД завершился из-за ошибки"""
+
+
+class DBWriter:
+    """Единственный поток, который пишет в файл БД.
+
+    Функции записи ставятся в очередь и выполняются этим потоком
+    по порядку. Все записи, накопившиеся в очереди, пока фиксировалась
+    предыдущая транзакция (но не больше DB_WRITE_BATCH_SIZE),
+    выполняются в одной транзакции (group commit): при одновременных
+    сохранениях fsync один на пачку, а не на каждую запись.
+    Каждая запись идет в своей точке сохранения (SAVEPOINT), поэтому
+    ошибка одной откатывает только ее, остальные фиксируются.
+    Результат или исключение функции получает Future из submit -
+    после того, как транзакция зафиксирована.
+
+    БД в режиме WAL (см. migrations.migrate), поэтому соединения
+    потоков пула читают, не дожидаясь записи.
+
+    Если поток записи завершится из-за ошибки (например, не откроется
+    файл БД), все записи в очереди и все следующие submit получат
+    DBWriterStoppedException, а не будут ждать вечно"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: 'queue.SimpleQueue[tuple]' = queue.SimpleQueue()
+        # функции, которые выполняемая запись просит вызвать после фиксации
+        self._after_commit: List[Callable[[], None]] = []
+        self.connection: Optional[sqlite3.Connection] = None
+        # ошибка, из-за которой поток записи завершился
+        self.error: Optional[BaseException] = None
+        self._error_lock = threading.Lock()
+        self.thread = threading.Thread(
+            target=self._run, name=f'db_writer:{path}', daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, func, /, *args, **kwargs) -> Future:
+        """Ставит функцию записи в очередь.
+        Вызывает DBWriterStoppedException, если поток записи завершился"""
+        future = Future()
+        with self._error_lock:
+            if self.error is not None:
+                raise DBWriterStoppedException(self.path) from self.error
+            self._queue.put((func, args, kwargs, future))
+        return future
+
+    def _run(self):
+        jobs: List[tuple] = []
+        try:
+            # транзакциями управляем сами: BEGIN / SAVEPOINT / COMMIT
+            self.connection = sqlite3.connect(
+                self.path, timeout=settings.DB_TIMEOUT, isolation_level=None
+            )
+            self.connection.row_factory = sqlite3.Row
+            _thread_local.writer = self
+            while True:
+                jobs = [self._queue.get()]
+                while len(jobs) < settings.DB_WRITE_BATCH_SIZE:
+                    try:
+                        jobs.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                self._commit(jobs)
+                jobs = []
+        except BaseException as error:
+            logging.exception(f'{self.path}: DB writer stopped')
+            self._fail_pending(jobs, error)
+
+    def _fail_pending(self, jobs: List[tuple], error: BaseException):
+        """Завершает Future недовыполненной пачки и всей очереди ошибкой.
+        После этого submit сразу вызывает DBWriterStoppedException"""
+        with self._error_lock:
+            self.error = error
+        while True:
+            try:
+                jobs.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        stopped = DBWriterStoppedException(self.path)
+        stopped.__cause__ = error
+        for *_, future in jobs:
+            try:
+                future.set_exception(stopped)
+            except InvalidStateError:
+                # запись уже завершена или отменена вызвавшим
+                pass
+
+    def _commit(self, jobs: List[tuple]):
+        """Выполняет пачку записей одной транзакцией и завершает их Future"""
+        # записи, которые вызвавший уже отменил, не выполняем
+        jobs = [job for job in jobs if job[3].set_running_or_notify_cancel()]
+        if not jobs:
+            return
+        outcomes = []
+        callbacks = []
+        try:
+            self.connection.execute('BEGIN IMMEDIATE')
+            for func, args, kwargs, future in jobs:
+                self._after_commit = []
+                self.connection.execute('SAVEPOINT write')
+                started_at = time.perf_counter()
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as error:
+                    # некоторые ошибки SQLite откатывают всю транзакцию
+                    if not self.connection.in_transaction:
+                        raise
+                    self.connection.execute('ROLLBACK TO write')
+                    self.connection.execute('RELEASE write')
+                    outcomes.append((future, None, error))
+                else:
+                    self.connection.execute('RELEASE write')
+                    outcomes.append((future, result, None))
+                    callbacks.extend(self._after_commit)
+                finally:
+                    DB_QUERY_LATENCY.observe(
+                        time.perf_counter() - started_at, func.__name__
+                    )
+            started_at = time.perf_counter()
+            self.connection.execute('COMMIT')
+            DB_COMMIT_LATENCY.observe(time.perf_counter() - started_at)
+        except Exception as error:
+            if self.connection.in_transaction:
+                self.connection.execute('ROLLBACK')
+            logging.exception(f'{self.path}: write transaction failed')
+            for *_, future in jobs:
+                future.set_exception(error)
+            return
+        finally:
+            self._after_commit = []
+        DB_WRITE_BATCH_SIZE.observe(len(jobs))
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logging.exception('Error in after commit callback')
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+_writers: Dict[str, DBWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(venue: Optional[str] = None) -> DBWriter:
+    """Функция возвращает поток записи в БД заведения venue
+    (без venue - в основную БД), запуская его при первом обращении"""
+    path = db_path(venue)
+    with _writers_lock:
+        writer = _writers.get(path)
+        if writer is None:
+            writer = _writers[path] = DBWriter(path)
+        return writer
+
+
+def get_write_connection(venue: Optional[str] = None) -> sqlite3.Connection:
+    """Функция возвращает соединение потока записи в БД заведения venue
+    (без venue - в основную БД). Функции записи вызываются только
+    через write или run_in_db_writer и не фиксируют транзакцию сами"""
+    writer = getattr(_thread_local, 'writer', None)
+    if writer is None or writer.path != db_path(venue):
+        raise RuntimeError(
+            f'{db_path(venue)}: writes must run in its DBWriter '
+            '(database.write / run_in_db_writer)'
+        )
+    return writer.connection
+
+
+def after_commit(callback: Callable[[], None]):
+    """Вызывает callback, когда транзакция с текущей записью
+    будет зафиксирована (если запись откатится - не вызывает).
+    Например, так сбрасывается кэш: до фиксации читатели
+    еще видят старые данные и положили бы их обратно в кэш"""
+    writer = getattr(_thread_local, 'writer', None)
+    if writer is None:
+        raise RuntimeError('after_commit is called outside of DBWriter')
+    writer._after_commit.append(callback)
+
+
+def write(venue: Optional[str], func, /, *args, **kwargs):
+    """Выполняет функцию записи в потоке записи БД заведения venue
+    (None - основной БД) и ждет фиксации транзакции.
+    Для командной строки и функций, работающих в потоках пула"""
+    writer = get_writer(venue)
+    if threading.current_thread() is writer.thread:
+        return func(*args, **kwargs)
+    return writer.submit(func, *args, **kwargs).result()
+
+
+async def run_in_db_writer(venue: Optional[str], func, /, *args, **kwargs):
+    """Ставит функцию записи в очередь потока записи БД заведения venue
+    (None - основной БД), не занимая поток пула, и ждет фиксации
+    транзакции, в которую она попала. Время работы функции
+    пишется в метрики потоком записи"""
+    return await asyncio.wrap_future(get_writer(venue).submit(func, *args, **kwargs))
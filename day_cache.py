@@ -0,0 +1,89 @@
+import copy
+import threading
+from datetime import date
+from typing import Callable, Dict, List, Tuple
+
+from cachetools import LRUCache
+
+import settings
+
+
+class DayCache:
+    """Кэш списков резервов по заведениям и календарным дням с вытеснением
+    давно не использованных дней (LRU).
+    Используется из нескольких потоков пула БД, поэтому защищен блокировкой"""
+
+    def __init__(self, maxsize: int):
+        self._cache = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        # счетчик инвалидаций дня: не даем сохранить в кэш список,
+        # прочитанный из БД до записи, которая его изменила.
+        # Нужен только пока день загружается, поэтому хранится
+        # для дней из _loading и удаляется вместе с ними
+        self._generations: Dict[Tuple[str, date], int] = {}
+        # сколько загрузок дня сейчас идет
+        self._loading: Dict[Tuple[str, date], int] = {}
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _generation(self, key: Tuple[str, date]) -> Tuple[int, int]:
+        return self._epoch, self._generations.get(key, 0)
+
+    def get_or_load(
+        self, venue: str, day: date, load: Callable[[date, str], List]
+    ) -> List:
+        """Возвращает резервы заведения на день из кэша или загружает их
+        функцией load(day, venue). Отдаются копии объектов, чтобы изменения
+        в обработчиках не попадали в кэш в обход БД"""
+        key = (venue, day)
+        with self._lock:
+            reservations = self._cache.get(key)
+            if reservations is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                generation = self._generation(key)
+                self._loading[key] = self._loading.get(key, 0) + 1
+        if reservations is None:
+            try:
+                reservations = load(day, venue)
+            finally:
+                with self._lock:
+                    if reservations is not None and self._generation(key) == generation:
+                        self._cache[key] = reservations
+                    self._finish_loading(key)
+        return [copy.copy(reservation) for reservation in reservations]
+
+    def _finish_loading(self, key: Tuple[str, date]):
+        self._loading[key] -= 1
+        if not self._loading[key]:
+            del self._loading[key]
+            self._generations.pop(key, None)
+
+    def invalidate(self, venue: str, *days: date):
+        """Удаляет из кэша переданные дни заведения"""
+        with self._lock:
+            for day in days:
+                key = (venue, day)
+                if key in self._loading:
+                    self._generations[key] = self._generations.get(key, 0) + 1
+                self._cache.pop(key, None)
+
+    def clear(self):
+        """Очищает кэш целиком"""
+        with self._lock:
+            self._epoch += 1
+            self._cache.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики попаданий и промахов для проверки работы кэша"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._cache),
+            }
+
+
+DAY_CACHE = DayCache(maxsize=settings.DAY_CACHE_SIZE)
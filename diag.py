@@ -0,0 +1,337 @@
+"""Диагностика работающего бота без перезапуска (команда /diag).
+
+Все сборы идут в процессе бота и выключаются сами:
+- profile: cProfile потока цикла событий на N секунд;
+- sample: сэмплирование стека цикла событий из отдельного потока
+  раз в DIAG_SAMPLE_INTERVAL на N секунд, почти не замедляет бота;
+- slow: режим отладки asyncio на N секунд, собираются обратные вызовы
+  цикла событий дольше DIAG_SLOW_CALLBACK_SECONDS;
+- tasks: текущие задачи asyncio, сгруппированные по корутине
+  и месту, где они ждут;
+- mem: снимки tracemalloc, каждый следующий сравнивается с предыдущим,
+  вместе с размерами chat_data, user_data и кэшей бота.
+
+Одновременно идет только один сбор profile, sample или slow: они
+меряют один и тот же цикл событий и мешали бы друг другу"""
+import asyncio
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from typing import Awaitable, Dict, List, Optional, Tuple
+
+from telegram.ext import Application
+
+import settings
+from day_cache import DAY_CACHE
+from reservations import RENDER_CACHE
+
+PROFILE = 'profile'
+SAMPLE = 'sample'
+SLOW = 'slow'
+CAPTURES = (PROFILE, SAMPLE, SLOW)
+
+# адреса объектов и номера задач в описаниях обратных вызовов,
+# без них одинаковые вызовы группируются вместе
+HANDLE_IDS = re.compile(r'0x[0-9a-f]+|Task-\d+')
+# стандартная библиотека и зависимости выводятся без общего префикса
+LIBRARY_PATHS = tuple(sorted(
+    {os.path.dirname(os.__file__) + os.sep, *(
+        path + os.sep for path in sys.path if path.endswith('site-packages')
+    )},
+    key=len,
+    reverse=True,
+))
+
+
+class DiagnosticsBusyException(Exception):
+    """Вызываем когда сбор диагностики уже идет"""
+
+
+@functools.lru_cache(maxsize=None)
+def short_path(filename: str) -> str:
+    for prefix in LIBRARY_PATHS:
+        if filename.startswith(prefix):
+            return filename[len(prefix):]
+    return os.path.relpath(filename) if os.path.isabs(filename) else filename
+
+
+def report_header(title: str) -> List[str]:
+    return [f'{title}, {datetime.now().strftime(settings.DATETIME_FORMAT)}', '']
+
+
+class SlowCallbackCollector(logging.Handler):
+    """Собирает предупреждения asyncio о долгих обратных вызовах
+    (пишутся только в режиме отладки цикла событий)"""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        # (длительность, описание вызова)
+        self.callbacks: List[Tuple[float, str]] = []
+
+    def emit(self, record: logging.LogRecord):
+        if record.msg.startswith('Executing') and len(record.args) == 2:
+            handle, duration = record.args
+            self.callbacks.append((duration, str(handle)))
+
+
+class Diagnostics:
+    """Сборы диагностики по команде /diag. Методы вызываются
+    из цикла событий, отчеты возвращаются текстом"""
+
+    def __init__(
+        self,
+        top: int,
+        sample_interval: float,
+        slow_callback: float,
+        tracemalloc_frames: int,
+    ):
+        self.top = top
+        self.sample_interval = sample_interval
+        self.slow_callback = slow_callback
+        self.tracemalloc_frames = tracemalloc_frames
+        # какой сбор сейчас идет
+        self.running: Optional[str] = None
+        # предыдущий снимок памяти и размеры данных бота на тот момент
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._objects: Dict[str, int] = {}
+
+    def capture(self, kind: str, seconds: float) -> Awaitable[str]:
+        """Занимает сборщик и возвращает корутину сбора kind
+        (одного из CAPTURES) на seconds секунд. Вызывает
+        DiagnosticsBusyException, если другой сбор еще идет"""
+        if self.running is not None:
+            raise DiagnosticsBusyException(self.running)
+        self.running = kind
+        return self._run(kind, seconds)
+
+    async def _run(self, kind: str, seconds: float) -> str:
+        collect = {
+            PROFILE: self._profile,
+            SAMPLE: self._sample,
+            SLOW: self._slow_callbacks,
+        }[kind]
+        try:
+            return await collect(seconds)
+        finally:
+            self.running = None
+
+    async def _profile(self, seconds: float) -> str:
+        # cProfile следит только за потоком, в котором включен,
+        # то есть за всем, что выполняет цикл событий
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+        return await asyncio.to_thread(self._format_profile, profiler, seconds)
+
+    def _format_profile(self, profiler: cProfile.Profile, seconds: float) -> str:
+        stream = io.StringIO()
+        stream.write('\n'.join(report_header(f'cProfile цикла событий, {seconds:g} с')))
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(self.top)
+        return stream.getvalue()
+
+    async def _sample(self, seconds: float) -> str:
+        thread_id = threading.get_ident()
+        return await asyncio.to_thread(self._sample_thread, thread_id, seconds)
+
+    def _sample_thread(self, thread_id: int, seconds: float) -> str:
+        """Снимает стек потока thread_id раз в sample_interval.
+        Для каждой функции считает, в скольких снимках она выполнялась
+        сама (own) и была в стеке (total)"""
+        own = Counter()
+        total = Counter()
+        samples = 0
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            time.sleep(self.sample_interval)
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                break
+            samples += 1
+            code = frame.f_code
+            own[f'{code.co_name} ({short_path(code.co_filename)}:{frame.f_lineno})'] += 1
+            functions = set()
+            while frame is not None:
+                code = frame.f_code
+                functions.add(
+                    f'{code.co_name} ({short_path(code.co_filename)}:{code.co_firstlineno})'
+                )
+                frame = frame.f_back
+            total.update(functions)
+
+        lines = report_header(f'Сэмплирование цикла событий, {seconds:g} с')
+        lines.append(
+            f'Снимков стека: {samples}, раз в {self.sample_interval * 1000:g} мс. '
+            'Время в select - простой цикла событий'
+        )
+        for title, counter in (
+            ('Выполнялась сама (own):', own),
+            ('Была в стеке (total):', total),
+        ):
+            lines.extend(['', title])
+            lines.extend(
+                f'{count / samples:7.1%} {count:7} {function}'
+                for function, count in counter.most_common(self.top)
+            )
+        return '\n'.join(lines)
+
+    async def _slow_callbacks(self, seconds: float) -> str:
+        loop = asyncio.get_running_loop()
+        collector = SlowCallbackCollector()
+        asyncio_logger = logging.getLogger('asyncio')
+        debug, slow_callback = loop.get_debug(), loop.slow_callback_duration
+        asyncio_logger.addHandler(collector)
+        loop.slow_callback_duration = self.slow_callback
+        loop.set_debug(True)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            loop.set_debug(debug)
+            loop.slow_callback_duration = slow_callback
+            asyncio_logger.removeHandler(collector)
+
+        callbacks = collector.callbacks
+        lines = report_header(f'Долгие обратные вызовы цикла событий, {seconds:g} с')
+        lines.append(
+            f'Дольше {self.slow_callback * 1000:g} мс: {len(callbacks)}, '
+            f'всего {sum(duration for duration, _ in callbacks):.3f} с'
+        )
+        groups: Dict[str, List[float]] = {}
+        for duration, handle in callbacks:
+            groups.setdefault(HANDLE_IDS.sub('…', handle), []).append(duration)
+        lines.extend(['', 'По вызовам (всего с, раз, максимум с):'])
+        lines.extend(
+            f'{sum(durations):8.3f} {len(durations):5} {max(durations):8.3f}  {handle}'
+            for handle, durations in sorted(
+                groups.items(), key=lambda item: sum(item[1]), reverse=True
+            )[:self.top]
+        )
+        lines.extend(['', 'Самые долгие:'])
+        lines.extend(
+            f'{duration:8.3f}  {handle}'
+            for duration, handle in sorted(callbacks, reverse=True)[:self.top]
+        )
+        return '\n'.join(lines)
+
+    def tasks(self) -> str:
+        """Задачи asyncio, сгруппированные по корутине и месту ожидания"""
+        groups = Counter()
+        for task in asyncio.all_tasks():
+            coro = task.get_coro()
+            name = getattr(coro, '__qualname__', repr(coro))
+            stack = task.get_stack()
+            if stack:
+                frame = stack[-1]
+                name += f' ({short_path(frame.f_code.co_filename)}:{frame.f_lineno})'
+            groups[name] += 1
+        lines = report_header('Задачи asyncio')
+        lines.append(f'Всего задач: {sum(groups.values())}')
+        lines.append('')
+        lines.extend(f'{count:6}  {name}' for name, count in groups.most_common())
+        return '\n'.join(lines)
+
+    def memory_start(self, application: Application) -> bool:
+        """Включает tracemalloc и снимает первый снимок.
+        Возвращает False, если первый снимок уже снят.
+        tracemalloc может быть включен и до этого (PYTHONTRACEMALLOC),
+        тогда снимается только первый снимок"""
+        if self._snapshot is not None and tracemalloc.is_tracing():
+            return False
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.tracemalloc_frames)
+        self._snapshot = tracemalloc.take_snapshot()
+        self._objects = self.bot_objects(application)
+        return True
+
+    def memory_stop(self):
+        tracemalloc.stop()
+        self._snapshot = None
+        self._objects = {}
+
+    async def memory_report(self, application: Application) -> str:
+        """Сравнивает новый снимок памяти с предыдущим
+        и запоминает его для следующего сравнения"""
+        objects = self.bot_objects(application)
+        snapshot = await asyncio.to_thread(tracemalloc.take_snapshot)
+        previous, self._snapshot = self._snapshot, snapshot
+        previous_objects, self._objects = self._objects, objects
+        return await asyncio.to_thread(
+            self._format_memory, snapshot, previous, objects, previous_objects
+        )
+
+    def _format_memory(
+        self,
+        snapshot: tracemalloc.Snapshot,
+        previous: tracemalloc.Snapshot,
+        objects: Dict[str, int],
+        previous_objects: Dict[str, int],
+    ) -> str:
+        current, peak = tracemalloc.get_traced_memory()
+        lines = report_header('Память')
+        lines.append(
+            f'Отслеживается: {current / 2**20:.1f} МБ, пик {peak / 2**20:.1f} МБ'
+        )
+        lines.extend(['', 'Данные бота (изменение с прошлого снимка):'])
+        lines.extend(
+            f'{name}: {count} ({count - previous_objects.get(name, 0):+})'
+            for name, count in objects.items()
+        )
+
+        filters = (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        )
+        snapshot = snapshot.filter_traces(filters)
+        previous = previous.filter_traces(filters)
+        lines.extend(['', 'Рост по строкам:'])
+        lines.extend(
+            str(stat) for stat in snapshot.compare_to(previous, 'lineno')[:self.top]
+        )
+        lines.extend(['', 'Рост по стекам вызовов:'])
+        for stat in snapshot.compare_to(previous, 'traceback')[:self.top // 4]:
+            lines.append('')
+            lines.append(
+                f'{stat.size_diff / 1024:+.1f} КБ, {stat.count_diff:+} блоков'
+            )
+            lines.extend(stat.traceback.format(most_recent_first=True))
+        return '\n'.join(lines)
+
+    @staticmethod
+    def bot_objects(application: Application) -> Dict[str, int]:
+        """Размеры данных бота, которые растут с числом чатов и кнопок"""
+        callback_data_cache = application.bot.callback_data_cache
+        return {
+            'chat_data, чатов': len(application.chat_data),
+            'chat_data, ключей': sum(len(data) for data in application.chat_data.values()),
+            'user_data, пользователей': len(application.user_data),
+            'кэш callback_data, клавиатур': (
+                len(callback_data_cache.persistence_data[0])
+                if callback_data_cache is not None else 0
+            ),
+            'кэш резервов по дням, дней': DAY_CACHE.stats()['size'],
+            'кэш карточек резервов': len(RENDER_CACHE),
+            'задач asyncio': len(asyncio.all_tasks()),
+        }
+
+
+DIAGNOSTICS = Diagnostics(
+    top=settings.DIAG_TOP,
+    sample_interval=settings.DIAG_SAMPLE_INTERVAL,
+    slow_callback=settings.DIAG_SLOW_CALLBACK_SECONDS,
+    tracemalloc_frames=settings.DIAG_TRACEMALLOC_FRAMES,
+)
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+
+@dataclass
+class HTTPRequest:
+    """Входящий HTTP-запрос"""
+    method: str
+    path: str
+    query: Dict[str, List[str]]
+    headers: Dict[str, str]
+    body: bytes = b''
+
+
+@dataclass
+class HTTPResponse:
+    """Ответ на HTTP-запрос"""
+    status: int = 200
+    body: bytes = b''
+    content_type: str = 'text/plain; charset=utf-8'
+    headers: Dict[str, str] = field(default_factory=dict)
+
+
+RequestHandler = Callable[[HTTPRequest], Awaitable[HTTPResponse]]
+# проверка запроса по заголовкам до чтения тела: ответ, если запрос
+# отклонен, иначе None
+HeadersCheck = Callable[[HTTPRequest], Optional[HTTPResponse]]
+# размер тела запроса по умолчанию
+DEFAULT_MAX_BODY_SIZE = 1024 * 1024
+
+
+class HTTPServer:
+    """Минимальный асинхронный HTTP/1.1 сервер на asyncio.
+    Поддерживает keep-alive и тела запросов с Content-Length -
+    этого достаточно для вебхуков Telegram, метрик и локальных тестов.
+
+    Тело читается в память, только если Content-Length корректен
+    (иначе 400), не больше max_body_size (иначе 413) и запрос прошел
+    check_headers: так клиент без секретного токена вебхука не заставит
+    сервер буферизовать тело. После такого отказа соединение закрывается,
+    тело не дочитывается"""
+
+    def __init__(
+        self,
+        handler: RequestHandler,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        max_body_size: int = DEFAULT_MAX_BODY_SIZE,
+        check_headers: Optional[HeadersCheck] = None,
+    ):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.max_body_size = max_body_size
+        self.check_headers = check_headers
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        """Начинает принимать соединения. Если порт 0 - выбирается свободный,
+        и после запуска он доступен в self.port"""
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info(f'HTTP server listening on {self.host}:{self.port}')
+
+    async def stop(self):
+        """Перестает принимать соединения"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _read_request(
+        self, reader: asyncio.StreamReader
+    ) -> Tuple[Optional[HTTPRequest], Optional[HTTPResponse]]:
+        """Читает запрос. Возвращает (None, None), если клиент закрыл
+        соединение, и ответ вместо вызова handler, если запрос отклонен
+        до чтения тела"""
+        request_line = await reader.readline()
+        if not request_line:
+            return None, None
+        method, target, version = request_line.decode('latin-1').split()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if version != 'HTTP/1.1':
+            headers.setdefault('connection', 'close')
+        url = urlsplit(target)
+        request = HTTPRequest(method, url.path, parse_qs(url.query), headers)
+        length = headers.get('content-length', '0')
+        if not (length.isascii() and length.isdigit()):
+            rejection = HTTPResponse(400, b'Bad Request')
+        elif self.check_headers is not None:
+            rejection = self.check_headers(request)
+        else:
+            rejection = None
+        if rejection is None and int(length) > self.max_body_size:
+            rejection = HTTPResponse(413, b'Payload Too Large')
+        if rejection is not None:
+            # тело не прочитано: следующий запрос в этом соединении не найти
+            headers['connection'] = 'close'
+            return request, rejection
+        if int(length):
+            request.body = await reader.readexactly(int(length))
+        return request, None
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        try:
+            while True:
+                request, response = await self._read_request(reader)
+                if request is None:
+                    break
+                if response is None:
+                    try:
+                        response = await self.handler(request)
+                    except Exception:
+                        logging.exception(
+                            f'Error when handling {request.method} {request.path}'
+                        )
+                        response = HTTPResponse(500, b'Internal Server Error')
+                keep_alive = request.headers.get('connection', '').lower() != 'close'
+                head = [
+                    f'HTTP/1.1 {response.status} {HTTPStatus(response.status).phrase}',
+                    f'Content-Type: {response.content_type}',
+                    f'Content-Length: {len(response.body)}',
+                    'Connection: {}'.format('keep-alive' if keep_alive else 'close'),
+                ]
+                head.extend(f'{name}: {value}' for name, value in response.headers.items())
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + response.body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # сервер останавливается вместе с циклом событий
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,235 @@
+"""Массовый импорт и экспорт резервов в CSV и JSONL.
+
+Файлы читаются и пишутся потоково: записи проходят через генераторы,
+в БД вставляются пачками по IMPORT_BATCH_SIZE через executemany,
+при экспорте строки берутся из курсора по одной.
+Время визита в файлах - в формате settings.DATETIME_FORMAT.
+
+Запуск из корня репозитория (бот держит кэш резервов по дням,
+поэтому импорт из командной строки лучше делать при остановленном боте,
+а на работающем - отправив файл боту с подписью /import):
+    python import_export.py import bookings.csv
+    python import_export.py export reservations.jsonl
+"""
+import argparse
+import csv
+import json
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+from itertools import islice
+from typing import IO, Iterable, Iterator, List, Optional
+
+import settings
+from database import get_connection, get_write_connection, write
+from day_cache import DAY_CACHE
+from validators import InvalidDatetimeException, datetime_format_validator
+
+# колонки файлов импорта и экспорта
+FILE_COLUMNS = ('guest_name', 'date_time', 'info', 'user_added', 'visited')
+FORMATS = ('csv', 'jsonl')
+# автор резерва, если в файле он не указан
+IMPORT_USER_ADDED = 'import'
+
+
+@dataclass
+class ImportResult:
+    """Итог импорта: сколько записей добавлено, сколько пропущено и почему"""
+    imported: int = 0
+    skipped: int = 0
+    errors: List[str] = field(default_factory=list)
+
+    def add_error(self, record_number: int, message: str):
+        self.skipped += 1
+        if len(self.errors) < settings.IMPORT_MAX_REPORTED_ERRORS:
+            self.errors.append(f'record {record_number}: {message}')
+
+
+def file_format(path: str) -> str:
+    """Определяет формат файла по расширению"""
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    if extension not in FORMATS:
+        raise ValueError(f'Unsupported file format: {path}')
+    return extension
+
+
+def read_csv(file: IO[str]) -> Iterator[dict]:
+    """Читает записи из CSV с заголовком. Разделитель (запятая,
+    точка с запятой или табуляция) определяется по первой строке"""
+    header = file.readline()
+    try:
+        dialect = csv.Sniffer().sniff(header, delimiters=',;\t')
+    except csv.Error:
+        # одна колонка - разделитель не определить
+        dialect = csv.excel
+    columns = next(csv.reader([header], dialect))
+    yield from csv.DictReader(file, fieldnames=columns, dialect=dialect)
+
+
+def read_jsonl(file: IO[str]) -> Iterator[Optional[dict]]:
+    """Читает записи из JSONL, пустые строки пропускаются.
+    Вместо строки с некорректным JSON отдается None"""
+    for line in file:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                yield None
+
+
+def text_field(record: dict, name: str, default: str = '') -> str:
+    """Возвращает строковое поле записи, default - если его нет или оно пустое.
+    В JSONL вместо строки может оказаться число или объект:
+    такую запись нельзя передать в БД"""
+    value = record.get(name)
+    if value is None or value == '':
+        return default
+    if not isinstance(value, str):
+        raise ValueError(f'{name} must be a string, got {type(value).__name__}')
+    return value
+
+
+def visited_field(record: dict) -> int:
+    """Возвращает отметку о визите: 0 или 1 (в CSV - строкой)"""
+    value = record.get('visited')
+    if isinstance(value, str):
+        value = value.strip()
+    if value is None or value == '':
+        return 0
+    if isinstance(value, bool):
+        return int(value)
+    if value in (0, 1, '0', '1') and not isinstance(value, float):
+        return int(value)
+    raise ValueError(f'visited must be 0 or 1, got {value!r}')
+
+
+def validated_rows(records: Iterable[dict], result: ImportResult) -> Iterator[tuple]:
+    """Проверяет каждое поле записи и превращает запись в строку для INSERT.
+    Записи с ошибками пропускаются и попадают в result, поэтому
+    пачка, в которую пошли остальные записи, вставляется целиком.
+    Время визита в прошлом допустимо: импортируется и история"""
+    for record_number, record in enumerate(records, start=1):
+        date_time = None
+        try:
+            if not isinstance(record, dict):
+                raise ValueError('not a JSON object')
+            guest_name = text_field(record, 'guest_name').strip()
+            if not guest_name:
+                raise ValueError('empty guest_name')
+            date_time = text_field(record, 'date_time').strip()
+            datetime_format_validator(date_time)
+            yield (
+                guest_name,
+                datetime.strptime(date_time, settings.DATETIME_FORMAT).strftime(
+                    settings.DATETIME_DB_FORMAT
+                ),
+                text_field(record, 'info'),
+                text_field(record, 'user_added', IMPORT_USER_ADDED),
+                visited_field(record),
+            )
+        except InvalidDatetimeException:
+            result.add_error(record_number, f'invalid date_time {date_time!r}')
+        except (ValueError, TypeError, AttributeError) as error:
+            result.add_error(record_number, str(error))
+
+
+def batched(rows: Iterable[tuple], size: int) -> Iterator[List[tuple]]:
+    """Делит поток строк на списки по size штук"""
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def insert_rows(rows: List[tuple], venue: str):
+    """Функция вставляет пачку проверенных строк в БД заведения"""
+    get_write_connection(venue).executemany(
+        """
+        INSERT INTO reservations
+        (guest_name, date_time, info, user_added, visited)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        rows
+    )
+
+
+def import_reservations(
+    path: str,
+    batch_size: int = settings.IMPORT_BATCH_SIZE,
+    venue: str = settings.DEFAULT_VENUE,
+) -> ImportResult:
+    """Функция импортирует резервы из CSV или JSONL файла в БД заведения.
+    Каждая пачка - отдельная запись в очереди потока записи БД"""
+    result = ImportResult()
+    reader = read_csv if file_format(path) == 'csv' else read_jsonl
+    try:
+        # utf-8-sig: CSV из Excel начинается с BOM
+        with open(path, encoding='utf-8-sig', newline='') as file:
+            for batch in batched(validated_rows(reader(file), result), batch_size):
+                write(venue, insert_rows, batch, venue)
+                result.imported += len(batch)
+    finally:
+        # новые резервы могли попасть в любые дни
+        DAY_CACHE.clear()
+    return result
+
+
+def exported_records(connection) -> Iterator[dict]:
+    """Отдает резервы (включая архив) по одному в порядке времени визита"""
+    cursor = connection.execute(
+        """
+        SELECT guest_name, date_time, info, user_added, visited
+        FROM all_reservations
+        ORDER BY date_time
+        """
+    )
+    for guest_name, date_time, info, user_added, visited in cursor:
+        yield {
+            'guest_name': guest_name,
+            'date_time': datetime.strptime(
+                date_time, settings.DATETIME_DB_FORMAT
+            ).strftime(settings.DATETIME_FORMAT),
+            'info': info,
+            'user_added': user_added,
+            'visited': visited,
+        }
+
+
+def export_reservations(path: str, venue: str = settings.DEFAULT_VENUE) -> int:
+    """Функция записывает все резервы заведения в CSV или JSONL файл
+    и возвращает количество записей"""
+    fmt = file_format(path)
+    count = 0
+    # utf-8-sig: без BOM Excel не распознает кириллицу в CSV
+    encoding = 'utf-8-sig' if fmt == 'csv' else 'utf-8'
+    with open(path, 'w', encoding=encoding, newline='') as file:
+        if fmt == 'csv':
+            writer = csv.DictWriter(file, fieldnames=FILE_COLUMNS)
+            writer.writeheader()
+            write_row = writer.writerow
+        else:
+            def write_row(record: dict):
+                file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        for record in exported_records(get_connection(venue)):
+            write_row(record)
+            count += 1
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Импорт и экспорт резервов')
+    parser.add_argument('command', choices=('import', 'export'))
+    parser.add_argument('path', help='файл .csv или .jsonl')
+    parser.add_argument('--venue', default=settings.DEFAULT_VENUE)
+    args = parser.parse_args()
+    if args.command == 'import':
+        from migrations import migrate_venues
+        migrate_venues()
+        result = import_reservations(args.path, venue=args.venue)
+        print(f'Imported: {result.imported}, skipped: {result.skipped}')
+        for error in result.errors:
+            print(f'  {error}')
+    else:
+        print(f'Exported: {export_reservations(args.path, venue=args.venue)}')
@@ -0,0 +1,284 @@
+"""Локальная замена HTTP API Telegram для нагрузочного тестирования.
+
+Реализует методы, которыми пользуется бот (getUpdates, sendMessage,
+editMessageText, editMessageReplyMarkup, answerCallbackQuery и служебные
+getMe / setWebhook / deleteWebhook), хранит отправленные ботом сообщения
+и позволяет подкладывать боту апдейты от имени пользователей.
+Бот подключается к ней через TELEGRAM_API_URL=http://host:port/bot.
+После setWebhook апдейты не отдаются через getUpdates, а отправляются
+POST-запросами на адрес вебхука с секретным токеном, как это делает Telegram
+"""
+import asyncio
+import itertools
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qs
+
+import httpx
+
+from http_server import HTTPRequest, HTTPResponse, HTTPServer
+
+BOT_USER = {
+    'id': 1,
+    'is_bot': True,
+    'first_name': 'Reservations Bot',
+    'username': 'fake_reservations_bot',
+}
+
+# параметры методов, которые PTB передает в JSON (строки идут как есть)
+JSON_PARAMETERS = {
+    'chat_id', 'message_id', 'reply_markup', 'offset', 'limit', 'timeout',
+    'allowed_updates', 'entities', 'disable_web_page_preview',
+    'disable_notification', 'show_alert', 'cache_time',
+    'max_connections', 'drop_pending_updates',
+}
+
+
+@dataclass
+class BotCall:
+    """Вызов метода API ботом"""
+    method: str
+    params: dict
+    received_at: float = field(default_factory=time.perf_counter)
+
+
+class FakeBotAPI:
+    """Фейковый Bot API: очередь апдейтов для getUpdates
+    и журнал вызовов бота по чатам"""
+
+    def __init__(self, latency: float = 0.0):
+        # искусственная задержка ответа, имитирующая сеть до Telegram
+        self.latency = latency
+        self.server = HTTPServer(self.handle)
+        self.calls: Dict[int, List[BotCall]] = {}
+        self.messages: Dict[int, dict] = {}
+        self._updates: asyncio.Queue = asyncio.Queue()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._changed = asyncio.Condition()
+        self._webhook_poster: Optional[asyncio.Task] = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self.server.host}:{self.server.port}/bot'
+
+    async def start(self):
+        await self.server.start()
+
+    async def stop(self):
+        await self._stop_webhook()
+        await self.server.stop()
+
+    # --- апдейты от пользователей ---
+
+    def _user(self, chat_id: int) -> dict:
+        return {'id': chat_id, 'is_bot': False, 'first_name': f'Staff {chat_id}'}
+
+    def _chat(self, chat_id: int) -> dict:
+        return {'id': chat_id, 'type': 'private', 'first_name': f'Staff {chat_id}'}
+
+    def send_text(self, chat_id: int, text: str) -> float:
+        """Кладет в очередь сообщение пользователя. Возвращает время отправки"""
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': self._chat(chat_id),
+            'from': self._user(chat_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            command = text.split()[0]
+            message['entities'] = [
+                {'type': 'bot_command', 'offset': 0, 'length': len(command)}
+            ]
+        self._updates.put_nowait(
+            {'update_id': next(self._update_ids), 'message': message}
+        )
+        return time.perf_counter()
+
+    def press_button(self, chat_id: int, message_id: int, callback_data: str) -> float:
+        """Кладет в очередь нажатие инлайн-кнопки под сообщением бота"""
+        self._updates.put_nowait({
+            'update_id': next(self._update_ids),
+            'callback_query': {
+                'id': str(next(self._update_ids)),
+                'from': self._user(chat_id),
+                'chat_instance': str(chat_id),
+                'message': self.messages[message_id],
+                'data': callback_data,
+            },
+        })
+        return time.perf_counter()
+
+    def find_button(self, message_id: int, text: str) -> str:
+        """Возвращает callback_data кнопки с переданным текстом"""
+        keyboard = self.messages[message_id].get('reply_markup', {})
+        for row in keyboard.get('inline_keyboard', []):
+            for button in row:
+                if button['text'] == text:
+                    return button['callback_data']
+        raise KeyError(text)
+
+    async def wait_for(
+        self,
+        chat_id: int,
+        predicate: Callable[[BotCall], bool],
+        start: int = 0,
+        timeout: float = 30,
+    ) -> BotCall:
+        """Ждет вызова бота в чате chat_id, начиная с номера start,
+        для которого predicate вернет True"""
+        async def wait():
+            async with self._changed:
+                while True:
+                    for call in self.calls.get(chat_id, [])[start:]:
+                        if predicate(call):
+                            return call
+                    await self._changed.wait()
+        return await asyncio.wait_for(wait(), timeout)
+
+    def calls_count(self, chat_id: int) -> int:
+        return len(self.calls.get(chat_id, []))
+
+    # --- методы Bot API ---
+
+    async def handle(self, request: HTTPRequest) -> HTTPResponse:
+        method = request.path.rsplit('/', 1)[-1]
+        params = self._parse_params(request)
+        handler = getattr(self, f'api_{method}', None)
+        result = await handler(params) if handler else True
+        if method != 'getUpdates' and self.latency:
+            await asyncio.sleep(self.latency)
+        return HTTPResponse(
+            body=json.dumps({'ok': True, 'result': result}).encode(),
+            content_type='application/json',
+        )
+
+    def _parse_params(self, request: HTTPRequest) -> dict:
+        content_type = request.headers.get('content-type', '')
+        if not content_type.startswith('application/x-www-form-urlencoded'):
+            # файлы (multipart) в нагрузочном сценарии не разбираются
+            return {}
+        params = {}
+        for name, values in parse_qs(request.body.decode()).items():
+            value = values[0]
+            params[name] = json.loads(value) if name in JSON_PARAMETERS else value
+        return params
+
+    async def _record(self, chat_id: int, method: str, params: dict):
+        async with self._changed:
+            self.calls.setdefault(chat_id, []).append(BotCall(method, params))
+            self._changed.notify_all()
+
+    async def api_getMe(self, params: dict):
+        return BOT_USER
+
+    async def api_getUpdates(self, params: dict):
+        timeout = params.get('timeout', 0)
+        updates = []
+        try:
+            updates.append(await asyncio.wait_for(self._updates.get(), timeout or 0.01))
+        except asyncio.TimeoutError:
+            return []
+        while not self._updates.empty() and len(updates) < params.get('limit', 100):
+            updates.append(self._updates.get_nowait())
+        return updates
+
+    async def api_sendMessage(self, params: dict):
+        chat_id = params['chat_id']
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': self._chat(chat_id),
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+        if isinstance(params.get('reply_markup'), dict) and 'inline_keyboard' in params['reply_markup']:
+            message['reply_markup'] = params['reply_markup']
+        self.messages[message['message_id']] = message
+        await self._record(chat_id, 'sendMessage', dict(params, message_id=message['message_id']))
+        return message
+
+    async def _edit_message(self, method: str, params: dict):
+        message = self.messages.get(params.get('message_id'))
+        if message is None:
+            return True
+        if 'text' in params:
+            message['text'] = params['text']
+        if isinstance(params.get('reply_markup'), dict):
+            message['reply_markup'] = params['reply_markup']
+        else:
+            message.pop('reply_markup', None)
+        await self._record(message['chat']['id'], method, params)
+        return message
+
+    async def api_editMessageText(self, params: dict):
+        return await self._edit_message('editMessageText', params)
+
+    async def api_editMessageReplyMarkup(self, params: dict):
+        return await self._edit_message('editMessageReplyMarkup', params)
+
+    async def api_answerCallbackQuery(self, params: dict):
+        return True
+
+    # --- вебхук ---
+
+    async def api_setWebhook(self, params: dict):
+        await self._stop_webhook()
+        self._webhook_poster = asyncio.create_task(
+            self._post_updates(params['url'], params.get('secret_token'))
+        )
+        return True
+
+    async def api_deleteWebhook(self, params: dict):
+        await self._stop_webhook()
+        return True
+
+    async def _stop_webhook(self):
+        if self._webhook_poster is not None:
+            self._webhook_poster.cancel()
+            try:
+                await self._webhook_poster
+            except asyncio.CancelledError:
+                pass
+            self._webhook_poster = None
+
+    async def _post_updates(self, url: str, secret_token: Optional[str]):
+        """Отправляет апдейты из очереди на вебхук бота по одному,
+        повторяя отправку, пока бот не ответит 200"""
+        headers = {'X-Telegram-Bot-Api-Secret-Token': secret_token} if secret_token else {}
+        async with httpx.AsyncClient(headers=headers) as client:
+            while True:
+                update = await self._updates.get()
+                while True:
+                    try:
+                        response = await client.post(url, json=update)
+                        if response.status_code == 200:
+                            break
+                        logging.warning(f'Webhook answered {response.status_code}')
+                    except httpx.HTTPError as error:
+                        logging.warning(f'Webhook is unavailable: {error!r}')
+                    await asyncio.sleep(0.5)
+
+
+async def serve(port: int, latency: float = 0.0, api: Optional[FakeBotAPI] = None):
+    """Запускает фейковый API и работает до остановки процесса"""
+    api = api or FakeBotAPI(latency)
+    api.server.port = port
+    await api.start()
+    print(f'Fake Bot API: TELEGRAM_API_URL={api.base_url}')
+    await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Фейковый Telegram Bot API')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='задержка ответа в секундах')
+    args = parser.parse_args()
+    asyncio.run(serve(args.port, args.latency))
@@ -0,0 +1,267 @@
+"""Нагрузочный тест бота на фейковом Bot API.
+
+Поднимает loadtest.fake_bot_api, запускает bot.py отдельным процессом
+с временной БД и TELEGRAM_API_URL, указывающим на фейковый API,
+и гоняет N параллельных чатов сотрудников по сценарию: добавление
+резерва, его редактирование, кнопки списков. Для каждого шага меряется
+время от отправки апдейта до последнего ответа бота на этот шаг.
+
+Запуск из корня репозитория:
+    python -m loadtest.load --chats 20 --iterations 5 --latency 0.05
+    python -m loadtest.load --webhook   # бот в режиме вебхука
+"""
+import argparse
+import asyncio
+import os
+import random
+import secrets
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List
+
+import settings
+from loadtest.fake_bot_api import BotCall, FakeBotAPI
+from migrations import migrate
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRST_CHAT_ID = 1000
+# резервов на сегодня и на завтра в начальной БД: больше
+# NUMBER_OF_RESERVES_BEFORE_LIST, чтобы выдача приходила одним списком
+SEEDED_PER_DAY = 10
+# сколько секунд ждать ответа бота на шаг сценария
+STEP_TIMEOUT = 30
+# сколько секунд дать боту на остановку
+BOT_STOP_TIMEOUT = 5
+
+
+def text_is(text: str) -> Callable[[BotCall], bool]:
+    return lambda call: call.method == 'sendMessage' and call.params.get('text') == text
+
+
+def text_starts_with(prefix: str) -> Callable[[BotCall], bool]:
+    return lambda call: (
+        call.method == 'sendMessage'
+        and call.params.get('text', '').startswith(prefix)
+    )
+
+
+def has_inline_button(text: str) -> Callable[[BotCall], bool]:
+    def predicate(call: BotCall) -> bool:
+        keyboard = call.params.get('reply_markup')
+        if not isinstance(keyboard, dict):
+            return False
+        return any(
+            button['text'] == text
+            for row in keyboard.get('inline_keyboard', [])
+            for button in row
+        )
+    return predicate
+
+
+def edited(message_id: int) -> Callable[[BotCall], bool]:
+    return lambda call: (
+        call.method == 'editMessageText'
+        and call.params.get('message_id') == message_id
+    )
+
+
+class StaffChat:
+    """Чат одного сотрудника, проходящий сценарий и копящий замеры"""
+
+    def __init__(self, api: FakeBotAPI, chat_id: int, latencies: Dict[str, List[float]]):
+        self.api = api
+        self.chat_id = chat_id
+        self.latencies = latencies
+        self.rng = random.Random(chat_id)
+        self.timed_out = False
+
+    async def step(self, name: str, send: Callable[[], float], done: Callable[[BotCall], bool]) -> BotCall:
+        """Отправляет апдейт и ждет ответа бота, завершающего шаг"""
+        start = self.api.calls_count(self.chat_id)
+        sent_at = send()
+        call = await self.api.wait_for(self.chat_id, done, start, STEP_TIMEOUT)
+        self.latencies.setdefault(name, []).append(call.received_at - sent_at)
+        return call
+
+    def text(self, text: str) -> Callable[[], float]:
+        return lambda: self.api.send_text(self.chat_id, text)
+
+    def press(self, message_id: int, button_text: str) -> Callable[[], float]:
+        return lambda: self.api.press_button(
+            self.chat_id, message_id, self.api.find_button(message_id, button_text)
+        )
+
+    async def add_and_edit_reservation(self):
+        visit = datetime.combine(
+            date.today() + timedelta(days=self.rng.randint(2, 60)),
+            datetime.min.time(),
+        ) + timedelta(hours=self.rng.randint(10, 21))
+        await self.step('add: start', self.text(settings.NEW_RESERVE_BUTTON),
+                        text_is(settings.RESERVER_ADDITION_GUEST_NAME))
+        await self.step('add: guest name', self.text(f'Гость {self.chat_id}'),
+                        text_is(settings.RESERVER_ADDITION_TIME))
+        await self.step('add: date time', self.text(visit.strftime(settings.DATETIME_FORMAT)),
+                        text_is(settings.RESERVER_ADDITION_MORE_INFO))
+        await self.step('add: info', self.text('Стол 5, 4 гостя'),
+                        text_starts_with('<b>Имя гостя:</b>'))
+        start = self.api.calls_count(self.chat_id)
+        await self.step('add: save', self.text('Сохранить'),
+                        text_is(settings.NOTIFY_ALL_CONFIRMATION))
+        card = await self.api.wait_for(
+            self.chat_id, has_inline_button('Изменить бронь'), start
+        )
+        card_id = card.params['message_id']
+
+        await self.step('edit: open', self.press(card_id, 'Изменить бронь'),
+                        edited(card_id))
+        await self.step('edit: choose info', self.press(card_id, 'Детали'),
+                        text_starts_with('Детали:'))
+        await self.step('edit: save', self.text('Стол 6, 5 гостей'),
+                        text_is(settings.NOTIFY_ALL_CONFIRMATION))
+
+    async def listings(self):
+        await self.step('list: today', self.text(settings.TODAY_RESERVES_BUTTON),
+                        text_is('Резервы:'))
+        await self.step('list: all', self.text(settings.ALL_RESERVES_BUTTON),
+                        text_is('Резервы:'))
+        await self.step('list: per date', self.text(settings.RESERVES_PER_DATE_BUTTON),
+                        text_is(settings.ASK_FOR_DATE))
+        tomorrow = (date.today() + timedelta(days=1)).strftime('%d.%m.%Y')
+        await self.step('list: per date answer', self.text(tomorrow),
+                        text_is('Резервы:'))
+
+    async def run(self, iterations: int):
+        try:
+            await self.step('start', self.text('/start'), text_is(settings.GREETINGS))
+            for _ in range(iterations):
+                await self.add_and_edit_reservation()
+                await self.listings()
+        except asyncio.TimeoutError:
+            # бот не ответил на шаг - дальше сценарий этого чата не пройти
+            self.timed_out = True
+
+
+def seed_db(db_path: str):
+    """Создает БД с резервами на сегодня и завтра"""
+    migrate(db_path)
+    connection = sqlite3.connect(db_path)
+    with connection:
+        for day in (date.today(), date.today() + timedelta(days=1)):
+            connection.executemany(
+                """INSERT INTO reservations
+                   (guest_name, date_time, info, user_added, visited)
+                   VALUES (?, ?, ?, ?, 0)""",
+                (
+                    (
+                        f'Гость {i}',
+                        (datetime.combine(day, datetime.min.time())
+                         + timedelta(hours=10, minutes=30 * i)
+                         ).strftime(settings.DATETIME_DB_FORMAT),
+                        'Стол 1',
+                        '@seed',
+                    )
+                    for i in range(SEEDED_PER_DAY)
+                )
+            )
+    connection.close()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], share: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def report(latencies: Dict[str, List[float]], elapsed: float, chats: List[StaffChat]):
+    total = sum(len(values) for values in latencies.values())
+    timed_out = sum(chat.timed_out for chat in chats)
+    print(f'\n{len(chats)} chats, {total} steps in {elapsed:.1f} s: '
+          f'{total / elapsed:.1f} steps/s, {timed_out} chats timed out')
+    print(f'{"step":<24}{"count":>7}{"p50, ms":>10}{"p99, ms":>10}{"max, ms":>10}')
+    all_values = []
+    for name, values in latencies.items():
+        all_values.extend(values)
+        print(f'{name:<24}{len(values):>7}'
+              f'{statistics.median(values) * 1000:>10.1f}'
+              f'{percentile(values, 0.99) * 1000:>10.1f}'
+              f'{max(values) * 1000:>10.1f}')
+    print(f'{"all":<24}{len(all_values):>7}'
+          f'{statistics.median(all_values) * 1000:>10.1f}'
+          f'{percentile(all_values, 0.99) * 1000:>10.1f}'
+          f'{max(all_values) * 1000:>10.1f}')
+
+
+async def main(args):
+    api = FakeBotAPI(latency=args.latency)
+    await api.start()
+    workdir = tempfile.mkdtemp(prefix='reservations_load_')
+    db_path = os.path.join(workdir, 'reservations.db')
+    seed_db(db_path)
+    env = dict(
+        os.environ,
+        TELEGRAM_BOT_TOKEN='123456:FAKE',
+        TELEGRAM_API_URL=api.base_url,
+        DB_PATH=db_path,
+        ADMIN_TG_ID=str(FIRST_CHAT_ID),
+    )
+    if args.webhook:
+        port = free_port()
+        env.update(
+            BOT_MODE='webhook',
+            HTTP_PORT=str(port),
+            WEBHOOK_URL=f'http://127.0.0.1:{port}/telegram',
+            WEBHOOK_PATH='/telegram',
+            WEBHOOK_SECRET_TOKEN=secrets.token_urlsafe(32),
+        )
+    bot_process = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_DIR, 'bot.py')],
+        cwd=workdir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL if not args.verbose else None,
+    )
+    try:
+        latencies: Dict[str, List[float]] = {}
+        chats = [
+            StaffChat(api, FIRST_CHAT_ID + i, latencies)
+            for i in range(args.chats)
+        ]
+        started_at = time.perf_counter()
+        await asyncio.gather(*(chat.run(args.iterations) for chat in chats))
+        report(latencies, time.perf_counter() - started_at, chats)
+    finally:
+        bot_process.terminate()
+        try:
+            bot_process.wait(timeout=BOT_STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            # бот дожидается фоновых рассылок - для замера они не нужны
+            bot_process.kill()
+            bot_process.wait()
+        await api.stop()
+    print(f'\nБД и bot.log прогона: {workdir}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Нагрузочный тест бота')
+    parser.add_argument('--chats', type=int, default=10,
+                        help='количество одновременных чатов сотрудников')
+    parser.add_argument('--iterations', type=int, default=3,
+                        help='сколько раз каждый чат проходит сценарий')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='задержка ответа фейкового API в секундах')
+    parser.add_argument('--webhook', action='store_true',
+                        help='запустить бота в режиме вебхука')
+    parser.add_argument('--verbose', action='store_true',
+                        help='показывать stderr бота')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,138 @@
+"""Настройка логирования бота.
+
+Обработчики бота только кладут записи в очередь (QueueHandler),
+а в файл и stderr их пишет отдельный поток QueueListener, поэтому
+запись на диск и сжатие старых логов не задерживают цикл событий.
+Файл LOG_FILE ротируется по размеру (LOG_MAX_BYTES) и в полночь,
+старые файлы сжимаются в gzip: bot.log.1.gz, bot.log.2.gz, ...
+
+С LOG_FORMAT=json каждая запись - одна строка JSON с id чата
+и именем обработчика, во время работы которого она записана,
+а записи о завершении обработки апдейта - еще и с его длительностью"""
+import atexit
+import contextvars
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+import settings
+
+TEXT_FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
+# поля, которые обработчики бота добавляют к записям (см. log_context)
+CONTEXT_FIELDS = ('chat_id', 'handler', 'duration_ms')
+
+# чат и обработчик апдейта, который сейчас обрабатывается в этой задаче
+_log_context: contextvars.ContextVar[dict] = contextvars.ContextVar(
+    'log_context', default={}
+)
+
+
+@contextmanager
+def log_context(**fields):
+    """Добавляет поля ко всем записям, сделанным внутри блока
+    (в том числе в задачах, созданных из него)"""
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Переносит поля log_context в атрибуты записи. Стоит на QueueHandler,
+    то есть выполняется в той задаче, которая пишет в лог"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for name, value in _log_context.get().items():
+            if not hasattr(record, name):
+                setattr(record, name, value)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога в виде одной строки JSON. Трейсбек исключения
+    QueueHandler уже добавил к тексту сообщения"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for name in CONTEXT_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class CompressingRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler, который ротирует файл еще и в полночь
+    и сжимает старые файлы в gzip"""
+
+    def __init__(self, filename: str, max_bytes: int, backup_count: int, daily: bool):
+        super().__init__(
+            filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+        )
+        self.daily = daily
+        self.rollover_at = self.next_midnight()
+
+    @staticmethod
+    def next_midnight() -> float:
+        tomorrow = datetime.now().date() + timedelta(days=1)
+        return datetime.combine(tomorrow, datetime.min.time()).timestamp()
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.daily and time.time() >= self.rollover_at:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = self.next_midnight()
+
+    def rotation_filename(self, default_name: str) -> str:
+        return default_name + '.gz'
+
+    def rotate(self, source: str, dest: str):
+        with open(source, 'rb') as log_file, gzip.open(dest, 'wb') as compressed:
+            shutil.copyfileobj(log_file, compressed)
+        os.remove(source)
+
+
+def setup_logging(level: int = logging.INFO) -> QueueListener:
+    """Направляет логи через очередь в файл и stderr.
+    Возвращает запущенный QueueListener, он останавливается при выходе"""
+    formatter = (
+        JsonFormatter() if settings.LOG_FORMAT == 'json'
+        else logging.Formatter(TEXT_FORMAT)
+    )
+    file_handler = CompressingRotatingFileHandler(
+        settings.LOG_FILE,
+        max_bytes=settings.LOG_MAX_BYTES,
+        backup_count=settings.LOG_BACKUP_COUNT,
+        daily=settings.LOG_ROTATE_DAILY,
+    )
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.handlers = [queue_handler]
+
+    listener = QueueListener(log_queue, file_handler, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,250 @@
+"""Метрики бота в формате Prometheus.
+
+Гистограммы времени работы обработчиков апдейтов, запросов к БД
+и запросов к Telegram Bot API, счетчики рассылок. Отдаются
+HTTP-сервером бота на /metrics (см. bot_server.py), p99 считается
+на стороне Prometheus, например:
+    histogram_quantile(0.99, sum by (le, handler)
+        (rate(bot_handler_duration_seconds_bucket[5m])))
+
+Запросы к БД выполняются в пуле потоков, поэтому метрики
+защищены блокировкой"""
+import functools
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+
+from telegram.ext import Application, BaseHandler, ConversationHandler
+from telegram.request import HTTPXRequest
+
+import settings
+from logs import log_context
+
+
+def escape_label(value: str) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_labels(labelnames: Sequence[str], labelvalues: Sequence[str]) -> str:
+    if not labelnames:
+        return ''
+    return '{{{}}}'.format(','.join(
+        f'{name}="{escape_label(value)}"'
+        for name, value in zip(labelnames, labelvalues)
+    ))
+
+
+class Counter:
+    """Счетчик событий с метками"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues: str, amount: float = 1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} counter',
+        ]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labelvalues, value in values:
+            lines.append(
+                f'{self.name}{format_labels(self.labelnames, labelvalues)} {value:g}'
+            )
+        return lines
+
+
+class Histogram:
+    """Гистограмма длительностей в секундах с метками.
+    Для каждого набора меток хранит число наблюдений в каждой корзине,
+    сумму и количество; накопительные значения считаются при выводе"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = settings.METRICS_LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # метки -> [наблюдений в корзинах..., в +Inf], сумма
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str):
+        position = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][position] += 1
+            series[1][0] += value
+
+    def render(self) -> List[str]:
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} histogram',
+        ]
+        with self._lock:
+            series = sorted(
+                (labelvalues, list(counts), total[0])
+                for labelvalues, (counts, total) in self._series.items()
+            )
+        labelnames = self.labelnames + ('le',)
+        for labelvalues, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append('{}_bucket{} {}'.format(
+                    self.name, format_labels(labelnames, labelvalues + (le,)), cumulative
+                ))
+            labels = format_labels(self.labelnames, labelvalues)
+            lines.append(f'{self.name}_sum{labels} {total:.6f}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """Все метрики бота, выводятся вместе на /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, *args, **kwargs) -> Counter:
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> List[str]:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return lines
+
+
+METRICS = MetricsRegistry()
+HANDLER_LATENCY = METRICS.histogram(
+    'bot_handler_duration_seconds',
+    'Время обработки апдейта обработчиком бота',
+    ('handler',),
+)
+DB_QUERY_LATENCY = METRICS.histogram(
+    'bot_db_query_duration_seconds',
+    'Время выполнения функции работы с БД в потоке пула или потоке записи',
+    ('query',),
+)
+DB_POOL_WAIT = METRICS.histogram(
+    'bot_db_pool_wait_seconds',
+    'Время ожидания свободного потока пула БД',
+)
+DB_WRITE_BATCH_SIZE = METRICS.histogram(
+    'bot_db_write_batch_size',
+    'Записей в одной транзакции потока записи БД',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+DB_COMMIT_LATENCY = METRICS.histogram(
+    'bot_db_commit_duration_seconds',
+    'Время фиксации транзакции потоком записи БД',
+)
+TELEGRAM_API_LATENCY = METRICS.histogram(
+    'bot_telegram_api_request_duration_seconds',
+    'Время запроса к Telegram Bot API (кроме getUpdates)',
+    ('method',),
+)
+TELEGRAM_API_ERRORS = METRICS.counter(
+    'bot_telegram_api_errors_total',
+    'Запросы к Telegram Bot API, завершившиеся ошибкой',
+    ('method',),
+)
+BROADCASTS = METRICS.counter(
+    'bot_broadcasts_total',
+    'Рассылки оповещений',
+)
+BROADCAST_MESSAGES = METRICS.counter(
+    'bot_broadcast_messages_total',
+    'Сообщения рассылок по итогу отправки: sent, failed, pruned',
+    ('result',),
+)
+
+
+def timed_callback(callback):
+    """Оборачивает callback обработчика замером времени его работы.
+    Записи лога во время работы обработчика получают id чата
+    и имя обработчика, по завершении пишется запись с длительностью"""
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        chat = getattr(update, 'effective_chat', None)
+        with log_context(chat_id=chat.id if chat else None, handler=callback.__name__):
+            started_at = time.perf_counter()
+            try:
+                return await callback(update, context)
+            finally:
+                duration = time.perf_counter() - started_at
+                HANDLER_LATENCY.observe(duration, callback.__name__)
+                logging.info(
+                    f'Update handled by {callback.__name__} in {duration * 1000:.1f} ms',
+                    extra={'duration_ms': round(duration * 1000, 1)},
+                )
+    wrapper.timed = True
+    return wrapper
+
+
+def instrument_handler(handler: BaseHandler):
+    """Добавляет замер времени к обработчику,
+    для ConversationHandler - ко всем его обработчикам"""
+    if isinstance(handler, ConversationHandler):
+        for nested in (
+            *handler.entry_points,
+            *(nested for handlers in handler.states.values() for nested in handlers),
+            *handler.fallbacks,
+        ):
+            instrument_handler(nested)
+        return
+    # один обработчик может быть в нескольких состояниях диалога
+    if not getattr(handler.callback, 'timed', False):
+        handler.callback = timed_callback(handler.callback)
+
+
+def instrument_handlers(application: Application):
+    """Добавляет замер времени ко всем обработчикам Application.
+    Вызывается после того, как все обработчики добавлены"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            instrument_handler(handler)
+
+
+class MeteredHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest, замеряющий время каждого запроса к Bot API"""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs) -> Tuple[int, bytes]:
+        api_method = url.rsplit('/', 1)[-1]
+        started_at = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            TELEGRAM_API_ERRORS.inc(api_method)
+            raise
+        finally:
+            TELEGRAM_API_LATENCY.observe(time.perf_counter() - started_at, api_method)
+        if code >= 400:
+            TELEGRAM_API_ERRORS.inc(api_method)
+        return code, payload
@@ -0,0 +1,315 @@
+import logging
+import sqlite3
+
+import settings
+from database import venue_db_path, venues
+
+# Миграции схемы БД. Номер версии хранится в PRAGMA user_version,
+# при запуске применяются все миграции с номером больше текущего.
+MIGRATIONS = {
+    # исходная схема: две таблицы без ключей и индексов
+    1: """
+        CREATE TABLE IF NOT EXISTS reservations (
+            guest_name text,
+            date_time datetime,
+            info text,
+            user_added text,
+            visited integer
+        );
+        CREATE TABLE IF NOT EXISTS chats (
+            id integer
+        );
+    """,
+    # первичные ключи, индекс по времени визита, уникальные id чатов
+    2: """
+        CREATE TABLE reservations_v2 (
+            id integer PRIMARY KEY AUTOINCREMENT,
+            guest_name text,
+            date_time datetime NOT NULL,
+            info text,
+            user_added text,
+            visited integer NOT NULL DEFAULT 0
+        );
+        INSERT INTO reservations_v2
+            (id, guest_name, date_time, info, user_added, visited)
+        SELECT rowid, guest_name, date_time, info, user_added, visited
+        FROM reservations;
+        DROP TABLE reservations;
+        ALTER TABLE reservations_v2 RENAME TO reservations;
+        CREATE INDEX reservations_date_time_idx ON reservations (date_time);
+
+        CREATE TABLE chats_v2 (
+            id integer PRIMARY KEY
+        );
+        INSERT OR IGNORE INTO chats_v2 (id)
+        SELECT id FROM chats WHERE id IS NOT NULL;
+        DROP TABLE chats;
+        ALTER TABLE chats_v2 RENAME TO chats;
+    """,
+    # данные бота между перезапусками: user_data, chat_data,
+    # кэш callback_data и состояния диалогов (см. persistence.py)
+    3: """
+        CREATE TABLE bot_persistence (
+            kind text NOT NULL,
+            key text NOT NULL,
+            data blob NOT NULL,
+            PRIMARY KEY (kind, key)
+        );
+    """,
+    # полнотекстовый поиск по имени гостя и деталям резерва.
+    # Индекс хранит только токены (content='reservations'),
+    # триггеры поддерживают его в актуальном состоянии
+    4: """
+        CREATE VIRTUAL TABLE reservations_fts USING fts5(
+            guest_name,
+            info,
+            content='reservations',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+        INSERT INTO reservations_fts (reservations_fts) VALUES ('rebuild');
+
+        CREATE TRIGGER reservations_fts_insert AFTER INSERT ON reservations
+        BEGIN
+            INSERT INTO reservations_fts (rowid, guest_name, info)
+            VALUES (new.id, new.guest_name, new.info);
+        END;
+        CREATE TRIGGER reservations_fts_delete AFTER DELETE ON reservations
+        BEGIN
+            INSERT INTO reservations_fts (reservations_fts, rowid, guest_name, info)
+            VALUES ('delete', old.id, old.guest_name, old.info);
+        END;
+        CREATE TRIGGER reservations_fts_update
+        AFTER UPDATE OF guest_name, info ON reservations
+        BEGIN
+            INSERT INTO reservations_fts (reservations_fts, rowid, guest_name, info)
+            VALUES ('delete', old.id, old.guest_name, old.info);
+            INSERT INTO reservations_fts (rowid, guest_name, info)
+            VALUES (new.id, new.guest_name, new.info);
+        END;
+    """,
+    # статистика резервов по дням и часам визита для /stats.
+    # Заполняется из существующих резервов и поддерживается триггерами,
+    # пересчитать с нуля можно командой python stats.py rebuild
+    5: """
+        CREATE TABLE daily_stats (
+            day text NOT NULL,
+            hour integer NOT NULL,
+            reservations integer NOT NULL DEFAULT 0,
+            visited integer NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, hour)
+        ) WITHOUT ROWID;
+        INSERT INTO daily_stats (day, hour, reservations, visited)
+        SELECT
+            substr(date_time, 1, 10),
+            CAST(substr(date_time, 12, 2) AS integer),
+            count(*),
+            sum(visited != 0)
+        FROM reservations
+        GROUP BY 1, 2;
+
+        CREATE TRIGGER daily_stats_insert AFTER INSERT ON reservations
+        BEGIN
+            INSERT INTO daily_stats (day, hour, reservations, visited)
+            VALUES (
+                substr(new.date_time, 1, 10),
+                CAST(substr(new.date_time, 12, 2) AS integer),
+                1,
+                new.visited != 0
+            )
+            ON CONFLICT (day, hour) DO UPDATE SET
+                reservations = reservations + 1,
+                visited = visited + excluded.visited;
+        END;
+        CREATE TRIGGER daily_stats_delete AFTER DELETE ON reservations
+        BEGIN
+            UPDATE daily_stats SET
+                reservations = reservations - 1,
+                visited = visited - (old.visited != 0)
+            WHERE day = substr(old.date_time, 1, 10)
+                AND hour = CAST(substr(old.date_time, 12, 2) AS integer);
+        END;
+        CREATE TRIGGER daily_stats_update
+        AFTER UPDATE OF date_time, visited ON reservations
+        BEGIN
+            UPDATE daily_stats SET
+                reservations = reservations - 1,
+                visited = visited - (old.visited != 0)
+            WHERE day = substr(old.date_time, 1, 10)
+                AND hour = CAST(substr(old.date_time, 12, 2) AS integer);
+            INSERT INTO daily_stats (day, hour, reservations, visited)
+            VALUES (
+                substr(new.date_time, 1, 10),
+                CAST(substr(new.date_time, 12, 2) AS integer),
+                1,
+                new.visited != 0
+            )
+            ON CONFLICT (day, hour) DO UPDATE SET
+                reservations = reservations + 1,
+                visited = visited + excluded.visited;
+        END;
+    """,
+    # архив прошедших резервов (см. archive.py): ночная задача переносит
+    # их из reservations, чтобы выборки будущих резервов шли по маленькой
+    # таблице. Поиск и статистика охватывают обе таблицы: индекс поиска
+    # строится по представлению all_reservations, а триггеры не считают
+    # перенос строки между таблицами (вставка в одну, затем удаление
+    # из другой) ни добавлением, ни удалением резерва
+    6: """
+        CREATE TABLE reservations_archive (
+            id integer PRIMARY KEY,
+            guest_name text,
+            date_time datetime NOT NULL,
+            info text,
+            user_added text,
+            visited integer NOT NULL DEFAULT 0
+        );
+        CREATE INDEX reservations_archive_date_time_idx
+            ON reservations_archive (date_time);
+        CREATE VIEW all_reservations AS
+            SELECT id, guest_name, date_time, info, user_added, visited
+            FROM reservations
+            UNION ALL
+            SELECT id, guest_name, date_time, info, user_added, visited
+            FROM reservations_archive;
+
+        DROP TRIGGER reservations_fts_insert;
+        DROP TRIGGER reservations_fts_delete;
+        DROP TRIGGER reservations_fts_update;
+        DROP TABLE reservations_fts;
+        CREATE VIRTUAL TABLE reservations_fts USING fts5(
+            guest_name,
+            info,
+            content='all_reservations',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+        INSERT INTO reservations_fts (reservations_fts) VALUES ('rebuild');
+
+        DROP TRIGGER daily_stats_insert;
+        DROP TRIGGER daily_stats_delete;
+        DROP TRIGGER daily_stats_update;
+    """ + "".join(
+        """
+        CREATE TRIGGER {table}_fts_insert AFTER INSERT ON {table}
+        WHEN NOT EXISTS (SELECT 1 FROM {other} WHERE id = new.id)
+        BEGIN
+            INSERT INTO reservations_fts (rowid, guest_name, info)
+            VALUES (new.id, new.guest_name, new.info);
+        END;
+        CREATE TRIGGER {table}_fts_delete AFTER DELETE ON {table}
+        WHEN NOT EXISTS (SELECT 1 FROM {other} WHERE id = old.id)
+        BEGIN
+            INSERT INTO reservations_fts (reservations_fts, rowid, guest_name, info)
+            VALUES ('delete', old.id, old.guest_name, old.info);
+        END;
+        CREATE TRIGGER {table}_fts_update
+        AFTER UPDATE OF guest_name, info ON {table}
+        BEGIN
+            INSERT INTO reservations_fts (reservations_fts, rowid, guest_name, info)
+            VALUES ('delete', old.id, old.guest_name, old.info);
+            INSERT INTO reservations_fts (rowid, guest_name, info)
+            VALUES (new.id, new.guest_name, new.info);
+        END;
+
+        CREATE TRIGGER {table}_daily_stats_insert AFTER INSERT ON {table}
+        WHEN NOT EXISTS (SELECT 1 FROM {other} WHERE id = new.id)
+        BEGIN
+            INSERT INTO daily_stats (day, hour, reservations, visited)
+            VALUES (
+                substr(new.date_time, 1, 10),
+                CAST(substr(new.date_time, 12, 2) AS integer),
+                1,
+                new.visited != 0
+            )
+            ON CONFLICT (day, hour) DO UPDATE SET
+                reservations = reservations + 1,
+                visited = visited + excluded.visited;
+        END;
+        CREATE TRIGGER {table}_daily_stats_delete AFTER DELETE ON {table}
+        WHEN NOT EXISTS (SELECT 1 FROM {other} WHERE id = old.id)
+        BEGIN
+            UPDATE daily_stats SET
+                reservations = reservations - 1,
+                visited = visited - (old.visited != 0)
+            WHERE day = substr(old.date_time, 1, 10)
+                AND hour = CAST(substr(old.date_time, 12, 2) AS integer);
+        END;
+        CREATE TRIGGER {table}_daily_stats_update
+        AFTER UPDATE OF date_time, visited ON {table}
+        BEGIN
+            UPDATE daily_stats SET
+                reservations = reservations - 1,
+                visited = visited - (old.visited != 0)
+            WHERE day = substr(old.date_time, 1, 10)
+                AND hour = CAST(substr(old.date_time, 12, 2) AS integer);
+            INSERT INTO daily_stats (day, hour, reservations, visited)
+            VALUES (
+                substr(new.date_time, 1, 10),
+                CAST(substr(new.date_time, 12, 2) AS integer),
+                1,
+                new.visited != 0
+            )
+            ON CONFLICT (day, hour) DO UPDATE SET
+                reservations = reservations + 1,
+                visited = visited + excluded.visited;
+        END;
+        """.format(table=table, other=other)
+        for table, other in (
+            ('reservations', 'reservations_archive'),
+            ('reservations_archive', 'reservations'),
+        )
+    ),
+    # заведение, с резервами которого работает чат (см. chat_registry.py).
+    # Чаты, добавленные до появления заведений, - NULL, это основное.
+    # Схема у всех шардов одна, но чаты хранятся только в основной БД
+    7: """
+        ALTER TABLE chats ADD COLUMN venue text;
+    """,
+}
+
+
+def get_schema_version(connection: sqlite3.Connection) -> int:
+    """Функция возвращает номер текущей версии схемы БД"""
+    return connection.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(db_path: str = settings.DB_PATH) -> int:
+    """Функция применяет к БД все недостающие миграции
+    и возвращает номер итоговой версии схемы"""
+    connection = sqlite3.connect(db_path)
+    try:
+        # режим WAL хранится в файле БД: читатели не ждут записи,
+        # а запись не ждет читателей
+        connection.execute('PRAGMA journal_mode = WAL')
+        version = get_schema_version(connection)
+        for target_version in sorted(MIGRATIONS):
+            if target_version <= version:
+                continue
+            try:
+                connection.executescript(
+                    'BEGIN;\n{}\nPRAGMA user_version = {};\nCOMMIT;'.format(
+                        MIGRATIONS[target_version], target_version
+                    )
+                )
+            except sqlite3.Error:
+                if connection.in_transaction:
+                    connection.rollback()
+                raise
+            logging.info(f'DB schema migrated to version {target_version}')
+            version = target_version
+        return version
+    finally:
+        connection.close()
+
+
+def migrate_venues():
+    """Функция применяет недостающие миграции к БД всех заведений"""
+    for venue in venues():
+        migrate(venue_db_path(venue))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    for venue in venues():
+        print(f'{venue} schema version: {migrate(venue_db_path(venue))}')
@@ -0,0 +1,61 @@
+import asyncio
+from typing import Any, Awaitable, Dict, List, Sequence
+
+import settings
+
+
+class OutboundPipeline:
+    """Отправка ответов бота в чат этапами.
+    Сообщения одного этапа отправляются одновременно и могут прийти
+    в любом порядке, следующий этап начинается после того, как отправлен
+    весь предыдущий. Поэтому отдельным этапом идет только то, что должно
+    быть раньше остального (заголовок перед карточками), а независимые
+    сообщения (карточки списка, карточка и подтверждения сохранения)
+    отправляются одним этапом - за одно обращение к API вместо
+    нескольких подряд. Одновременных отправок в один чат
+    не больше per_chat_concurrency"""
+
+    def __init__(self, per_chat_concurrency: int):
+        self.per_chat_concurrency = per_chat_concurrency
+        self._semaphores: Dict[int, asyncio.Semaphore] = {}
+        # сколько отправок в чат сейчас ждут или выполняются:
+        # семафор чата удаляется, когда их не остается
+        self._in_flight: Dict[int, int] = {}
+
+    async def _send_one(self, chat_id: int, send: Awaitable) -> Any:
+        semaphore = self._semaphores.get(chat_id)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.per_chat_concurrency)
+            self._semaphores[chat_id] = semaphore
+        self._in_flight[chat_id] = self._in_flight.get(chat_id, 0) + 1
+        try:
+            async with semaphore:
+                return await send
+        finally:
+            self._in_flight[chat_id] -= 1
+            if not self._in_flight[chat_id]:
+                del self._in_flight[chat_id]
+                del self._semaphores[chat_id]
+
+    async def send(self, chat_id: int, *stages: Sequence[Awaitable]) -> List[List[Any]]:
+        """Выполняет этапы отправки по очереди, сообщения внутри этапа -
+        одновременно. Возвращает результаты (отправленные сообщения)
+        по этапам, в порядке, в котором они переданы"""
+        results = []
+        for number, stage in enumerate(stages):
+            try:
+                results.append(await asyncio.gather(
+                    *(self._send_one(chat_id, send) for send in stage)
+                ))
+            except BaseException:
+                # до следующих этапов дело не дошло: закрываем их корутины,
+                # чтобы не было предупреждений о том, что их не дождались
+                for later_stage in stages[number + 1:]:
+                    for send in later_stage:
+                        if asyncio.iscoroutine(send):
+                            send.close()
+                raise
+        return results
+
+
+OUTBOUND = OutboundPipeline(settings.OUTBOUND_PER_CHAT_CONCURRENCY)
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import logging
+import pickle
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import settings
+from database import (get_connection, get_write_connection, run_in_db_thread,
+                      run_in_db_writer)
+
+# виды записей в таблице bot_persistence
+USER_DATA = 'user_data'
+CHAT_DATA = 'chat_data'
+BOT_DATA = 'bot_data'
+CALLBACK_DATA = 'callback_data'
+CONVERSATION = 'conversation:{}'
+
+# ключ (kind, key) -> данные или None, если запись нужно удалить
+PendingWrites = Dict[Tuple[str, str], Optional[object]]
+
+
+def load_kind(kind: str) -> Dict[str, object]:
+    """Функция возвращает все сохраненные записи одного вида"""
+    connection = get_connection()
+    rows = connection.execute(
+        'SELECT key, data FROM bot_persistence WHERE kind = ?', (kind,)
+    ).fetchall()
+    return {key: pickle.loads(data) for key, data in rows}
+
+
+def write_batch(writes: PendingWrites):
+    """Функция записывает накопленные изменения
+    (в транзакции потока записи основной БД)"""
+    upserts = [
+        (kind, key, pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+        for (kind, key), data in writes.items()
+        if data is not None
+    ]
+    deletes = [
+        (kind, key) for (kind, key), data in writes.items() if data is None
+    ]
+    connection = get_write_connection()
+    connection.executemany(
+        'INSERT OR REPLACE INTO bot_persistence (kind, key, data) VALUES (?, ?, ?)',
+        upserts
+    )
+    connection.executemany(
+        'DELETE FROM bot_persistence WHERE kind = ? AND key = ?', deletes
+    )
+
+
+def load_legacy_buttons() -> Dict[str, object]:
+    """Функция возвращает данные кнопок, отправленных до перехода
+    на r:<id>:<действие>. Тогда у бота был включен arbitrary_callback_data:
+    PTB заменял callback_data каждой кнопки на uuid клавиатуры и кнопки,
+    а сами данные хранил в своем кэше, сохраненном здесь как callback_data.
+    Возвращает словарь uuid клавиатуры + uuid кнопки -> данные кнопки"""
+    stored = load_kind(CALLBACK_DATA).get('')
+    if stored is None:
+        return {}
+    keyboards, _ = stored
+    return {
+        keyboard_uuid + button_uuid: data
+        for keyboard_uuid, _, buttons in keyboards
+        for button_uuid, data in buttons.items()
+    }
+
+
+class SQLitePersistence(BasePersistence):
+    """Хранение user_data, chat_data, bot_data, кэша callback_data
+    и состояний диалогов в таблице bot_persistence.
+
+    Application раз в update_interval секунд передает сюда все изменения
+    одной пачкой (и еще раз при остановке). Пачка копится в памяти
+    и пишется в БД одной записью потока записи БД, а не по записи
+    на каждый апдейт. Данные приходят уже скопированными Application,
+    поэтому pickle выполняется в потоке записи, а не в цикле событий"""
+
+    def __init__(self, update_interval: float = settings.PERSISTENCE_UPDATE_INTERVAL):
+        super().__init__(store_data=PersistenceInput(), update_interval=update_interval)
+        self._pending: PendingWrites = {}
+        self._write_task: Optional[asyncio.Task] = None
+        self._legacy_buttons: Optional[Dict[str, object]] = None
+
+    def _schedule(self, kind: str, key: str, data: Optional[object]):
+        """Кладет изменение в пачку и планирует её запись.
+        Application вызывает все update_* пачки через asyncio.gather, и ни один
+        из них не уступает цикл событий - задача записи запускается после них"""
+        self._pending[(kind, key)] = data
+        if self._write_task is None:
+            self._write_task = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self):
+        try:
+            # пока пишется одна пачка, может прийти следующая
+            while self._pending:
+                writes, self._pending = self._pending, {}
+                try:
+                    await run_in_db_writer(None, write_batch, writes)
+                except Exception:
+                    # не теряем изменения: они уйдут со следующей пачкой,
+                    # если к тому времени их не перезапишут более новые
+                    self._pending = {**writes, **self._pending}
+                    logging.exception('Error when writing persistence data')
+                    break
+                logging.debug(f'Persistence: {len(writes)} records written')
+        finally:
+            self._write_task = None
+
+    async def _load_keyed(self, kind: str) -> Dict[int, dict]:
+        data = defaultdict(dict)
+        data.update(
+            (int(key), value)
+            for key, value in (await run_in_db_thread(load_kind, kind)).items()
+        )
+        return data
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        return await self._load_keyed(USER_DATA)
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return await self._load_keyed(CHAT_DATA)
+
+    async def get_bot_data(self) -> dict:
+        return (await run_in_db_thread(load_kind, BOT_DATA)).get('', {})
+
+    async def get_callback_data(self):
+        return (await run_in_db_thread(load_kind, CALLBACK_DATA)).get('')
+
+    async def get_legacy_buttons(self) -> Dict[str, object]:
+        """Данные старых кнопок (см. load_legacy_buttons). Они больше
+        не меняются, поэтому читаются из БД один раз"""
+        if self._legacy_buttons is None:
+            self._legacy_buttons = await run_in_db_thread(load_legacy_buttons)
+        return self._legacy_buttons
+
+    async def get_conversations(self, name: str) -> dict:
+        stored = await run_in_db_thread(load_kind, CONVERSATION.format(name))
+        return {tuple(json.loads(key)): state for key, state in stored.items()}
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]):
+        self._schedule(CONVERSATION.format(name), json.dumps(key), new_state)
+
+    async def update_user_data(self, user_id: int, data: dict):
+        self._schedule(USER_DATA, str(user_id), data)
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        self._schedule(CHAT_DATA, str(chat_id), data)
+
+    async def update_bot_data(self, data: dict):
+        self._schedule(BOT_DATA, '', data)
+
+    async def update_callback_data(self, data):
+        self._schedule(CALLBACK_DATA, '', data)
+
+    async def drop_user_data(self, user_id: int):
+        self._schedule(USER_DATA, str(user_id), None)
+
+    async def drop_chat_data(self, chat_id: int):
+        self._schedule(CHAT_DATA, str(chat_id), None)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
+
+    async def flush(self):
+        """Дописывает всё накопленное при остановке бота"""
+        if self._write_task is not None:
+            await self._write_task
+        if self._pending:
+            await self._write_pending()
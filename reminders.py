@@ -0,0 +1,187 @@
+"""Напоминания о визитах.
+
+За REMINDER_MINUTES_BEFORE минут до визита всем чатам бота уходит
+напоминание, а через NO_SHOW_MINUTES_AFTER минут после - сообщение,
+что гости не отмечены как пришедшие (с кнопками резерва).
+
+Ближайшие события хранятся в памяти в куче (heapq): она загружается
+из БД один раз при запуске и дальше обновляется функциями
+async_reservations при добавлении, изменении и удалении резервов.
+В JobQueue всегда стоит одна задача - на время ближайшего события,
+поэтому БД не опрашивается по таймеру: резерв читается только
+в момент его события, чтобы отправить актуальную карточку.
+У каждого заведения своя куча и своя задача JobQueue, напоминания
+уходят в чаты этого заведения"""
+import heapq
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from telegram.ext import CallbackContext, Job, JobQueue
+
+import reservations
+import settings
+from database import run_in_db_thread, venues
+from reservations import Reservation
+
+REMIND = 'remind'
+NO_SHOW = 'no_show'
+
+# (время события, id резерва, вид события, время визита резерва)
+Event = Tuple[datetime, int, str, datetime]
+# отправка события во все чаты: (вид события, резерв)
+Notify = Callable[[str, Reservation], Awaitable]
+
+
+class ReminderScheduler:
+    """Куча событий по резервам и задача JobQueue на ближайшее из них.
+    Изменение и удаление резерва не ищут его события в куче: в _visits
+    хранится актуальное время визита, а устаревшие события
+    пропускаются, когда доходят до вершины кучи"""
+
+    def __init__(
+        self, venue: str, remind_before: timedelta, no_show_after: timedelta
+    ):
+        self.venue = venue
+        self.remind_before = remind_before
+        self.no_show_after = no_show_after
+        self._heap: List[Event] = []
+        # id резерва -> время визита, по которому ждут его события
+        self._visits: Dict[int, datetime] = {}
+        self._job_queue: Optional[JobQueue] = None
+        self._notify: Optional[Notify] = None
+        self._job: Optional[Job] = None
+        self._job_at: Optional[datetime] = None
+
+    async def start(self, job_queue: JobQueue, notify: Notify):
+        """Загружает из БД резервы, события которых еще впереди,
+        и ставит задачу на ближайшее событие"""
+        self._job_queue = job_queue
+        self._notify = notify
+        if self._job is not None:
+            self._job.schedule_removal()
+            self._job = self._job_at = None
+        now = datetime.now()
+        visits = await run_in_db_thread(
+            reservations.unvisited_since, now - self.no_show_after, venue=self.venue
+        )
+        self._heap = []
+        self._visits = {}
+        for reservation_id, date_time in visits:
+            events = self._events(reservation_id, date_time, now)
+            if events:
+                self._visits[reservation_id] = date_time
+                self._heap.extend(events)
+        heapq.heapify(self._heap)
+        self._arm()
+        logging.info(f'Reminders loaded in {self.venue}: {len(self._heap)} events')
+
+    async def reload(self):
+        """Загружает события заново (после массового импорта)"""
+        if self._job_queue is not None:
+            await self.start(self._job_queue, self._notify)
+
+    def _events(
+        self, reservation_id: int, date_time: datetime, now: datetime
+    ) -> List[Event]:
+        """События резерва, время которых еще не прошло"""
+        events = [
+            (date_time - self.remind_before, reservation_id, REMIND, date_time),
+            (date_time + self.no_show_after, reservation_id, NO_SHOW, date_time),
+        ]
+        return [event for event in events if event[0] >= now]
+
+    def update(self, reservation: Reservation):
+        """Учитывает добавленный или измененный резерв"""
+        if self._job_queue is None:
+            return
+        if reservation.visited:
+            self.discard(reservation.id)
+            return
+        if self._visits.get(reservation.id) == reservation.date_time:
+            return
+        self._visits.pop(reservation.id, None)
+        events = self._events(reservation.id, reservation.date_time, datetime.now())
+        if events:
+            self._visits[reservation.id] = reservation.date_time
+            for event in events:
+                heapq.heappush(self._heap, event)
+        if self._compact_needed():
+            self._compact()
+        self._arm()
+
+    def discard(self, reservation_id: int):
+        """Забывает события удаленного резерва
+        или резерва, гости которого уже пришли"""
+        self._visits.pop(reservation_id, None)
+        if self._compact_needed():
+            self._compact()
+
+    def _is_current(self, event: Event) -> bool:
+        return self._visits.get(event[1]) == event[3]
+
+    def _compact_needed(self) -> bool:
+        # у каждого резерва в куче не больше двух актуальных событий
+        return len(self._heap) > 2 * len(self._visits) + settings.REMINDER_HEAP_SLACK
+
+    def _compact(self):
+        """Убирает из кучи устаревшие события"""
+        self._heap = [event for event in self._heap if self._is_current(event)]
+        heapq.heapify(self._heap)
+
+    def _arm(self):
+        """Ставит задачу JobQueue на время ближайшего события.
+        Задача переставляется, только если ближайшее событие стало раньше:
+        если оно устарело, сработавшая задача просто найдет следующее"""
+        if not self._heap:
+            return
+        next_at = self._heap[0][0]
+        if self._job is not None and self._job_at <= next_at:
+            return
+        if self._job is not None:
+            self._job.schedule_removal()
+        self._job_at = next_at
+        # время передается интервалом: у JobQueue свой часовой пояс,
+        # а время визитов в БД - местное
+        self._job = self._job_queue.run_once(
+            self._fire,
+            max((next_at - datetime.now()).total_seconds(), 0),
+            name=f'reminders:{self.venue}',
+        )
+
+    def _due_events(self, now: datetime) -> List[Event]:
+        """Снимает с кучи наступившие актуальные события"""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            event = heapq.heappop(self._heap)
+            if not self._is_current(event):
+                continue
+            due.append(event)
+            if event[2] == NO_SHOW:
+                del self._visits[event[1]]
+        return due
+
+    async def _fire(self, context: CallbackContext):
+        self._job = self._job_at = None
+        due = self._due_events(datetime.now())
+        self._arm()
+        for _, reservation_id, kind, _ in due:
+            reservation = await run_in_db_thread(
+                reservations.get_reservation, reservation_id, venue=self.venue
+            )
+            # резерв мог измениться в обход бота (импорт, правка БД)
+            if reservation is None or reservation.visited:
+                continue
+            logging.info(f'Reminder {kind}:\n{reservation.reserve_line()}')
+            await self._notify(kind, reservation)
+
+
+# заведение -> его напоминания
+REMINDERS = {
+    venue: ReminderScheduler(
+        venue,
+        remind_before=timedelta(minutes=settings.REMINDER_MINUTES_BEFORE),
+        no_show_after=timedelta(minutes=settings.NO_SHOW_MINUTES_AFTER),
+    )
+    for venue in venues()
+}
@@ -1,27 +1,142 @@
-import sqlite3
+import re
 import textwrap
 from dataclasses import dataclass
-from datetime import datetime
-from typing import List
+from datetime import date, datetime, timedelta
+from typing import Callable, List, Optional, Tuple
+
+from cachetools import LRUCache
 
 import settings
+from database import after_commit, get_connection, get_write_connection
+from day_cache import DAY_CACHE
 from validators import (apropriate_datetime_validator, date_format_validator,
                         datetime_format_validator)
 
-DB_CONNECTION = sqlite3.connect('reservations.db')
-DB_CONNECTION.row_factory = sqlite3.Row
-DB_CURSOR = DB_CONNECTION.cursor()
+
+# таблица для экранирования HTML за один проход str.translate
+HTML_ESCAPE_TABLE = str.maketrans(settings.HTML_ESCAPE_SYMBOLS)
+# строки из одних пробелов и табуляций: textwrap.dedent, которым прежде
+# выравнивался весь текст превью, оставлял от них пустые строки
+WHITESPACE_ONLY_LINE = re.compile('^[ \t]+$', re.MULTILINE)
+
+# шаблоны сообщений о резерве, собираются один раз при импорте
+RESERVE_PREVIEW_TEMPLATE = (
+    '<b>Имя гостя:</b> {guest_name}\n'
+    '<b>Время визита:</b> {date_time}\n'
+    '\n'
+    '<b>Дополнительная информация:</b>\n'
+    '{info}\n'
+)
+RESERVE_CARD_TEMPLATE = (
+    RESERVE_PREVIEW_TEMPLATE
+    + '\n'
+    '<b>Бронь принял(а):</b> {user_added}\n'
+    '<b>Гости пришли:</b> {visited}\n'
+)
+RESERVE_LINE_TEMPLATE = '{date_time} | {guest_name} | {visited}'
+RESERVE_COPY_CARD_TEMPLATE = '`TR\n{date_time}\n{guest_name}\n{info}`\n    '
+
+# кэш отрисованных сообщений: (шаблон, id резерва, версия содержимого) -> текст
+RENDER_CACHE = LRUCache(maxsize=settings.RENDER_CACHE_SIZE)
+
+# порядок колонок, в котором резервы выбираются из БД
+# и раскладываются по полям Reservation в Reservation.from_db_row
+RESERVATION_COLUMNS = 'id, guest_name, date_time, info, user_added, visited'
+
+# будущие и недавние резервы лежат в reservations, прошедшие ночная задача
+# переносит в архив (см. archive.py), all_reservations - обе таблицы вместе
+HOT_TABLE = 'reservations'
+ARCHIVE_TABLE = 'reservations_archive'
+ALL_RESERVATIONS = 'all_reservations'
 
 
-@dataclass
 class Reservation:
-    """Класс для бронирований"""
-    id: int = None
-    guest_name: str = None
-    date_time: datetime = None
-    info: str = None
-    user_added: str = None
-    visited: int = 0
+    """Класс для бронирований.
+    Экземпляров в выборках из архива бывает много, поэтому класс
+    хранит поля в __slots__, а время визита из БД разбирает
+    в datetime только при первом обращении к date_time.
+    venue - заведение, в БД которого хранится резерв
+    (у разных заведений id резервов пересекаются)"""
+    __slots__ = (
+        'id', 'guest_name', '_date_time', '_date_time_db',
+        'info', 'user_added', 'visited', 'venue',
+    )
+
+    def __init__(
+        self,
+        id: int = None,
+        guest_name: str = None,
+        date_time: datetime = None,
+        info: str = None,
+        user_added: str = None,
+        visited: int = 0,
+        venue: str = None,
+    ):
+        self.id = id
+        self.guest_name = guest_name
+        self._date_time = date_time
+        self._date_time_db = None
+        self.info = info
+        self.user_added = user_added
+        self.visited = visited
+        self.venue = venue
+
+    def __setstate__(self, state):
+        """Восстанавливает резерв из pickle (user_data, сохраненные
+        SQLitePersistence). Резервы, сохраненные до появления заведений,
+        не знают своего заведения - они из основного"""
+        dict_state, slots_state = state if isinstance(state, tuple) else (state, None)
+        for name, value in {**(dict_state or {}), **(slots_state or {})}.items():
+            setattr(self, name, value)
+        if not hasattr(self, 'venue'):
+            self.venue = settings.DEFAULT_VENUE
+
+    @classmethod
+    def from_db_row(cls, row: tuple) -> 'Reservation':
+        """Создает резерв из строки БД с колонками RESERVATION_COLUMNS,
+        не разбирая время визита"""
+        reservation = cls.__new__(cls)
+        (
+            reservation.id,
+            reservation.guest_name,
+            reservation._date_time_db,
+            reservation.info,
+            reservation.user_added,
+            reservation.visited,
+        ) = row
+        reservation._date_time = None
+        reservation.venue = None
+        return reservation
+
+    @property
+    def date_time(self) -> datetime:
+        if self._date_time is None and self._date_time_db is not None:
+            self._date_time = datetime.strptime(
+                self._date_time_db, settings.DATETIME_DB_FORMAT
+            )
+        return self._date_time
+
+    @date_time.setter
+    def date_time(self, value: datetime):
+        self._date_time = value
+        self._date_time_db = None
+
+    def _fields(self) -> tuple:
+        return (
+            self.id, self.guest_name, self.date_time,
+            self.info, self.user_added, self.visited,
+        )
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    def __repr__(self):
+        return (
+            'Reservation(id={!r}, guest_name={!r}, date_time={!r}, '
+            'info={!r}, user_added={!r}, visited={!r})'.format(*self._fields())
+        )
 
     @staticmethod
     def str_to_datetime(datetime_str: str) -> datetime:
@@ -44,17 +159,13 @@ class Reservation:
     def parse_escape(line: str) -> str:
         """Метод закрывает специальные символы
         от обработки parse_mode телеграма"""
-        escaped_line = line
-        for i in line:
-            if i in settings.HTML_ESCAPE_SYMBOLS.keys():
-                escaped_line.replace(
-                    i, settings.HTML_ESCAPE_SYMBOLS[i]
-                )
-        return escaped_line
+        return line.translate(HTML_ESCAPE_TABLE)
 
     def datetime_to_db_format(self) -> str:
         """Метод преобразует datetime объект
         в данные для передачи в соответсвующую колонку БД"""
+        if self._date_time_db is not None:
+            return self._date_time_db
         return self.date_time.strftime(settings.DATETIME_DB_FORMAT)
 
     def visited_to_emoji(self):
@@ -70,197 +181,484 @@ class Reservation:
         elif self.visited == 0:
             self.visited = 1
 
-    def reserve_preview(self):
-        """Возвращает сокращенную информацию о резерве для превью"""
-        preview = """<b>Имя гостя:</b> {}
-<b>Время визита:</b> {}
+    def content_version(self) -> tuple:
+        """Версия содержимого резерва для кэша отрисовки:
+        меняется при изменении любого из выводимых полей"""
+        return (
+            self.guest_name,
+            self._date_time_db or self._date_time,
+            self.info,
+            self.user_added,
+            self.visited,
+        )
 
-<b>Дополнительная информация:</b>
-{}
-        """.format(
-            self.parse_escape(self.guest_name),
-            self.date_time.strftime(settings.DATETIME_FORMAT),
-            self.parse_escape(self.info),
+    def _render(self, template_name: str, render: Callable[[], str]) -> str:
+        """Возвращает текст из RENDER_CACHE или отрисовывает его функцией render.
+        Несохраненные резервы (без id) не кэшируются"""
+        if self.id is None:
+            return render()
+        key = (template_name, self.id, self.content_version())
+        text = RENDER_CACHE.get(key)
+        if text is None:
+            text = RENDER_CACHE[key] = render()
+        return text
+
+    def _template_fields(self) -> dict:
+        return {
+            'guest_name': self.parse_escape(self.guest_name),
+            'date_time': self.date_time.strftime(settings.DATETIME_FORMAT),
+            'info': self.parse_escape(textwrap.dedent(self.info)),
+            'user_added': self.parse_escape(str(self.user_added)),
+            'visited': self.visited_to_emoji(),
+        }
+
+    def reserve_preview(self):
+        """Возвращает сокращенную информацию о резерве для превью.
+        Детали в превью, в отличие от карточки, не выравниваются dedent:
+        только строки из одних пробелов становятся пустыми"""
+        return self._render(
+            'preview',
+            lambda: RESERVE_PREVIEW_TEMPLATE.format_map({
+                **self._template_fields(),
+                'info': self.parse_escape(WHITESPACE_ONLY_LINE.sub('', self.info)),
+            })
         )
-        return textwrap.dedent(preview)
 
     def reserve_card(self):
         """Возвращает полную информацию о резерве для карточки резерва"""
-        card = """<b>Имя гостя:</b> {}
-<b>Время визита:</b> {}
-
-<b>Дополнительная информация:</b>
-{}
-
-<b>Бронь принял(а):</b> {}
-<b>Гости пришли:</b> {}
-        """.format(
-            self.parse_escape(self.guest_name),
-            self.date_time.strftime(settings.DATETIME_FORMAT),
-            self.parse_escape((textwrap.dedent(self.info))),
-            self.user_added,
-            self.visited_to_emoji(),
+        return self._render(
+            'card',
+            lambda: RESERVE_CARD_TEMPLATE.format_map(self._template_fields())
         )
-        return textwrap.dedent(card)
 
     def reserve_line(self, logs=True):
-        """Возвращает краткую информацию о резерве в виде строки"""
+        """Возвращает краткую информацию о резерве в виде строки.
+        Строка идет в логи и в текст кнопки, а не в HTML,
+        поэтому имя гостя не экранируется"""
         if logs is True:
-            visited = self.visited
-        else:
-            visited = self.visited_to_emoji()
-
-        line = (
-            f'{self.date_time.strftime(settings.DATETIME_FORMAT)} | {self.parse_escape(self.guest_name)} | {visited}'
+            return self._render(
+                'log_line',
+                lambda: RESERVE_LINE_TEMPLATE.format(
+                    date_time=self.date_time.strftime(settings.DATETIME_FORMAT),
+                    guest_name=self.guest_name,
+                    visited=self.visited,
+                )
+            )
+        return self._render(
+            'line',
+            lambda: RESERVE_LINE_TEMPLATE.format(
+                date_time=self.date_time.strftime(settings.DATETIME_FORMAT),
+                guest_name=self.guest_name,
+                visited=self.visited_to_emoji(),
+            )
         )
-        return line
 
     def reserve_copy_card(self):
-        return f"""`TR
-{self.date_time.strftime(settings.DATETIME_FORMAT)}
-{self.guest_name}
-{self.info}`
-    """
+        return self._render(
+            'copy_card',
+            lambda: RESERVE_COPY_CARD_TEMPLATE.format(
+                date_time=self.date_time.strftime(settings.DATETIME_FORMAT),
+                guest_name=self.guest_name,
+                info=self.info,
+            )
+        )
 
 
 def parse_db_to_reservation_class(reservations_list: List) -> List:
-    """Принимает список с данными из бд
+    """Принимает список с данными из бд (колонки RESERVATION_COLUMNS)
     и парсит в список классов Reservation"""
-    reservations = []
-    for line in reservations_list:
-        parsed_line = dict(line)
-        reservations.append(
-            Reservation(
-                id=parsed_line['rowid'],
-                guest_name=parsed_line['guest_name'],
-                date_time=datetime.strptime(
-                    parsed_line['date_time'], settings.DATETIME_DB_FORMAT
-                ),
-                info=parsed_line['info'],
-                user_added=parsed_line['user_added'],
-                visited=parsed_line['visited'],
-            )
-        )
+    return [Reservation.from_db_row(tuple(line)) for line in reservations_list]
+
+
+def reservation_row_factory(cursor, row: tuple) -> Reservation:
+    """row_factory для курсора: строки выборки сразу становятся
+    объектами Reservation, без промежуточных sqlite3.Row и dict"""
+    return Reservation.from_db_row(row)
+
+
+def select_reservations(
+    query: str, params: dict, venue: str = settings.DEFAULT_VENUE
+) -> List[Reservation]:
+    """Выполняет выборку резервов в БД заведения
+    и возвращает список объектов Reservation"""
+    cursor = get_connection(venue).cursor()
+    cursor.row_factory = reservation_row_factory
+    reservations = cursor.execute(query, params).fetchall()
+    for reservation in reservations:
+        reservation.venue = venue
     return reservations
 
 
-def add_reservation(reservation: Reservation):
+def day_bounds(day: date) -> Tuple[str, str]:
+    """Возвращает границы суток [начало дня, начало следующего дня)
+    в формате колонки date_time, чтобы запросы по дате использовали индекс"""
+    return (
+        day.strftime(settings.DATE_DB_FORMAT),
+        (day + timedelta(days=1)).strftime(settings.DATE_DB_FORMAT),
+    )
+
+
+def add_reservation(reservation: Reservation, venue: str = settings.DEFAULT_VENUE):
     """Функция записывает данные резерва
-    из объекта класса Reservation в базу данных"""
-    with DB_CONNECTION:
-        DB_CURSOR.execute(
-            """
-            INSERT INTO reservations
-            VALUES (:guest_name, :date_time, :info, :user_added, :visited)
-            """,
-            {
-                'guest_name': reservation.guest_name,
-                'date_time': reservation.datetime_to_db_format(),
-                'info': reservation.info,
-                'user_added': reservation.user_added,
-                'visited': reservation.visited,
-            }
-        )
+    из объекта класса Reservation в базу данных заведения.
+    Как и остальные функции записи, вызывается через database.write
+    или run_in_db_writer"""
+    cursor = get_write_connection(venue).execute(
+        """
+        INSERT INTO reservations
+        (guest_name, date_time, info, user_added, visited)
+        VALUES (:guest_name, :date_time, :info, :user_added, :visited)
+        """,
+        {
+            'guest_name': reservation.guest_name,
+            'date_time': reservation.datetime_to_db_format(),
+            'info': reservation.info,
+            'user_added': reservation.user_added,
+            'visited': reservation.visited,
+        }
+    )
+    reservation.id = cursor.lastrowid
+    reservation.venue = venue
+    day = reservation.date_time.date()
+    after_commit(lambda: DAY_CACHE.invalidate(venue, day))
+
+
+def archive_cutoff() -> str:
+    """Граница архива в формате колонки date_time: в архив попадают
+    резервы с временем визита раньше начала текущего дня"""
+    day_start, _ = day_bounds(date.today())
+    return day_start
+
+
+def move_reservations(
+    connection, source: str, target: str, condition: str, params: dict
+) -> int:
+    """Переносит резервы, подходящие под condition, из таблицы source
+    в target и возвращает их количество. Строка сначала вставляется,
+    потом удаляется: по этому признаку триггеры поиска и статистики
+    отличают перенос от добавления и удаления резерва.
+    Вызывается внутри транзакции"""
+    cursor = connection.execute(
+        f"""
+        INSERT INTO {target} ({RESERVATION_COLUMNS})
+        SELECT {RESERVATION_COLUMNS} FROM {source} WHERE {condition}
+        """,
+        params
+    )
+    connection.execute(f"DELETE FROM {source} WHERE {condition}", params)
+    return cursor.rowcount
+
+
+def stored_reservation_day(connection, reservation_id: int) -> Optional[date]:
+    """Возвращает день визита, сохраненный в БД для резерва с переданным id"""
+    row = connection.execute(
+        "SELECT date_time FROM all_reservations WHERE id = :id",
+        {'id': reservation_id}
+    ).fetchone()
+    if row is None:
+        return None
+    return datetime.strptime(row['date_time'], settings.DATETIME_DB_FORMAT).date()
+
+
+def get_reservation(
+    reservation_id: int, venue: str = settings.DEFAULT_VENUE
+) -> Optional[Reservation]:
+    """Функция возвращает резерв с переданным id или None, если его нет в БД"""
+    found = select_reservations(
+        f"SELECT {RESERVATION_COLUMNS} FROM all_reservations WHERE id = :id",
+        {'id': reservation_id},
+        venue,
+    )
+    return found[0] if found else None
 
 
-def delete_reservation(reservation: Reservation):
+def delete_reservation(reservation: Reservation, venue: str = settings.DEFAULT_VENUE):
     """Функция находит соответствующую строку и удаляет из бд"""
-    with DB_CONNECTION:
-        DB_CURSOR.execute(
-            """DELETE FROM reservations
-               WHERE rowid = :id""",
+    connection = get_write_connection(venue)
+    stored_day = stored_reservation_day(connection, reservation.id)
+    for table in (HOT_TABLE, ARCHIVE_TABLE):
+        connection.execute(
+            f"""DELETE FROM {table}
+                WHERE id = :id""",
             {'id': reservation.id}
         )
-
-
-def edit_reservation(reservation: Reservation):
-    """Функция находит соответствующую строку в бд и изменяет её"""
-    with DB_CONNECTION:
-        DB_CURSOR.execute(
-            """UPDATE reservations
-               SET
-               guest_name=:guest_name,
-               date_time=:date_time,
-               info=:info,
-               visited=:visited
-               WHERE rowid = :id""",
-            {
-                'id': reservation.id,
-                'guest_name': reservation.guest_name,
-                'date_time': reservation.datetime_to_db_format(),
-                'info': reservation.info,
-                'visited': reservation.visited,
-            }
+    if stored_day is not None:
+        after_commit(lambda: DAY_CACHE.invalidate(venue, stored_day))
+
+
+def edit_reservation(reservation: Reservation, venue: str = settings.DEFAULT_VENUE):
+    """Функция находит соответствующую строку в бд и изменяет её.
+    Архивный резерв сначала возвращается в таблицу актуальных резервов:
+    если он так и остался в прошлом, ночная задача снова перенесет его в архив"""
+    connection = get_write_connection(venue)
+    stored_day = stored_reservation_day(connection, reservation.id)
+    if stored_day is not None and stored_day < date.today():
+        move_reservations(
+            connection, ARCHIVE_TABLE, HOT_TABLE, 'id = :id',
+            {'id': reservation.id}
         )
+    connection.execute(
+        """UPDATE reservations
+           SET
+           guest_name=:guest_name,
+           date_time=:date_time,
+           info=:info,
+           visited=:visited
+           WHERE id = :id""",
+        {
+            'id': reservation.id,
+            'guest_name': reservation.guest_name,
+            'date_time': reservation.datetime_to_db_format(),
+            'info': reservation.info,
+            'visited': reservation.visited,
+        }
+    )
+    days = {stored_day, reservation.date_time.date()} - {None}
+    after_commit(lambda: DAY_CACHE.invalidate(venue, *days))
 
 
-def show_reservations_all():
-    """Функция выводит все БУДУЩИЕ резервы."""
-    DB_CURSOR.execute(
-        """
-        SELECT rowid, *
-        FROM reservations
-        WHERE date(date_time) >= DATE('now', 'localtime')
-        ORDER BY date_time
+@dataclass
+class ReservationsPage:
+    """Страница выдачи резервов для постраничного вывода"""
+    reservations: List[Reservation]
+    has_previous: bool
+    has_next: bool
+
+
+def show_reservations_page(
+    lower_bound: Optional[str] = None,
+    upper_bound: Optional[str] = None,
+    page_cursor: Optional[Tuple[datetime, int]] = None,
+    backwards: bool = False,
+    limit: int = settings.RESERVES_PAGE_SIZE,
+    table: str = HOT_TABLE,
+    venue: str = settings.DEFAULT_VENUE,
+) -> ReservationsPage:
+    """Функция выводит страницу резервов с date_time в промежутке
+    [lower_bound, upper_bound), отсортированных по (date_time, id).
+    page_cursor - (date_time, id) резерва, от которого отсчитывается страница:
+    следующая страница начинается после него, предыдущая (backwards) - до него.
+    Страница выбирается по индексу, без OFFSET, поэтому время запроса
+    не зависит от того, как далеко пролистан список.
+    table - таблица или представление, из которого выбираются резервы"""
+    conditions = []
+    params = {'limit': limit + 1}
+    if page_cursor is not None:
+        cursor_date_time = page_cursor[0].strftime(settings.DATETIME_DB_FORMAT)
+        out_of_bounds = (
+            (lower_bound is not None and cursor_date_time < lower_bound)
+            or (upper_bound is not None and cursor_date_time >= upper_bound)
+        )
+        if out_of_bounds:
+            # курсор устарел (например, после полуночи) - начинаем сначала
+            page_cursor = None
+            backwards = False
+        else:
+            conditions.append(
+                '(date_time, id) {} (:cursor_date_time, :cursor_id)'.format(
+                    '<' if backwards else '>'
+                )
+            )
+            params['cursor_date_time'] = cursor_date_time
+            params['cursor_id'] = page_cursor[1]
+    # границу, которую уже задает курсор, не дублируем:
+    # иначе SQLite может выбрать для поиска по индексу не её, а курсор
+    if lower_bound is not None and (page_cursor is None or backwards):
+        conditions.append('date_time >= :lower_bound')
+        params['lower_bound'] = lower_bound
+    if upper_bound is not None and (page_cursor is None or not backwards):
+        conditions.append('date_time < :upper_bound')
+        params['upper_bound'] = upper_bound
+
+    reservations = select_reservations(
         """
+        SELECT {columns}
+        FROM {table}
+        {where}
+        ORDER BY date_time {order}, id {order}
+        LIMIT :limit
+        """.format(
+            columns=RESERVATION_COLUMNS,
+            table=table,
+            where='WHERE ' + ' AND '.join(conditions) if conditions else '',
+            order='DESC' if backwards else 'ASC',
+        ),
+        params,
+        venue,
     )
-    return parse_db_to_reservation_class(DB_CURSOR.fetchall())
-
-
-def show_reservations_archive():
-    """Функция выводит все ПРОШЕДШИЕ резервы."""
-    DB_CURSOR.execute(
-         """
-         SELECT rowid, *
-         FROM reservations
-         WHERE date(date_time) < DATE('now', 'localtime')
-         ORDER BY date_time
-         """
+    has_more = len(reservations) > limit
+    reservations = reservations[:limit]
+    if backwards:
+        reservations.reverse()
+        return ReservationsPage(reservations, has_more, True)
+    return ReservationsPage(reservations, page_cursor is not None, has_more)
+
+
+def show_reservations_all(
+    page_cursor: Optional[Tuple[datetime, int]] = None,
+    backwards: bool = False,
+    venue: str = settings.DEFAULT_VENUE,
+) -> ReservationsPage:
+    """Функция выводит страницу БУДУЩИХ резервов."""
+    day_start, _ = day_bounds(date.today())
+    return show_reservations_page(
+        lower_bound=day_start,
+        page_cursor=page_cursor,
+        backwards=backwards,
+        venue=venue,
     )
-    return parse_db_to_reservation_class(DB_CURSOR.fetchall())
 
 
-def show_reservations_today():
+def show_reservations_archive(
+    page_cursor: Optional[Tuple[datetime, int]] = None,
+    backwards: bool = False,
+    venue: str = settings.DEFAULT_VENUE,
+) -> ReservationsPage:
+    """Функция выводит страницу ПРОШЕДШИХ резервов.
+    Читает архив вместе с таблицей актуальных резервов: прошедшие
+    после последнего запуска ночной задачи резервы еще лежат в ней.
+    SQLite сливает отсортированные по индексу выборки из обеих таблиц"""
+    return show_reservations_page(
+        upper_bound=archive_cutoff(),
+        page_cursor=page_cursor,
+        backwards=backwards,
+        table=ALL_RESERVATIONS,
+        venue=venue,
+    )
+
+
+def show_reservations_today(venue: str = settings.DEFAULT_VENUE):
     """Функция выводит строки из бд, где дата соответствует текущей"""
-    DB_CURSOR.execute(
+    return show_reservations_per_date(date.today(), venue)
+
+
+def show_reservations_per_date(passed_date: date, venue: str = settings.DEFAULT_VENUE):
+    """Функция выводит строки из БД,
+    где дата соответствует переданной в функцию.
+    Результат кэшируется по дням до изменения резервов на этот день"""
+    if isinstance(passed_date, datetime):
+        passed_date = passed_date.date()
+    return DAY_CACHE.get_or_load(venue, passed_date, load_reservations_per_date)
+
+
+def load_reservations_per_date(passed_date: date, venue: str = settings.DEFAULT_VENUE):
+    """Функция читает из БД резервы на переданную дату.
+    Прошедшие дни могут быть уже в архиве"""
+    day_start, next_day_start = day_bounds(passed_date)
+    return select_reservations(
         """
-        SELECT rowid, *
-        FROM reservations
-        WHERE date(date_time) = DATE('now', 'localtime')
+        SELECT {}
+        FROM {}
+        WHERE date_time >= :day_start AND date_time < :next_day_start
         ORDER BY date_time
-        """
+        """.format(
+            RESERVATION_COLUMNS,
+            HOT_TABLE if day_start >= archive_cutoff() else ALL_RESERVATIONS,
+        ),
+        {'day_start': day_start, 'next_day_start': next_day_start},
+        venue,
     )
-    results = DB_CURSOR.fetchall()
-    return parse_db_to_reservation_class(results)
 
 
-def show_reservations_per_date(passed_date: datetime):
-    """Функция выводит строки из БД,
-    где дата соответствует переданной в функцию"""
-    DB_CURSOR.execute(
+def unvisited_since(
+    since: datetime, venue: str = settings.DEFAULT_VENUE
+) -> List[Tuple[int, datetime]]:
+    """Функция возвращает id и время визита резервов, гости которых
+    еще не отмечены как пришедшие, с временем визита не раньше since"""
+    rows = get_connection(venue).execute(
         """
-        SELECT rowid, *
+        SELECT id, date_time
         FROM reservations
-        WHERE date(date_time) = DATE(:passed_date)
+        WHERE date_time >= :since AND visited = 0
         ORDER BY date_time
         """,
-        {'passed_date': passed_date.strftime(settings.DATE_DB_FORMAT)}
+        {'since': since.strftime(settings.DATETIME_DB_FORMAT)}
+    )
+    return [
+        (row['id'], datetime.strptime(row['date_time'], settings.DATETIME_DB_FORMAT))
+        for row in rows
+    ]
+
+
+def fts_query(text: str) -> str:
+    """Превращает текст из чата в запрос FTS5: каждое слово ищется
+    как префикс ("иван" найдет "Иванов"), все слова должны встретиться.
+    Слова берутся в кавычки, чтобы операторы FTS5 из текста не выполнялись"""
+    return ' '.join(
+        '"{}"*'.format(word.replace('"', '""')) for word in text.split()
     )
-    results = DB_CURSOR.fetchall()
-    return parse_db_to_reservation_class(results)
 
 
-def add_chat_id(chat_id: int):
-    """Функция записывает id чата в базу данных"""
-    with DB_CONNECTION:
-        DB_CURSOR.execute(
-            "INSERT INTO chats VALUES (:id)", {'id': chat_id}
+def search_reservations(
+    text: str,
+    limit: int = settings.SEARCH_RESULTS_LIMIT,
+    venue: str = settings.DEFAULT_VENUE,
+) -> List[Reservation]:
+    """Функция ищет резервы по имени гостя и деталям (включая архив)
+    и возвращает их в порядке релевантности.
+    Найденные id ищутся в каждой таблице по первичному ключу:
+    соединение с представлением all_reservations SQLite выполнил бы
+    через полную выборку обеих таблиц"""
+    query = fts_query(text)
+    if not query:
+        return []
+    return select_reservations(
+        """
+        WITH found AS MATERIALIZED (
+            SELECT rowid AS reservation_id, rank
+            FROM reservations_fts
+            WHERE reservations_fts MATCH :query
+            ORDER BY rank
+            LIMIT :limit
+        )
+        SELECT {columns}
+        FROM (
+            SELECT {columns}, found.rank
+            FROM found JOIN {hot} ON {hot}.id = found.reservation_id
+            UNION ALL
+            SELECT {columns}, found.rank
+            FROM found JOIN {archive} ON {archive}.id = found.reservation_id
         )
+        ORDER BY rank, date_time DESC
+        """.format(
+            columns=RESERVATION_COLUMNS, hot=HOT_TABLE, archive=ARCHIVE_TABLE
+        ),
+        {'query': query, 'limit': limit},
+        venue,
+    )
+
+
+def add_chat_id(chat_id: int, venue: str = settings.DEFAULT_VENUE):
+    """Функция записывает id чата в основную базу данных,
+    если его там еще нет, с заведением, с которым работает чат"""
+    get_write_connection().execute(
+        "INSERT OR IGNORE INTO chats (id, venue) VALUES (:id, :venue)",
+        {'id': chat_id, 'venue': venue}
+    )
+
+
+def set_chat_venue(chat_id: int, venue: str):
+    """Функция записывает заведение, с которым работает чат"""
+    get_write_connection().execute(
+        """
+        INSERT INTO chats (id, venue) VALUES (:id, :venue)
+        ON CONFLICT (id) DO UPDATE SET venue = excluded.venue
+        """,
+        {'id': chat_id, 'venue': venue}
+    )
+
+
+def delete_chat_id(chat_id: int):
+    """Функция удаляет id чата из базы данных"""
+    get_write_connection().execute(
+        "DELETE FROM chats WHERE id = :id", {'id': chat_id}
+    )
 
 
-def get_chat_id_list() -> List[int]:
-    """Функция выводит из бд ID всех чатов, с которыми общается бот"""
-    DB_CURSOR.execute(
-        "SELECT id, * FROM chats",
+def get_chats() -> List[Tuple[int, Optional[str]]]:
+    """Функция выводит из бд ID всех чатов, с которыми общается бот,
+    и их заведения (None - основное)"""
+    cursor = get_connection().execute(
+        "SELECT id, venue FROM chats",
     )
-    return [dict(chat_id)['id'] for chat_id in DB_CURSOR.fetchall()]
+    return [(chat['id'], chat['venue']) for chat in cursor.fetchall()]
@@ -1,5 +1,6 @@
 import os
-from datetime import datetime
+import re
+from datetime import datetime, time
 from dotenv.main import load_dotenv
 
 
@@ -8,6 +9,66 @@ load_dotenv()
 # IDs
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 ADMIN_TG_ID = int(os.getenv('ADMIN_TG_ID'))
+# Адрес Bot API (например, фейкового из loadtest для нагрузочных тестов)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org/bot')
+
+# Режим получения апдейтов: polling или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Публичный адрес, на который Telegram отправляет апдейты (обычно
+# reverse proxy, проксирующий на HTTP_HOST:HTTP_PORT и WEBHOOK_PATH)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+# Секрет, который Telegram передает в заголовке каждого запроса вебхука
+# (символы A-Z, a-z, 0-9, _ и -)
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN')
+# HTTP-сервер бота: вебхук, /healthz и /metrics.
+# В режиме polling сервер запускается, только если HTTP_PORT не 0
+HTTP_HOST = os.getenv('HTTP_HOST', '127.0.0.1')
+HTTP_PORT = int(os.getenv('HTTP_PORT', 0))
+# Наибольший размер тела запроса к HTTP-серверу в байтах (больше - ответ 413).
+# Апдейты Telegram намного меньше
+HTTP_MAX_BODY_SIZE = int(os.getenv('HTTP_MAX_BODY_SIZE', 1024 * 1024))
+
+# База данных
+DB_PATH = os.getenv('DB_PATH', 'reservations.db')
+# Заведения. Резервы основного заведения хранятся в DB_PATH, там же -
+# чаты с заведением каждого из них и данные бота (bot_persistence).
+# У остальных заведений резервы в отдельных файлах БД (шардах):
+# VENUES=park=park.db,center=center.db
+DEFAULT_VENUE = os.getenv('DEFAULT_VENUE', 'main')
+VENUE_DB_PATHS = dict(
+    (name.strip(), path.strip())
+    for name, _, path in (
+        venue.partition('=') for venue in os.getenv('VENUES', '').split(',')
+    )
+    if name.strip()
+)
+# Имя заведения входит в callback_data кнопок резервов
+# (r:<заведение>:<id>:<действие>), а Telegram ограничивает ее 64 байтами:
+# 20 символов имени + 19 цифр id + 13 символов действия + 5 - не больше 57.
+# Поэтому имя - только латинские буквы, цифры, _ и -, не длиннее 20 символов
+VENUE_NAME_PATTERN = r'[A-Za-z0-9_-]{1,20}'
+for _venue in (DEFAULT_VENUE, *VENUE_DB_PATHS):
+    if not re.fullmatch(VENUE_NAME_PATTERN, _venue):
+        raise ValueError(
+            f'Invalid venue name {_venue!r}: up to 20 characters A-Z, a-z, 0-9, _, -'
+        )
+    if _venue in VENUE_DB_PATHS and not VENUE_DB_PATHS[_venue]:
+        raise ValueError(f'No DB path for venue {_venue!r} in VENUES')
+# Количество потоков, выполняющих запросы к БД (у каждого своё соединение)
+DB_WORKERS = int(os.getenv('DB_WORKERS', 4))
+# Сколько секунд ждать снятия блокировки БД другим соединением
+DB_TIMEOUT = 10
+# Сколько записей, ожидающих в очереди потока записи БД,
+# выполнять одной транзакцией (см. database.DBWriter)
+DB_WRITE_BATCH_SIZE = int(os.getenv('DB_WRITE_BATCH_SIZE', 100))
+# Сколько дней с резервами держать в кэше
+DAY_CACHE_SIZE = 64
+# Сколько отрисованных карточек резервов держать в кэше
+RENDER_CACHE_SIZE = 1024
+# Как часто (в секундах) сбрасывать в БД user_data, chat_data
+# и состояния диалогов. При остановке бота сбрасываются сразу
+PERSISTENCE_UPDATE_INTERVAL = int(os.getenv('PERSISTENCE_UPDATE_INTERVAL', 30))
 
 # Ввода даты и времени
 DATETIME_FORMAT = '%d.%m.%Y %H:%M'
@@ -20,6 +81,78 @@ DATETIME_VALIDATION_FAILED = 'Ой, какая-то странная дата...
 
 # Количество резервов выводимых отдельными сообщениями (больше > формируется список под одним)
 NUMBER_OF_RESERVES_BEFORE_LIST = 3
+# Количество резервов на одной странице списка (кнопки Назад / Вперед)
+RESERVES_PAGE_SIZE = 10
+# Сколько резервов выводить в результатах поиска
+SEARCH_RESULTS_LIMIT = 20
+# Импорт резервов из файла: строк в одной транзакции
+# и сколько ошибок в записях показывать в отчете
+IMPORT_BATCH_SIZE = 1000
+IMPORT_MAX_REPORTED_ERRORS = 10
+# Статистика /stats: период по умолчанию и самый длинный период в днях,
+# и до скольки дней в периоде выводить строку на каждый день
+STATS_DEFAULT_DAYS = 30
+STATS_MAX_DAYS = 366
+STATS_MAX_DAYS_LISTED = 31
+# Формат времени визита в кнопках переключения страниц (лимит callback_data - 64 байта)
+PAGE_CURSOR_FORMAT = '%Y%m%d%H%M'
+
+# Рассылка оповещений
+# Одновременных запросов к Telegram во время рассылки
+BROADCAST_CONCURRENCY = 10
+# Лимиты Telegram: ~30 сообщений в секунду всего и ~1 в секунду в один чат
+BROADCAST_GLOBAL_RATE = 30
+BROADCAST_PER_CHAT_RATE = 1
+# Сколько раз повторять отправку после ответа RetryAfter
+BROADCAST_MAX_RETRIES = 3
+# Сколько сообщений ответа (карточки списка, подтверждения)
+# отправлять в один чат одновременно (см. outbound.py)
+OUTBOUND_PER_CHAT_CONCURRENCY = 4
+# Соединений с Bot API: по умолчанию у PTB одно, и все отправки,
+# включая параллельную рассылку, выстраиваются к нему в очередь
+TELEGRAM_CONNECTION_POOL_SIZE = BROADCAST_CONCURRENCY + OUTBOUND_PER_CHAT_CONCURRENCY
+# Сколько секунд запрос может ждать свободного соединения
+TELEGRAM_POOL_TIMEOUT = 10
+
+# Логи (logs.py): файл, формат text или json,
+# ротация по размеру и в полночь, сколько сжатых файлов хранить
+LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_ROTATE_DAILY = True
+LOG_BACKUP_COUNT = 14
+
+# Границы корзин гистограмм времени в секундах (metrics.py)
+METRICS_LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+
+# Напоминания о визитах (reminders.py)
+# За сколько минут до визита напоминать всем пользователям бота
+REMINDER_MINUTES_BEFORE = int(os.getenv('REMINDER_MINUTES_BEFORE', 60))
+# Через сколько минут после времени визита сообщать, что гости не отмечены
+NO_SHOW_MINUTES_AFTER = int(os.getenv('NO_SHOW_MINUTES_AFTER', 30))
+# Сколько устаревших событий (после изменения или удаления резервов)
+# может накопиться в куче напоминаний до ее очистки
+REMINDER_HEAP_SLACK = 256
+
+# Архив прошедших резервов (archive.py)
+# Во сколько (по местному времени) каждый день переносить их в архив
+ARCHIVE_TIME = time(4, 0)
+# Резервов в одной транзакции переноса
+ARCHIVE_BATCH_SIZE = 1000
+
+# /diag: длительность сбора по умолчанию и наибольшая, секунд
+DIAG_DEFAULT_SECONDS = 30
+DIAG_MAX_SECONDS = 600
+# строк в отчетах /diag
+DIAG_TOP = 40
+# интервал снимков стека цикла событий для /diag sample, секунд
+DIAG_SAMPLE_INTERVAL = 0.005
+# обратные вызовы цикла событий дольше этого попадают в /diag slow, секунд
+DIAG_SLOW_CALLBACK_SECONDS = 0.05
+# глубина стека вызовов, которую запоминает tracemalloc для /diag mem
+DIAG_TRACEMALLOC_FRAMES = 10
 
 # Добавляем новый резерв
 RESERVER_ADDITION_START = 'Добавляем новый резерв. '
@@ -35,6 +168,9 @@ WRONG_DATE_INPUT = """Неверно введена дата!
 Пожалуйста используйте следующий формат: {}
 """.format(datetime.now().strftime('%d.%m.%Y'))
 
+# Поиск
+ASK_FOR_SEARCH_QUERY = 'Введите имя гостя или слово из деталей брони'
+
 # Редактируем резерв
 RESERVE_EDITING_CHOICE = 'Что меняем?'
 
@@ -43,6 +179,8 @@ NOTIFY_ALL_CONFIRMATION = 'Другие пользователи получил
 NOTIFY_ALL_NEW_RESERVE = 'Появилась новая бронь:'
 NOTIFY_ALL_EDIT_RESERVE = 'Изменение в бронировании:'
 NOTIFY_ALL_DELETE_RESERVE = 'Бронирование отменена и удалено из базы данных:'
+REMINDER_MSG = '⏰ Через {minutes} мин. придут гости:'
+NO_SHOW_MSG = '❓ Время визита прошло, а гости не отмечены как пришедшие:'
 
 # buttons
 NEW_RESERVE_BUTTON = 'Новое бронирование'
@@ -51,6 +189,33 @@ ALL_RESERVES_BUTTON = 'Все бронирования'
 ARCHIVE_BUTTON = 'Старые бронирования'
 HELP_BUTTON = 'Справка'
 RESERVES_PER_DATE_BUTTON = 'Брони на конкретную дату'
+SEARCH_BUTTON = 'Поиск'
+
+# Импорт и экспорт (только для администратора)
+EXPORT_USAGE = 'Формат выгрузки: /export csv или /export jsonl'
+EXPORT_CAPTION = 'Выгружено резервов: {}'
+IMPORT_WRONG_FORMAT = 'Для импорта нужен файл .csv или .jsonl'
+IMPORT_RESULT = 'Импортировано резервов: {imported}, пропущено: {skipped}'
+IMPORT_FAILED = 'Импорт прерван ошибкой, подробности в логе бота'
+
+# Статистика
+STATS_USAGE = f'Период статистики в днях: /stats 7 (от 1 до {STATS_MAX_DAYS})'
+STATS_REBUILT = 'Статистика пересчитана'
+VENUE_CURRENT = 'Заведение этого чата: {}'
+VENUE_USAGE = 'Заведения: {}\nСменить заведение чата: /venue <заведение> [id чата]'
+VENUE_CHANGED = 'Чат {chat_id} работает с заведением {venue}'
+VENUE_UNKNOWN = 'Нет такого заведения. Заведения: {}'
+DIAG_USAGE = f"""Диагностика: /diag <команда> [секунд, до {DIAG_MAX_SECONDS}]
+/diag profile 30 - cProfile цикла событий
+/diag sample 30 - сэмплирование стека цикла событий
+/diag slow 30 - долгие обратные вызовы цикла событий
+/diag tasks - задачи asyncio
+/diag mem - снимок памяти и рост с прошлого снимка
+/diag mem stop - выключить отслеживание памяти"""
+DIAG_STARTED = 'Сбор {} на {} с запущен, отчет придет файлом'
+DIAG_BUSY = 'Уже идет сбор {}, дождитесь отчета'
+DIAG_MEMORY_STARTED = 'Отслеживание памяти включено, повторите /diag mem позже, чтобы увидеть рост'
+DIAG_MEMORY_STOPPED = 'Отслеживание памяти выключено'
 
 # errors
 NO_INFO_FOUND = 'Ничего не нашлось :('
@@ -74,6 +239,7 @@ HELP = f"""📖Для добавления бронирования воспол
 "{TODAY_RESERVES_BUTTON}" выведет все бронирования на текущий день.
 "{ALL_RESERVES_BUTTON}" выведет все бронирования, начиная с текущего дня.
 "{ARCHIVE_BUTTON}" выведет все бронирования, с временем визита раньше текущего момента.
+"{SEARCH_BUTTON}" найдет бронирования по имени гостя или словам из деталей, например "Иванов" или "день рождения".
 
 Информацию о резервах можно менять, используя кнопки, прилегающие к сообщению с резервом.
 
@@ -82,6 +248,8 @@ HELP = f"""📖Для добавления бронирования воспол
 🤖 Полезные команды, которые можно отправить боту
 /cancel - прервет диалог о внесении информации по резерву
 /start - выведет приветственное сообщение и кнопки взаимодействия с ботом
+/search <текст> - поиск бронирований по имени гостя и деталям
+/stats [дней] - статистика бронирований и неявок за последние дни (по умолчанию 30)
 
 🕧 Ввод времени визита
 Бот еще совсем маленький и плохо умеет работать с датами и временем.
@@ -119,7 +287,7 @@ MARKDOWN_ESCAPE_SYMBOLS = [
 
 # HTML
 HTML_ESCAPE_SYMBOLS = {
-    '<': '&lt',
-    '>': '&gt',
-    '&': '&amp'
+    '<': '&lt;',
+    '>': '&gt;',
+    '&': '&amp;'
 }
@@ -0,0 +1,167 @@
+"""Статистика резервов для команды /stats.
+
+Отчеты строятся по таблице daily_stats (резервы и пришедшие гости
+по дням и часам визита), которую триггеры на reservations и архиве обновляют
+при каждом добавлении, изменении и удалении резерва. Поэтому отчет
+за год читает не больше 365 * 24 строк, а не всю таблицу резервов.
+
+У каждого заведения своя daily_stats в его БД.
+Пересчитать статистику с нуля (например, после ручной правки БД):
+    python stats.py rebuild --venue main
+"""
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Dict, List, Tuple
+
+import settings
+from database import get_connection, get_write_connection, write
+
+WEEKDAYS = ('Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс')
+# оттенки ячеек тепловой карты, от пустой до самой загруженной
+HEATMAP_SHADES = ' ░▒▓█'
+
+
+def rebuild_daily_stats(venue: str = settings.DEFAULT_VENUE):
+    """Функция пересчитывает daily_stats заведения по резервам, включая архив.
+    Вызывается через database.write или run_in_db_writer"""
+    connection = get_write_connection(venue)
+    connection.execute('DELETE FROM daily_stats')
+    connection.execute(
+        """
+        INSERT INTO daily_stats (day, hour, reservations, visited)
+        SELECT
+            substr(date_time, 1, 10),
+            CAST(substr(date_time, 12, 2) AS integer),
+            count(*),
+            sum(visited != 0)
+        FROM all_reservations
+        GROUP BY 1, 2
+        """
+    )
+
+
+@dataclass
+class StatsReport:
+    """Статистика резервов за период [first_day, last_day]"""
+    first_day: date
+    last_day: date
+    # день -> (резервов, из них гости пришли)
+    per_day: Dict[date, Tuple[int, int]] = field(default_factory=dict)
+    # [день недели][час] -> резервов
+    heatmap: List[List[int]] = field(
+        default_factory=lambda: [[0] * 24 for _ in WEEKDAYS]
+    )
+
+    @property
+    def total(self) -> int:
+        return sum(reservations for reservations, _ in self.per_day.values())
+
+    def no_show_rate(self, today: date) -> Tuple[float, int, int]:
+        """Доля неявок среди резервов прошедших дней:
+        (доля, не пришли, всего прошедших)"""
+        past = [counts for day, counts in self.per_day.items() if day < today]
+        reservations = sum(counts[0] for counts in past)
+        visited = sum(counts[1] for counts in past)
+        if not reservations:
+            return 0.0, 0, 0
+        return (reservations - visited) / reservations, reservations - visited, reservations
+
+    def render_heatmap(self) -> List[str]:
+        """Тепловая карта день недели x час для моноширинного вывода"""
+        hours = [
+            hour for hour in range(24)
+            if any(row[hour] for row in self.heatmap)
+        ]
+        if not hours:
+            return []
+        busiest = max(max(row) for row in self.heatmap)
+        lines = ['   ' + ''.join(f'{hour:>3}' for hour in hours)]
+        for weekday, row in zip(WEEKDAYS, self.heatmap):
+            cells = ''.join(
+                ' ' + HEATMAP_SHADES[
+                    -(-row[hour] * (len(HEATMAP_SHADES) - 1) // busiest)
+                ] * 2
+                for hour in hours
+            )
+            lines.append(f'{weekday} {cells}')
+        return lines
+
+    def render(self, today: date) -> str:
+        """Текст отчета для отправки в чат (HTML)"""
+        title = '<b>Статистика с {} по {}</b>'.format(
+            self.first_day.strftime('%d.%m.%Y'),
+            self.last_day.strftime('%d.%m.%Y'),
+        )
+        if not self.per_day:
+            return f'{title}\n{settings.NO_INFO_FOUND}'
+        days_count = (self.last_day - self.first_day).days + 1
+        rate, no_shows, past = self.no_show_rate(today)
+        lines = [
+            title,
+            f'Резервов: {self.total}, в среднем {self.total / days_count:.1f} в день',
+            f'Неявки: {rate:.0%} ({no_shows} из {past} прошедших)',
+        ]
+        weekday_totals = [sum(row) for row in self.heatmap]
+        lines.append('')
+        lines.append('<b>По дням недели:</b>')
+        lines.extend(
+            f'{weekday}: {count}' for weekday, count in zip(WEEKDAYS, weekday_totals)
+        )
+        if days_count <= settings.STATS_MAX_DAYS_LISTED:
+            lines.append('')
+            lines.append('<b>По дням:</b>')
+            lines.extend(
+                '{}: {} (пришли {})'.format(day.strftime('%d.%m'), *self.per_day[day])
+                for day in sorted(self.per_day)
+            )
+        heatmap = self.render_heatmap()
+        if heatmap:
+            lines.append('')
+            lines.append('<b>По часам визита:</b>')
+            lines.append('<pre>{}</pre>'.format('\n'.join(heatmap)))
+        return '\n'.join(lines)
+
+
+def stats_report(
+    first_day: date, last_day: date, venue: str = settings.DEFAULT_VENUE
+) -> StatsReport:
+    """Функция собирает статистику заведения за период из daily_stats"""
+    report = StatsReport(first_day, last_day)
+    rows = get_connection(venue).execute(
+        """
+        SELECT day, hour, reservations, visited
+        FROM daily_stats
+        WHERE day >= :first_day AND day <= :last_day AND reservations > 0
+        """,
+        {
+            'first_day': first_day.strftime(settings.DATE_DB_FORMAT),
+            'last_day': last_day.strftime(settings.DATE_DB_FORMAT),
+        }
+    )
+    for day, hour, reservations, visited in rows:
+        day = date.fromisoformat(day)
+        day_reservations, day_visited = report.per_day.get(day, (0, 0))
+        report.per_day[day] = (day_reservations + reservations, day_visited + visited)
+        report.heatmap[day.weekday()][hour] += reservations
+    return report
+
+
+def stats_for_last_days(days: int, venue: str = settings.DEFAULT_VENUE) -> StatsReport:
+    """Функция собирает статистику за последние days дней, включая сегодня"""
+    today = date.today()
+    return stats_report(today - timedelta(days=days - 1), today, venue)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Статистика резервов')
+    parser.add_argument('command', choices=('rebuild', 'report'))
+    parser.add_argument('--days', type=int, default=settings.STATS_DEFAULT_DAYS)
+    parser.add_argument('--venue', default=settings.DEFAULT_VENUE)
+    args = parser.parse_args()
+    if args.command == 'rebuild':
+        write(args.venue, rebuild_daily_stats, args.venue)
+        print('daily_stats rebuilt')
+    else:
+        print(stats_for_last_days(args.days, args.venue).render(date.today()))
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# settings читает обязательные переменные окружения при импорте
+os.environ.setdefault('ADMIN_TG_ID', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import settings  # noqa: E402
+from database import close_connection  # noqa: E402
+from day_cache import DAY_CACHE  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Пустая БД основного заведения со всеми миграциями"""
+    path = str(tmp_path / 'reservations.db')
+    monkeypatch.setattr(settings, 'DB_PATH', path)
+    migrate(path)
+    DAY_CACHE.clear()
+    yield path
+    close_connection()
+    DAY_CACHE.clear()
@@ -0,0 +1,32 @@
+from datetime import date
+
+from archive import archive_reservations
+from database import get_connection
+from reservations import ARCHIVE_TABLE, HOT_TABLE, get_reservation, search_reservations
+from stats import stats_report
+
+
+def count(table: str) -> int:
+    return get_connection().execute(f'SELECT count(*) FROM {table}').fetchone()[0]
+
+
+def test_past_reservations_move_to_archive_in_batches(db_path):
+    connection = get_connection()
+    with connection:
+        connection.executemany(
+            f'INSERT INTO {HOT_TABLE} (guest_name, date_time, info, user_added, visited) '
+            "VALUES (?, ?, '', '@staff', 1)",
+            [(f'Гость {day}', f'2029-12-{day:02} 19:00') for day in range(1, 6)]
+            + [('Анна', '2030-01-01 19:00'), ('Олег', '2030-01-02 19:00')]
+        )
+    stats_before = stats_report(date(2029, 12, 1), date(2030, 1, 31))
+
+    assert archive_reservations(before='2030-01-01 00:00', batch_size=2) == 5
+    assert (count(HOT_TABLE), count(ARCHIVE_TABLE)) == (2, 5)
+    assert archive_reservations(before='2030-01-01 00:00', batch_size=2) == 0
+
+    # перенос не считается ни удалением, ни добавлением резерва
+    assert stats_report(date(2029, 12, 1), date(2030, 1, 31)) == stats_before
+    assert [r.guest_name for r in search_reservations('гость 3')] == ['Гость 3']
+    archived_id = search_reservations('гость 3')[0].id
+    assert get_reservation(archived_id).guest_name == 'Гость 3'
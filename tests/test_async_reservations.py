@@ -0,0 +1,61 @@
+import asyncio
+import threading
+import time
+from datetime import datetime
+
+import settings
+from async_reservations import (add_reservation, delete_reservation,
+                                edit_reservation, get_reservation,
+                                show_reservations_per_date)
+from database import run_in_db_thread
+from reservations import Reservation
+
+VENUE = settings.DEFAULT_VENUE
+
+
+def test_db_work_does_not_block_event_loop(db_path):
+    """Пока запрос к БД выполняется в пуле, цикл событий
+    продолжает обрабатывать другие задачи"""
+    def slow_query():
+        time.sleep(0.2)
+        return threading.current_thread().name
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticking = asyncio.create_task(ticker())
+        thread_name = await run_in_db_thread(slow_query)
+        ticking.cancel()
+        return thread_name, ticks
+
+    thread_name, ticks = asyncio.run(main())
+    assert thread_name.startswith('db_worker')
+    assert ticks >= 5
+
+
+def test_async_reservation_roundtrip(db_path):
+    reservation = Reservation(
+        guest_name='Анна',
+        date_time=datetime(2030, 1, 1, 19, 0),
+        info='Стол 1',
+        user_added='@staff',
+    )
+
+    async def main():
+        await add_reservation(VENUE, reservation)
+        stored = await get_reservation(VENUE, reservation.id)
+        stored.guest_name = 'Анна Петрова'
+        await edit_reservation(VENUE, stored)
+        day = await show_reservations_per_date(VENUE, datetime(2030, 1, 1))
+        await delete_reservation(VENUE, stored)
+        return day, await get_reservation(VENUE, reservation.id)
+
+    day, deleted = asyncio.run(main())
+    assert [(r.id, r.guest_name) for r in day] == [(reservation.id, 'Анна Петрова')]
+    assert deleted is None
@@ -0,0 +1,37 @@
+from benchmarks.suite import compare, merge_best, timeit
+
+
+def results(**benchmarks) -> dict:
+    return {'results': {'1000': benchmarks}}
+
+
+def test_compare_uses_best_time_and_measured_spread():
+    baseline = results(
+        quiet={'min_s': 1.0, 'spread': 0.01},
+        noisy={'min_s': 1.0, 'spread': 0.2},
+        writes={'ops_per_s': 100.0, 'spread': 0.01},
+    )
+    current = results(
+        quiet={'min_s': 1.15, 'spread': 0.01},
+        # 50% медленнее, но в пределах трех разбросов (60%)
+        noisy={'min_s': 1.5, 'spread': 0.05},
+        writes={'ops_per_s': 80.0, 'spread': 0.01},
+    )
+    regressions = compare(current, baseline, threshold=0.1)
+    assert sorted(regression['benchmark'] for regression in regressions) == [
+        'quiet', 'writes'
+    ]
+
+
+def test_merge_best_keeps_faster_result():
+    kept = results(query={'min_s': 2.0}, writes={'ops_per_s': 50.0})
+    merge_best(kept, results(query={'min_s': 1.0}, writes={'ops_per_s': 40.0}))
+    assert kept == results(query={'min_s': 1.0}, writes={'ops_per_s': 50.0})
+
+
+def test_fast_functions_are_repeated_within_a_sample():
+    calls = []
+    stats = timeit(lambda: calls.append(1), repeat=3)
+    assert stats['number'] > 1
+    assert len(calls) == 1 + 3 * stats['number']
+    assert stats['min_s'] <= stats['median_s']
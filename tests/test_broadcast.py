@@ -0,0 +1,43 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from telegram import error
+
+import settings
+from broadcast import Broadcaster
+
+
+def fake_bot(send_message) -> SimpleNamespace:
+    return SimpleNamespace(send_message=send_message)
+
+
+def test_last_retry_after_does_not_sleep(monkeypatch):
+    monkeypatch.setattr(settings, 'BROADCAST_MAX_RETRIES', 1)
+    monkeypatch.setattr(settings, 'BROADCAST_PER_CHAT_RATE', 100)
+
+    async def flood(**kwargs):
+        raise error.RetryAfter(0.2)
+
+    started_at = time.monotonic()
+    stats = asyncio.run(Broadcaster().broadcast(fake_bot(flood), [1], 'text'))
+    assert (stats.failed, stats.retries) == (1, 1)
+    # одна пауза перед повтором, после последней попытки бот не ждет
+    assert time.monotonic() - started_at < 0.35
+
+
+def test_idle_chat_buckets_are_evicted(monkeypatch):
+    monkeypatch.setattr(settings, 'BROADCAST_PER_CHAT_RATE', 100)
+
+    async def send(**kwargs):
+        pass
+
+    async def two_broadcasts(broadcaster: Broadcaster):
+        await broadcaster.broadcast(fake_bot(send), range(50), 'text')
+        assert len(broadcaster._chat_buckets) == 50
+        await asyncio.sleep(0.05)
+        await broadcaster.broadcast(fake_bot(send), [], 'text')
+
+    broadcaster = Broadcaster()
+    asyncio.run(two_broadcasts(broadcaster))
+    assert broadcaster._chat_buckets == {}
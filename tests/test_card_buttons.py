@@ -0,0 +1,43 @@
+import asyncio
+import re
+from datetime import datetime
+from types import SimpleNamespace
+
+import bot
+import settings
+from reservations import Reservation
+
+
+def press(callback_data: str):
+    """Нажимает кнопку и возвращает аргументы, с которыми вызван card_action"""
+    async def answer():
+        pass
+
+    update = SimpleNamespace(
+        callback_query=SimpleNamespace(data=callback_data, answer=answer),
+    )
+    return asyncio.run(bot.button(update, SimpleNamespace()))
+
+
+def test_card_buttons_carry_venue_id_and_action(monkeypatch):
+    async def card_action(update, context, venue, reservation_id, action):
+        return venue, reservation_id, action
+
+    monkeypatch.setattr(bot, 'card_action', card_action)
+    reservation = Reservation(
+        guest_name='Анна',
+        date_time=datetime(2030, 1, 1, 19, 0),
+        info='',
+        user_added='@staff',
+        venue='terrace',
+    )
+    reservation.id = 42
+    data = bot.card_callback_data(reservation, 'visited')
+    assert data == 'r:terrace:42:visited'
+    # лимит Telegram на callback_data - 64 байта
+    assert len(data.encode()) <= 64
+    assert re.match(bot.CARD_CALLBACK_PATTERN, data)
+    assert press(data) == ('terrace', 42, 'visited')
+    # кнопки, отправленные до появления заведений
+    assert re.match(bot.CARD_CALLBACK_PATTERN, 'r:7:delete')
+    assert press('r:7:delete') == (settings.DEFAULT_VENUE, 7, 'delete')
@@ -0,0 +1,29 @@
+import asyncio
+
+import settings
+from chat_registry import ChatRegistry
+
+
+def test_registry_changes_survive_reload(db_path):
+    async def main():
+        registry = ChatRegistry()
+        await registry.load()
+        await registry.add(1)
+        await registry.add(2)
+        await registry.add(2)
+        await registry.set_venue(3, 'closed_venue')
+        await registry.remove(1)
+
+        # новый реестр, как после перезапуска бота
+        reloaded = ChatRegistry()
+        await reloaded.load()
+        return registry, reloaded
+
+    registry, reloaded = asyncio.run(main())
+    assert sorted(registry) == [2, 3]
+    assert registry.chats_of('closed_venue') == {3}
+    assert sorted(reloaded) == [2, 3]
+    # заведения closed_venue нет в настройках: чат работает с основным
+    assert reloaded.venue_of(3) == settings.DEFAULT_VENUE
+    assert reloaded.chats_of(settings.DEFAULT_VENUE) == {2, 3}
+    assert 1 not in reloaded and reloaded.venue_of(1) == settings.DEFAULT_VENUE
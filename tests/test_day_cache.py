@@ -0,0 +1,28 @@
+from datetime import date, timedelta
+
+from day_cache import DayCache
+
+DAY = date(2030, 1, 1)
+
+
+def test_invalidation_during_load_keeps_stale_list_out_of_cache():
+    cache = DayCache(maxsize=4)
+
+    def load_and_invalidate(day, venue):
+        cache.invalidate(venue, day)
+        return ['stale']
+
+    assert cache.get_or_load('main', DAY, load_and_invalidate) == ['stale']
+    assert cache.get_or_load('main', DAY, lambda day, venue: ['fresh']) == ['fresh']
+
+
+def test_generations_do_not_outlive_loads():
+    cache = DayCache(maxsize=4)
+    for offset in range(100):
+        day = DAY + timedelta(days=offset)
+        cache.get_or_load('main', day, lambda day, venue: [])
+        cache.invalidate('main', day)
+    cache.get_or_load(
+        'main', DAY, lambda day, venue: cache.invalidate(venue, day) or []
+    )
+    assert cache._generations == {} and cache._loading == {}
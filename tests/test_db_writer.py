@@ -0,0 +1,27 @@
+import sqlite3
+import threading
+
+import pytest
+
+import database
+from database import DBWriter, DBWriterStoppedException
+
+
+def test_writer_that_failed_to_start_fails_queued_and_new_writes(monkeypatch, tmp_path):
+    can_fail = threading.Event()
+
+    def broken_connect(*args, **kwargs):
+        can_fail.wait()
+        raise sqlite3.OperationalError('unable to open database file')
+
+    monkeypatch.setattr(database.sqlite3, 'connect', broken_connect)
+    writer = DBWriter(str(tmp_path / 'reservations.db'))
+    queued = writer.submit(print, 'never runs')
+    can_fail.set()
+    writer.thread.join()
+
+    with pytest.raises(DBWriterStoppedException) as stopped:
+        queued.result(timeout=1)
+    assert isinstance(stopped.value.__cause__, sqlite3.OperationalError)
+    with pytest.raises(DBWriterStoppedException):
+        writer.submit(print, 'too late')
@@ -0,0 +1,30 @@
+import asyncio
+import tracemalloc
+from types import SimpleNamespace
+
+import pytest
+
+from diag import Diagnostics
+
+
+@pytest.fixture
+def application():
+    yield SimpleNamespace(
+        chat_data={}, user_data={}, bot=SimpleNamespace(callback_data_cache=None)
+    )
+    tracemalloc.stop()
+
+
+def test_memory_report_when_tracemalloc_was_already_tracing(application):
+    """tracemalloc включен до первого /diag mem (например, PYTHONTRACEMALLOC)"""
+    diagnostics = Diagnostics(
+        top=10, sample_interval=0.01, slow_callback=0.1, tracemalloc_frames=1
+    )
+    tracemalloc.start()
+
+    async def first_report() -> str:
+        assert diagnostics.memory_start(application)
+        assert not diagnostics.memory_start(application)
+        return await diagnostics.memory_report(application)
+
+    assert 'Рост по строкам:' in asyncio.run(first_report())
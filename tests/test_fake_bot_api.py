@@ -0,0 +1,35 @@
+import asyncio
+
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+
+from loadtest.fake_bot_api import FakeBotAPI
+
+
+def test_real_bot_talks_to_fake_api():
+    """PTB-бот получает апдейты и отправляет сообщения через фейковый API,
+    а тот записывает вызовы и отдает нажатия кнопок"""
+    async def main():
+        api = FakeBotAPI()
+        await api.start()
+        try:
+            async with Bot('123:abc', base_url=api.base_url) as bot:
+                api.send_text(7, '/start')
+                (update,) = await bot.get_updates(timeout=1)
+                await bot.send_message(
+                    7, 'Резерв',
+                    reply_markup=InlineKeyboardMarkup(
+                        [[InlineKeyboardButton('Гости пришли', callback_data='r:1:visited')]]
+                    ),
+                )
+                call = await api.wait_for(7, lambda call: call.method == 'sendMessage')
+                callback_data = api.find_button(call.params['message_id'], 'Гости пришли')
+                api.press_button(7, call.params['message_id'], callback_data)
+                (press,) = await bot.get_updates(offset=update.update_id + 1, timeout=1)
+                return update, call, press
+        finally:
+            await api.stop()
+
+    update, call, press = asyncio.run(main())
+    assert update.message.text == '/start' and update.message.chat_id == 7
+    assert call.params['text'] == 'Резерв'
+    assert press.callback_query.data == 'r:1:visited'
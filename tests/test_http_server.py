@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from http_server import HTTPResponse, HTTPServer
+
+SECRET = 'secret'
+
+
+def check_headers(request):
+    if request.headers.get('x-token') != SECRET:
+        return HTTPResponse(403, b'Forbidden')
+    return None
+
+
+async def echo(request):
+    return HTTPResponse(200, request.body)
+
+
+async def exchange(raw: bytes, max_body_size: int = 16) -> bytes:
+    """Отправляет серверу сырой запрос и возвращает все, что он ответил
+    до закрытия соединения"""
+    server = HTTPServer(echo, max_body_size=max_body_size, check_headers=check_headers)
+    await server.start()
+    try:
+        reader, writer = await asyncio.open_connection(server.host, server.port)
+        writer.write(raw)
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+        return response
+    finally:
+        await server.stop()
+
+
+def request(length: str, token: str = SECRET, body: bytes = b'',
+            connection: str = 'close') -> bytes:
+    return (
+        f'POST /hook HTTP/1.1\r\nX-Token: {token}\r\n'
+        f'Content-Length: {length}\r\nConnection: {connection}\r\n\r\n'
+    ).encode() + body
+
+
+def test_body_within_limit_is_read():
+    response = asyncio.run(exchange(request('5', body=b'hello')))
+    assert response.startswith(b'HTTP/1.1 200 ')
+    assert response.endswith(b'\r\n\r\nhello')
+
+
+@pytest.mark.parametrize('length', ['-1', 'abc', '1e3', ''])
+def test_bad_content_length(length):
+    response = asyncio.run(exchange(request(length)))
+    assert response.startswith(b'HTTP/1.1 400 ')
+
+
+def test_too_large_body_is_not_read():
+    # тело не отправлено: сервер отвечает, не дожидаясь его
+    response = asyncio.run(exchange(request('17', connection='keep-alive')))
+    assert response.startswith(b'HTTP/1.1 413 ')
+    assert b'Connection: close' in response
+
+
+def test_headers_checked_before_body():
+    # объявлено большое тело без токена: отказ по токену, тело не читается
+    response = asyncio.run(
+        exchange(request('1000000', token='wrong', connection='keep-alive'))
+    )
+    assert response.startswith(b'HTTP/1.1 403 ')
+    assert b'Connection: close' in response
@@ -0,0 +1,64 @@
+import json
+
+from database import get_connection
+from import_export import IMPORT_USER_ADDED, import_reservations
+
+
+def write_jsonl(path, records):
+    with open(path, 'w', encoding='utf-8') as file:
+        for record in records:
+            file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def imported_rows():
+    return [
+        tuple(row) for row in get_connection().execute(
+            'SELECT guest_name, date_time, info, user_added, visited '
+            'FROM all_reservations ORDER BY id'
+        )
+    ]
+
+
+def test_bad_fields_are_skipped_and_good_records_imported(db_path, tmp_path):
+    """Запись с полем не того типа пропускается с ошибкой в отчете,
+    хорошие записи из той же пачки попадают в БД"""
+    path = str(tmp_path / 'mixed.jsonl')
+    write_jsonl(path, [
+        {'guest_name': 'Анна', 'date_time': '01.01.2030 19:00', 'info': 'Стол 1'},
+        {'guest_name': 'Борис', 'date_time': '01.01.2030 20:00', 'info': {'table': 2}},
+        {'guest_name': 'Вера', 'date_time': '02.01.2030 19:00', 'user_added': 42},
+        {'guest_name': 'Глеб', 'date_time': '02.01.2030 20:00', 'visited': 2},
+        {'guest_name': 'Дина', 'date_time': '03.01.2030 19:00', 'visited': True},
+    ])
+
+    result = import_reservations(path)
+
+    assert result.imported == 2
+    assert result.skipped == 3
+    assert [error.split(':')[0] for error in result.errors] == [
+        'record 2', 'record 3', 'record 4'
+    ]
+    assert imported_rows() == [
+        ('Анна', '2030-01-01 19:00', 'Стол 1', IMPORT_USER_ADDED, 0),
+        ('Дина', '2030-01-03 19:00', '', IMPORT_USER_ADDED, 1),
+    ]
+
+
+def test_csv_visited_flag(db_path, tmp_path):
+    """В CSV все поля - строки: visited 0/1 принимается, остальное - нет"""
+    path = str(tmp_path / 'bookings.csv')
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(
+            'guest_name,date_time,info,user_added,visited\n'
+            'Анна,01.01.2030 19:00,Стол 1,@staff,1\n'
+            'Борис,01.01.2030 20:00,,,\n'
+            'Вера,01.01.2030 21:00,,,да\n'
+        )
+
+    result = import_reservations(path)
+
+    assert (result.imported, result.skipped) == (2, 1)
+    assert imported_rows() == [
+        ('Анна', '2030-01-01 19:00', 'Стол 1', '@staff', 1),
+        ('Борис', '2030-01-01 20:00', '', IMPORT_USER_ADDED, 0),
+    ]
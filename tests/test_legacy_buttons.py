@@ -0,0 +1,76 @@
+import asyncio
+import re
+from datetime import datetime
+from types import SimpleNamespace
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ExtBot
+
+import bot
+import settings
+from database import write
+from persistence import CALLBACK_DATA, SQLitePersistence, write_batch
+from reservations import Reservation
+
+
+def pre_013_keyboards():
+    """Клавиатуры карточки и списка в том виде, в каком их отправлял бот
+    с arbitrary_callback_data: PTB подменяет callback_data на uuid
+    и возвращает данные для сохранения в persistence"""
+    cache = ExtBot('123:abc', arbitrary_callback_data=True).callback_data_cache
+    card = cache.process_keyboard(InlineKeyboardMarkup([
+        [InlineKeyboardButton('Гости пришли', callback_data='visited')],
+        [
+            InlineKeyboardButton('Удалить бронь', callback_data='delete_reservation'),
+            InlineKeyboardButton('Изменить бронь', callback_data='edit_reservation'),
+        ],
+    ]))
+    reservation = Reservation(
+        guest_name='Анна',
+        date_time=datetime(2030, 1, 1, 19, 0),
+        info='',
+        user_added='@staff',
+    )
+    reservation.id = 42
+    listing = cache.process_keyboard(InlineKeyboardMarkup([
+        [InlineKeyboardButton('Анна', callback_data=reservation)],
+    ]))
+    return card, listing, cache.persistence_data
+
+
+def press(callback_data: str, message_id: int, chat_data: dict):
+    """Нажимает кнопку и возвращает аргументы, с которыми вызван card_action"""
+    async def answer():
+        pass
+
+    update = SimpleNamespace(
+        callback_query=SimpleNamespace(data=callback_data, answer=answer),
+        effective_message=SimpleNamespace(id=message_id),
+    )
+    context = SimpleNamespace(
+        chat_data=chat_data,
+        application=SimpleNamespace(persistence=SQLitePersistence()),
+    )
+    return asyncio.run(bot.legacy_card_button(update, context))
+
+
+def test_pre_013_buttons_resolve_through_persisted_callback_data(db_path, monkeypatch):
+    card, listing, persistence_data = pre_013_keyboards()
+    write(None, write_batch, {(CALLBACK_DATA, ''): persistence_data})
+
+    async def card_action(update, context, venue, reservation_id, action):
+        return venue, reservation_id, action
+
+    monkeypatch.setattr(bot, 'card_action', card_action)
+    visited, (delete, edit) = (row for row in card.inline_keyboard)
+    visited = visited[0].callback_data
+    assert re.match(bot.LEGACY_CARD_CALLBACK_PATTERN, visited)
+    chat_data = {'msg_reservation': {10: 7}}
+
+    assert press(visited, 10, chat_data) == (settings.DEFAULT_VENUE, 7, 'visited')
+    assert press(edit.callback_data, 10, chat_data) == (settings.DEFAULT_VENUE, 7, 'edit')
+    assert press(listing.inline_keyboard[0][0].callback_data, 11, {}) == (
+        settings.DEFAULT_VENUE, 42, 'show'
+    )
+    # кнопка, данных которой в кэше нет
+    assert press('0' * 64, 10, chat_data)[2] is None
@@ -0,0 +1,42 @@
+import gzip
+import json
+import logging
+
+from logs import CompressingRotatingFileHandler, ContextFilter, JsonFormatter, log_context
+
+
+def record(message: str) -> logging.LogRecord:
+    return logging.LogRecord('bot', logging.INFO, __file__, 1, message, (), None)
+
+
+def test_json_records_carry_chat_and_handler_of_the_update():
+    context_filter = ContextFilter()
+    with log_context(chat_id=10, handler='start'):
+        inside = record('Резерв добавлен')
+        context_filter.filter(inside)
+    outside = record('Бот запущен')
+    context_filter.filter(outside)
+
+    entry = json.loads(JsonFormatter().format(inside))
+    assert entry['message'] == 'Резерв добавлен'
+    assert (entry['chat_id'], entry['handler']) == (10, 'start')
+    assert 'chat_id' not in json.loads(JsonFormatter().format(outside))
+
+
+def test_rotated_logs_are_gzipped(tmp_path):
+    path = tmp_path / 'bot.log'
+    handler = CompressingRotatingFileHandler(
+        str(path), max_bytes=100, backup_count=2, daily=True
+    )
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    try:
+        handler.emit(record('первая запись'))
+        # наступила полночь
+        handler.rollover_at = 0
+        handler.emit(record('вторая запись'))
+    finally:
+        handler.close()
+
+    with gzip.open(tmp_path / 'bot.log.1.gz', 'rt', encoding='utf-8') as rotated:
+        assert rotated.read() == 'первая запись\n'
+    assert path.read_text(encoding='utf-8') == 'вторая запись\n'
@@ -0,0 +1,45 @@
+import asyncio
+
+from telegram.ext import CommandHandler, ConversationHandler
+
+from metrics import MetricsRegistry, instrument_handler
+
+
+def test_exposition_has_cumulative_buckets_and_escaped_labels():
+    registry = MetricsRegistry()
+    latency = registry.histogram('latency_seconds', 'Время', ('handler',), buckets=(0.1, 1))
+    errors = registry.counter('errors_total', 'Ошибки', ('method',))
+    for value in (0.05, 0.5, 0.5, 5):
+        latency.observe(value, 'start')
+    errors.inc('send"Message')
+
+    assert registry.render() == [
+        '# HELP latency_seconds Время',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{handler="start",le="0.1"} 1',
+        'latency_seconds_bucket{handler="start",le="1"} 3',
+        'latency_seconds_bucket{handler="start",le="+Inf"} 4',
+        'latency_seconds_sum{handler="start"} 6.050000',
+        'latency_seconds_count{handler="start"} 4',
+        '# HELP errors_total Ошибки',
+        '# TYPE errors_total counter',
+        'errors_total{method="send\\"Message"} 1',
+    ]
+
+
+def test_handler_shared_between_states_is_timed_once():
+    calls = []
+
+    async def start(update, context):
+        calls.append(update)
+        return 'done'
+
+    shared = CommandHandler('start', start)
+    conversation = ConversationHandler(
+        entry_points=[shared], states={1: [shared], 2: [shared]}, fallbacks=[]
+    )
+    instrument_handler(conversation)
+
+    assert shared.callback.timed and shared.callback.__wrapped__ is start
+    assert asyncio.run(shared.callback(None, None)) == 'done'
+    assert calls == [None]
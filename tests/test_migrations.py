@@ -0,0 +1,41 @@
+import sqlite3
+
+from migrations import MIGRATIONS, get_schema_version, migrate
+
+
+def test_baseline_db_is_migrated_without_losing_rows(tmp_path):
+    """БД исходной схемы (без ключей и user_version) получает
+    id резервов, индекс по времени визита и уникальные id чатов"""
+    path = str(tmp_path / 'reservations.db')
+    connection = sqlite3.connect(path)
+    connection.executescript(MIGRATIONS[1])
+    with connection:
+        connection.executemany(
+            'INSERT INTO reservations VALUES (?, ?, ?, ?, ?)',
+            [
+                ('Анна', '2030-01-01 19:00', 'Стол 1', '@staff', 0),
+                ('Иван', '2030-01-02 20:00', '', '@staff', 1),
+            ]
+        )
+        connection.executemany(
+            'INSERT INTO chats VALUES (?)', [(1,), (1,), (None,), (2,)]
+        )
+    connection.close()
+
+    assert migrate(path) == max(MIGRATIONS)
+    # повторный запуск ничего не меняет
+    assert migrate(path) == max(MIGRATIONS)
+
+    connection = sqlite3.connect(path)
+    assert get_schema_version(connection) == max(MIGRATIONS)
+    assert connection.execute(
+        'SELECT id, guest_name, date_time, visited FROM all_reservations ORDER BY id'
+    ).fetchall() == [(1, 'Анна', '2030-01-01 19:00', 0), (2, 'Иван', '2030-01-02 20:00', 1)]
+    assert connection.execute('SELECT id FROM chats ORDER BY id').fetchall() == [(1,), (2,)]
+    indexes = {
+        row[0] for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"
+        )
+    }
+    assert 'reservations_date_time_idx' in indexes
+    connection.close()
@@ -0,0 +1,80 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from outbound import OutboundPipeline
+
+
+def test_stages_are_sent_in_order():
+    """Следующий этап не начинается, пока не отправлен предыдущий,
+    даже если его сообщения отправляются дольше"""
+    sent = []
+
+    async def send(text: str, delay: float):
+        await asyncio.sleep(delay)
+        sent.append(text)
+        return text
+
+    async def main():
+        return await OutboundPipeline(per_chat_concurrency=4).send(
+            1,
+            *([send(f'card {number}', 0.03 - number * 0.01)] for number in range(3)),
+            [send('saved', 0.01)],
+            [send('notified', 0)],
+        )
+
+    results = asyncio.run(main())
+    expected = ['card 0', 'card 1', 'card 2', 'saved', 'notified']
+    assert sent == expected
+    assert [stage[0] for stage in results] == expected
+
+
+def test_stage_is_sent_concurrently_up_to_the_chat_cap():
+    running = 0
+    peak = 0
+
+    async def send(number: int):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return number
+
+    async def main():
+        return await OutboundPipeline(per_chat_concurrency=3).send(
+            1, [send(number) for number in range(6)]
+        )
+
+    assert asyncio.run(main()) == [list(range(6))]
+    assert peak == 3
+
+
+def test_cards_share_one_stage_after_header(monkeypatch):
+    """Заголовок - первым этапом, все карточки списка - вторым"""
+    import bot
+    from reservations import Reservation
+
+    # вместо отправки - текст сообщения
+    monkeypatch.setattr(
+        bot, 'send_message', lambda update, context, text, *args, **kwargs: text
+    )
+    visit = datetime(2030, 1, 1, 19, 0)
+    reservations = [
+        Reservation(
+            guest_name=f'Гость {number}',
+            date_time=visit + timedelta(hours=number),
+            info='',
+            user_added='@staff',
+        )
+        for number in range(3)
+    ]
+    for number, reservation in enumerate(reservations, start=1):
+        reservation.id = number
+        reservation.venue = 'main'
+
+    stages = bot.reservations_messages(None, None, reservations)
+
+    assert stages == [
+        ['Вот что я нашел:'],
+        [reservation.reserve_card() for reservation in reservations],
+    ]
@@ -0,0 +1,49 @@
+from datetime import date, datetime, timedelta
+
+import settings
+from database import get_connection
+from reservations import HOT_TABLE, show_reservations_all
+
+
+def fill_future(count: int):
+    """Будущие резервы, по три на одно время визита:
+    порядок внутри времени задает id"""
+    first_visit = datetime.combine(date.today(), datetime.min.time()) + timedelta(days=1, hours=19)
+    connection = get_connection()
+    with connection:
+        connection.executemany(
+            f'INSERT INTO {HOT_TABLE} (guest_name, date_time, info, user_added, visited) '
+            "VALUES (?, ?, '', '@staff', 0)",
+            [
+                (
+                    f'Гость {number}',
+                    (first_visit + timedelta(hours=number // 3)).strftime(
+                        settings.DATETIME_DB_FORMAT
+                    ),
+                )
+                for number in range(count)
+            ]
+        )
+
+
+def cursor_of(reservation):
+    return reservation.date_time, reservation.id
+
+
+def test_pages_cover_every_reservation_once_in_both_directions(db_path):
+    fill_future(25)
+    pages = [show_reservations_all()]
+    while pages[-1].has_next:
+        pages.append(show_reservations_all(cursor_of(pages[-1].reservations[-1])))
+
+    assert [len(page.reservations) for page in pages] == [10, 10, 5]
+    assert [(page.has_previous, page.has_next) for page in pages] == [
+        (False, True), (True, True), (True, False)
+    ]
+    listed = [cursor_of(r) for page in pages for r in page.reservations]
+    assert listed == sorted(listed) and len(set(listed)) == 25
+
+    # назад от первого резерва последней страницы - вторая страница
+    previous = show_reservations_all(cursor_of(pages[2].reservations[0]), backwards=True)
+    assert [r.id for r in previous.reservations] == [r.id for r in pages[1].reservations]
+    assert (previous.has_previous, previous.has_next) == (True, True)
@@ -0,0 +1,32 @@
+import asyncio
+
+from persistence import SQLitePersistence
+
+
+def test_batched_state_survives_restart(db_path):
+    async def save():
+        persistence = SQLitePersistence(update_interval=60)
+        await persistence.update_user_data(1, {'step': 'date'})
+        await persistence.update_chat_data(10, {'venue': 'main'})
+        await persistence.update_chat_data(11, {'stale': True})
+        await persistence.drop_chat_data(11)
+        await persistence.update_conversation('addreserve', (10, 1), 2)
+        await persistence.update_bot_data({'version': 3})
+        await persistence.flush()
+
+    async def load():
+        # новый экземпляр, как после перезапуска бота
+        persistence = SQLitePersistence()
+        return (
+            await persistence.get_user_data(),
+            await persistence.get_chat_data(),
+            await persistence.get_conversations('addreserve'),
+            await persistence.get_bot_data(),
+        )
+
+    asyncio.run(save())
+    user_data, chat_data, conversations, bot_data = asyncio.run(load())
+    assert user_data == {1: {'step': 'date'}}
+    assert chat_data == {10: {'venue': 'main'}}
+    assert conversations == {(10, 1): 2}
+    assert bot_data == {'version': 3}
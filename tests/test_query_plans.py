@@ -0,0 +1,108 @@
+"""Выборки резервов должны идти по индексу времени визита
+(EXPLAIN QUERY PLAN), а не перебирать таблицу целиком"""
+import re
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from database import get_connection
+from reservations import (ARCHIVE_TABLE, HOT_TABLE, load_reservations_per_date,
+                          show_reservations_all, show_reservations_archive,
+                          show_reservations_today)
+
+HOT_INDEX = 'reservations_date_time_idx'
+ARCHIVE_INDEX = 'reservations_archive_date_time_idx'
+
+
+@pytest.fixture
+def filled_db(db_path):
+    """БД с резервами в прошлом (в архиве) и в будущем"""
+    connection = get_connection()
+    rows = [
+        (f'Гость {days}', (datetime.combine(date.today(), datetime.min.time())
+                           + timedelta(days=days, hours=19)).strftime('%Y-%m-%d %H:%M'))
+        for days in range(-30, 30)
+    ]
+    with connection:
+        for table, selected in (
+            (ARCHIVE_TABLE, rows[:30]),
+            (HOT_TABLE, rows[30:]),
+        ):
+            connection.executemany(
+                f'INSERT INTO {table} (guest_name, date_time, info, user_added, visited) '
+                "VALUES (?, ?, '', '@staff', 0)",
+                selected
+            )
+    return db_path
+
+
+@contextmanager
+def captured_selects():
+    """Собирает SELECT-запросы (с подставленными параметрами),
+    выполненные соединением текущего потока"""
+    statements = []
+    connection = get_connection()
+    connection.set_trace_callback(
+        lambda sql: statements.append(sql)
+        if sql.lstrip().upper().startswith('SELECT') else None
+    )
+    try:
+        yield statements
+    finally:
+        connection.set_trace_callback(None)
+
+
+def query_plan(sql: str) -> str:
+    return '\n'.join(
+        row['detail']
+        for row in get_connection().execute('EXPLAIN QUERY PLAN ' + sql)
+    )
+
+
+def assert_searches(sql: str, *indexes: str):
+    plan = query_plan(sql)
+    for index in indexes:
+        assert re.search(rf'^SEARCH .* USING (COVERING )?INDEX {index} ', plan, re.M), plan
+    for line in plan.splitlines():
+        assert not line.startswith('SCAN'), plan
+
+
+@pytest.mark.parametrize('select', [
+    pytest.param(show_reservations_today, id='today'),
+    pytest.param(show_reservations_all, id='all'),
+    pytest.param(
+        lambda: show_reservations_all(
+            (datetime.combine(date.today(), datetime.min.time()), 0)
+        ),
+        id='all-next-page',
+    ),
+    pytest.param(
+        lambda: load_reservations_per_date(date.today() + timedelta(days=3)),
+        id='per-date',
+    ),
+])
+def test_hot_table_queries_use_index(filled_db, select):
+    """Сегодня, все будущие и будущая дата - по индексу таблицы
+    актуальных резервов"""
+    with captured_selects() as statements:
+        assert select()
+    assert len(statements) == 1
+    assert re.search(rf'FROM {HOT_TABLE}\s', statements[0]), statements[0]
+    assert_searches(statements[0], HOT_INDEX)
+
+
+@pytest.mark.parametrize('select', [
+    pytest.param(show_reservations_archive, id='archive'),
+    pytest.param(
+        lambda: load_reservations_per_date(date.today() - timedelta(days=3)),
+        id='past-date',
+    ),
+])
+def test_archive_queries_use_both_indexes(filled_db, select):
+    """Прошедшие резервы читаются из архива и таблицы актуальных резервов,
+    в обеих - по индексу"""
+    with captured_selects() as statements:
+        assert select()
+    assert len(statements) == 1
+    assert_searches(statements[0], HOT_INDEX, ARCHIVE_INDEX)
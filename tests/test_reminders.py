@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from reminders import NO_SHOW, REMIND, ReminderScheduler
+from reservations import Reservation
+
+
+class FakeJobQueue:
+    """Запоминает задачи вместо запуска"""
+
+    def __init__(self):
+        self.jobs = []
+
+    def run_once(self, callback, when, name=None):
+        job = SimpleNamespace(when=when, removed=False)
+        job.schedule_removal = lambda: setattr(job, 'removed', True)
+        self.jobs.append(job)
+        return job
+
+
+def reservation(reservation_id: int, date_time: datetime) -> Reservation:
+    result = Reservation(
+        guest_name='Анна', date_time=date_time, info='', user_added='@staff'
+    )
+    result.id = reservation_id
+    return result
+
+
+def test_heap_skips_stale_events_and_rearms_only_for_earlier_ones():
+    scheduler = ReminderScheduler(
+        'main', remind_before=timedelta(hours=1), no_show_after=timedelta(minutes=30)
+    )
+    job_queue = FakeJobQueue()
+    scheduler._job_queue = job_queue
+    visit = datetime.now().replace(microsecond=0) + timedelta(days=1)
+
+    scheduler.update(reservation(1, visit))
+    assert len(job_queue.jobs) == 1
+    # более позднее событие задачу не переставляет
+    scheduler.update(reservation(2, visit + timedelta(hours=2)))
+    assert len(job_queue.jobs) == 1
+    # перенос визита на раньше переставляет задачу, старые события устаревают
+    scheduler.update(reservation(1, visit - timedelta(hours=3)))
+    assert len(job_queue.jobs) == 2 and job_queue.jobs[0].removed
+    # гости второго резерва пришли
+    visited = reservation(2, visit + timedelta(hours=2))
+    visited.visited = True
+    scheduler.update(visited)
+
+    due = scheduler._due_events(visit + timedelta(days=1))
+    assert [(event[1], event[2]) for event in due] == [(1, REMIND), (1, NO_SHOW)]
+    assert due[0][0] == visit - timedelta(hours=4)
+    assert scheduler._heap == [] and scheduler._visits == {}
@@ -0,0 +1,39 @@
+from datetime import datetime
+
+from bot import reservations_keyboard
+from reservations import Reservation
+
+
+def make_reservation(info: str, guest_name: str = 'Анна') -> Reservation:
+    return Reservation(
+        guest_name=guest_name,
+        date_time=datetime(2030, 1, 1, 19, 0),
+        info=info,
+        user_added='@staff',
+    )
+
+
+def test_preview_keeps_info_indentation():
+    """Превью, как и раньше, не выравнивает отступы в деталях резерва"""
+    preview = make_reservation('  Стол 1\n  у окна').reserve_preview()
+    assert preview.endswith('\n  Стол 1\n  у окна\n')
+
+
+def test_preview_blanks_whitespace_only_lines():
+    preview = make_reservation('Стол 1\n  \t\nу окна').reserve_preview()
+    assert preview.endswith('\nСтол 1\n\nу окна\n')
+
+
+def test_card_dedents_info():
+    card = make_reservation('  Стол 1\n  у окна').reserve_card()
+    assert '\nСтол 1\nу окна\n' in card
+
+
+def test_button_label_and_log_line_keep_raw_guest_name():
+    """Текст кнопки и логи - не HTML, экранировать в них нечего"""
+    reservation = make_reservation('', guest_name='Tom & Jerry <VIP>')
+    reservation.id = 1
+    label = reservations_keyboard([reservation]).inline_keyboard[0][0].text
+    assert label == '01.01.2030 19:00 | Tom & Jerry <VIP> | ❌'
+    assert reservation.reserve_line() == '01.01.2030 19:00 | Tom & Jerry <VIP> | 0'
+    assert 'Tom &amp; Jerry &lt;VIP&gt;' in reservation.reserve_card()
@@ -0,0 +1,34 @@
+import pickle
+from datetime import datetime
+
+import settings
+from reservations import Reservation
+
+
+def make_reservation() -> Reservation:
+    reservation = Reservation(
+        guest_name='Анна',
+        date_time=datetime(2030, 1, 1, 19, 0),
+        info='Стол 1',
+        user_added='@staff',
+    )
+    reservation.id = 7
+    return reservation
+
+
+def test_pickle_roundtrip_keeps_venue():
+    reservation = make_reservation()
+    reservation.venue = 'park'
+    restored = pickle.loads(pickle.dumps(reservation, pickle.HIGHEST_PROTOCOL))
+    assert (restored.id, restored.venue, restored.date_time) == (
+        7, 'park', datetime(2030, 1, 1, 19, 0)
+    )
+
+
+def test_reservation_pickled_before_venues_gets_default_venue():
+    """В user_data, сохраненных до появления заведений, у резерва нет venue"""
+    reservation = make_reservation()
+    del reservation.venue
+    restored = pickle.loads(pickle.dumps(reservation, pickle.HIGHEST_PROTOCOL))
+    assert restored.venue == settings.DEFAULT_VENUE
+    assert restored.reserve_card() == make_reservation().reserve_card()
@@ -0,0 +1,43 @@
+import sqlite3
+from datetime import datetime
+
+import settings
+from reservations import (RESERVATION_COLUMNS, Reservation,
+                          parse_db_to_reservation_class, select_reservations)
+
+ROW = (5, 'Анна', '2030-01-01 19:00', 'Стол 1', '@staff', 1)
+
+
+def test_row_becomes_slotted_reservation_with_lazy_date_time():
+    reservation = Reservation.from_db_row(ROW)
+    assert not hasattr(reservation, '__dict__')
+    # время визита разбирается только при обращении
+    assert reservation._date_time is None
+    assert reservation == Reservation(
+        id=5,
+        guest_name='Анна',
+        date_time=datetime(2030, 1, 1, 19, 0),
+        info='Стол 1',
+        user_added='@staff',
+        visited=1,
+    )
+    assert reservation._date_time == datetime(2030, 1, 1, 19, 0)
+
+
+def test_sqlite_rows_map_to_reservations(db_path):
+    connection = sqlite3.connect(db_path)
+    with connection:
+        connection.execute(
+            'INSERT INTO reservations (id, guest_name, date_time, info, user_added, visited) '
+            'VALUES (?, ?, ?, ?, ?, ?)', ROW
+        )
+    connection.row_factory = sqlite3.Row
+    rows = connection.execute(f'SELECT {RESERVATION_COLUMNS} FROM reservations').fetchall()
+    connection.close()
+
+    expected = Reservation.from_db_row(ROW)
+    assert parse_db_to_reservation_class(rows) == [expected]
+    selected = select_reservations(
+        f'SELECT {RESERVATION_COLUMNS} FROM reservations WHERE id = :id', {'id': 5}
+    )
+    assert selected == [expected] and selected[0].venue == settings.DEFAULT_VENUE
@@ -0,0 +1,31 @@
+from datetime import datetime
+
+import settings
+from database import write
+from reservations import Reservation, add_reservation, search_reservations
+
+
+def add(guest_name: str, info: str = '') -> Reservation:
+    reservation = Reservation(
+        guest_name=guest_name,
+        date_time=datetime(2030, 1, 1, 19, 0),
+        info=info,
+        user_added='@staff',
+    )
+    write(settings.DEFAULT_VENUE, add_reservation, reservation)
+    return reservation
+
+
+def test_search_matches_word_prefixes_of_name_and_info(db_path):
+    add('Иван Петров', 'у окна')
+    add('Мария Иванова', 'день рождения')
+    add('Олег', 'торт')
+
+    found = {r.guest_name for r in search_reservations('иван')}
+    assert found == {'Иван Петров', 'Мария Иванова'}
+    # все слова запроса должны встретиться
+    assert [r.guest_name for r in search_reservations('иван окн')] == ['Иван Петров']
+    assert [r.guest_name for r in search_reservations('торт')] == ['Олег']
+    # операторы FTS5 из текста не выполняются
+    assert search_reservations('иван OR "олег') == []
+    assert search_reservations('   ') == []
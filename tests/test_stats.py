@@ -0,0 +1,35 @@
+from datetime import date
+
+import settings
+from database import get_connection, write
+from reservations import HOT_TABLE
+from stats import rebuild_daily_stats, stats_report
+
+
+def test_triggers_keep_daily_stats_in_sync_with_reservations(db_path):
+    connection = get_connection()
+    with connection:
+        connection.executemany(
+            f'INSERT INTO {HOT_TABLE} (guest_name, date_time, info, user_added, visited) '
+            "VALUES (?, ?, '', '@staff', 0)",
+            [
+                ('Анна', '2030-01-07 19:00'),
+                ('Олег', '2030-01-07 19:30'),
+                ('Мария', '2030-01-07 21:00'),
+                ('Иван', '2030-01-08 12:00'),
+            ]
+        )
+        connection.execute(f"UPDATE {HOT_TABLE} SET visited = 1 WHERE guest_name = 'Анна'")
+        connection.execute(f"DELETE FROM {HOT_TABLE} WHERE guest_name = 'Мария'")
+
+    report = stats_report(date(2030, 1, 1), date(2030, 1, 31))
+    assert report.per_day == {date(2030, 1, 7): (2, 1), date(2030, 1, 8): (1, 0)}
+    # 07.01.2030 - понедельник
+    assert report.heatmap[0][19] == 2 and report.heatmap[1][12] == 1
+    assert report.total == 3
+    assert report.no_show_rate(date(2030, 2, 1)) == (2 / 3, 2, 3)
+    assert 'Резервов: 3' in report.render(date(2030, 2, 1))
+
+    # пересчет с нуля дает то же, что поддерживали триггеры
+    write(settings.DEFAULT_VENUE, rebuild_daily_stats)
+    assert stats_report(date(2030, 1, 1), date(2030, 1, 31)) == report
@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from reservations import Reservation
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_settings(**env) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, '-c', 'import settings'],
+        cwd=ROOT,
+        env={**os.environ, 'ADMIN_TG_ID': '0', **env},
+        capture_output=True,
+        text=True,
+    )
+
+
+@pytest.mark.parametrize('env', [
+    {'VENUES': 'кафе=cafe.db'},
+    {'VENUES': 'park:1=park.db'},
+    {'VENUES': 'a' * 21 + '=long.db'},
+    {'VENUES': 'park'},
+    {'DEFAULT_VENUE': 'main venue'},
+])
+def test_invalid_venue_settings_rejected(env):
+    result = import_settings(**env)
+    assert result.returncode != 0
+    assert 'ValueError' in result.stderr
+
+
+def test_valid_venues_accepted():
+    assert import_settings(VENUES='park=park.db, center-2 = center.db').returncode == 0
+
+
+def test_longest_card_callback_data_fits_telegram_limit():
+    """callback_data кнопки резерва с самым длинным допустимым именем
+    заведения, id и действием не длиннее 64 байт"""
+    from bot import CARD_ACTIONS, card_callback_data
+
+    reservation = Reservation(
+        guest_name='Гость', date_time=None, info='', user_added='@staff'
+    )
+    reservation.id = 2 ** 63 - 1
+    reservation.venue = 'v' * 20
+    assert all(
+        len(card_callback_data(reservation, action).encode()) <= 64
+        for action in CARD_ACTIONS
+    )